@@ -0,0 +1,538 @@
+import os
+
+# Every worker process owns its own ONNXRuntime session, so keep the
+# per-process thread pools small and let the process pool scale instead.
+os.environ.setdefault("MKL_NUM_THREADS", "1")
+os.environ.setdefault("NUMEXPR_NUM_THREADS", "1")
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+
+import argparse
+import importlib
+import importlib.resources as pkg_resources
+import logging
+import multiprocessing
+import os.path as osp
+import sys
+import time
+
+import natsort
+import yaml
+
+from anylabeling.configs import auto_labeling as auto_labeling_configs
+
+# Model type -> (module, class) for all models that can run without
+# user interaction (SAM-like models need marks from the canvas)
+MODEL_CLASSES = {
+    "yolov5": ("yolov5", "YOLOv5"),
+    "yolov6": ("yolov6", "YOLOv6"),
+    "yolov7": ("yolov7", "YOLOv7"),
+    "yolov8": ("yolov8", "YOLOv8"),
+    "yolov8_seg": ("yolov8_seg", "YOLOv8_Seg"),
+    "yolox": ("yolox", "YOLOX"),
+    "yolo_nas": ("yolo_nas", "YOLO_NAS"),
+    "yolov5_cls": ("yolov5_cls", "YOLOv5_CLS"),
+    "yolov6_face": ("yolov6_face", "YOLOv6Face"),
+    "rtdetr": ("rtdetr", "RTDETR"),
+    "yolox_dwpose": ("yolox_dwpose", "YOLOX_DWPose"),
+    "clrnet": ("clrnet", "CLRNet"),
+    "ppocr_v4": ("ppocr_v4", "PPOCRv4"),
+    "yolov5_sam": ("yolov5_sam", "YOLOv5SegmentAnything"),
+}
+
+# Model type -> (module, class) for models with an image encoder whose
+# embeddings can be precomputed
+EMBEDDING_MODEL_CLASSES = {
+    "segment_anything": ("segment_anything", "SegmentAnything"),
+    "sam_med2d": ("sam_med2d", "SAM_Med2D"),
+    "yolov5_sam": ("yolov5_sam", "YOLOv5SegmentAnything"),
+}
+
+IMAGE_EXTENSIONS = (
+    ".bmp",
+    ".jpeg",
+    ".jpg",
+    ".png",
+    ".tif",
+    ".tiff",
+    ".webp",
+)
+
+# Model instance of the current worker process
+_worker_model = None
+
+
+def load_model_config(config):
+    """Load model config from a yaml file or a built-in config name"""
+    if osp.isfile(config):
+        with open(config, "r", encoding="utf-8") as f:
+            model_config = yaml.safe_load(f)
+        model_config["config_file"] = osp.normpath(osp.abspath(config))
+        return model_config
+
+    # Built-in config: ":/yolov5s.yaml", "yolov5s.yaml" or a model name
+    # listed in models.yaml
+    config_file_name = config[2:] if config.startswith(":/") else config
+    with pkg_resources.open_text(auto_labeling_configs, "models.yaml") as f:
+        model_list = yaml.safe_load(f)
+    for model in model_list:
+        if model["model_name"] == config:
+            config_file_name = model["config_file"][2:]
+            break
+    try:
+        with pkg_resources.open_text(
+            auto_labeling_configs, config_file_name
+        ) as f:
+            model_config = yaml.safe_load(f)
+    except FileNotFoundError as e:
+        raise FileNotFoundError(f"Config file not found: {config}") from e
+    model_config["config_file"] = ":/" + config_file_name
+    return model_config
+
+
+def create_model(model_config, on_message=None):
+    """Create model instance from model config"""
+    model_type = model_config.get("type")
+    model_classes = {**EMBEDDING_MODEL_CLASSES, **MODEL_CLASSES}
+    if model_type not in model_classes:
+        raise ValueError(
+            f"Model type is not supported in batch mode: {model_type}"
+        )
+    module_name, class_name = model_classes[model_type]
+    module = importlib.import_module(
+        f"anylabeling.services.auto_labeling.{module_name}"
+    )
+    if on_message is None:
+        on_message = logging.info
+    return getattr(module, class_name)(model_config, on_message=on_message)
+
+
+def scan_all_images(folder_path):
+    """Scan all images in a folder (recursively)"""
+    images = []
+    for root, _, files in os.walk(folder_path):
+        for file in files:
+            if file.lower().endswith(IMAGE_EXTENSIONS):
+                images.append(osp.join(root, file))
+    return natsort.os_sorted(images)
+
+
+def get_label_file(image_file, image_dir, output_dir=None):
+    """Get label file path of an image"""
+    label_file = osp.splitext(image_file)[0] + ".json"
+    if output_dir:
+        label_file = osp.join(output_dir, osp.relpath(label_file, image_dir))
+    return label_file
+
+
+def format_shape(shape):
+    """Convert a shape to LabelFile format"""
+    data = shape.other_data.copy()
+    data.update(
+        {
+            "label": shape.label,
+            "text": shape.text,
+            "points": [(p.x(), p.y()) for p in shape.points],
+            "group_id": shape.group_id,
+            "shape_type": shape.shape_type,
+            "flags": shape.flags,
+        }
+    )
+    return data
+
+
+def _init_worker(model_config, num_threads):
+    """Create one model (and one ONNXRuntime session) per worker process"""
+    from anylabeling.services.auto_labeling.model_cache import (
+        model_artifact_cache,
+    )
+
+    global _worker_model
+    os.environ["OMP_NUM_THREADS"] = str(num_threads)
+    # Models map OMP_NUM_THREADS to inter-op threads only, the intra-op
+    # pool would otherwise use all cores in every worker
+    model_artifact_cache.num_threads = max(1, int(num_threads))
+    _worker_model = create_model(model_config)
+
+
+def _save_result(image_file, label_file, image_size, result):
+    """Save auto labeling result to a label file"""
+    from anylabeling.views.labeling.label_file import LabelFile
+
+    # Some models return an empty list instead of a result on error
+    shapes = getattr(result, "shapes", result) or []
+    label_dir = osp.dirname(label_file)
+    if label_dir and not osp.exists(label_dir):
+        os.makedirs(label_dir, exist_ok=True)
+    LabelFile().save(
+        filename=label_file,
+        shapes=[format_shape(shape) for shape in shapes],
+        image_path=osp.relpath(image_file, label_dir or "."),
+        image_height=image_size[1],
+        image_width=image_size[0],
+        other_data={"text": ""},
+    )
+    return len(shapes)
+
+
+def _predict_worker(tasks):
+    """Run model on a batch of images and save results to label files"""
+    from anylabeling.services.auto_labeling import slicing
+    from anylabeling.services.auto_labeling.model import Model
+
+    outputs = []
+    images = []
+    for image_file, label_file in tasks:
+        # Large images with a windowed reader are read tile by tile,
+        # without decoding the whole image
+        if _worker_model.use_sliced_inference(None, image_file):
+            images.append(None)
+            try:
+                result = _worker_model.predict_shapes_sliced(None, image_file)
+                num_shapes = _save_result(
+                    image_file,
+                    label_file,
+                    slicing.get_image_size(None, image_file),
+                    result,
+                )
+            except Exception as e:  # noqa
+                outputs.append((image_file, None, str(e)))
+                continue
+            outputs.append((image_file, num_shapes, None))
+            continue
+        image = Model.load_image_from_filename(image_file)
+        if image is None:
+            outputs.append((image_file, None, "Could not read image"))
+        images.append(image)
+    valid = [i for i, image in enumerate(images) if image is not None]
+
+    try:
+        results = _worker_model.predict_shapes_batch(
+            [images[i] for i in valid], [tasks[i][0] for i in valid]
+        )
+    except Exception as e:  # noqa
+        outputs.extend((tasks[i][0], None, str(e)) for i in valid)
+        return outputs
+
+    for i, result in zip(valid, results):
+        image_file, label_file = tasks[i]
+        try:
+            num_shapes = _save_result(
+                image_file,
+                label_file,
+                (images[i].width(), images[i].height()),
+                result,
+            )
+        except Exception as e:  # noqa
+            outputs.append((image_file, None, str(e)))
+            continue
+        outputs.append((image_file, num_shapes, None))
+    return outputs
+
+
+def run_batch(
+    model_config,
+    image_files,
+    image_dir,
+    output_dir=None,
+    num_workers=1,
+    num_threads=1,
+    overwrite=False,
+):
+    """Run auto labeling over image files with a pool of worker processes"""
+    tasks = []
+    for image_file in image_files:
+        label_file = get_label_file(image_file, image_dir, output_dir)
+        if not overwrite and osp.exists(label_file):
+            continue
+        tasks.append((image_file, label_file))
+    skipped = len(image_files) - len(tasks)
+    if skipped:
+        logging.info("Skip %d images which already have labels", skipped)
+    if not tasks:
+        return 0, 0
+
+    # Images are sent to workers in batches of the model's batch size
+    batch_size = max(1, int(model_config.get("batch_size", 1)))
+    batches = [
+        tasks[i : i + batch_size] for i in range(0, len(tasks), batch_size)
+    ]
+    num_workers = max(1, min(num_workers, len(batches)))
+    num_done = num_failed = 0
+    start_time = time.time()
+    # Spawn instead of fork: ONNXRuntime and Qt are not fork-safe
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(
+        num_workers,
+        initializer=_init_worker,
+        initargs=(model_config, num_threads),
+    ) as pool:
+        for outputs in pool.imap_unordered(_predict_worker, batches):
+            for image_file, num_shapes, error in outputs:
+                num_done += 1
+                if error is not None:
+                    num_failed += 1
+                    logging.warning("Failed %s: %s", image_file, error)
+                else:
+                    logging.debug("%s: %d shapes", image_file, num_shapes)
+                if num_done % 100 == 0 or num_done == len(tasks):
+                    elapsed = time.time() - start_time
+                    logging.info(
+                        "Processed %d/%d images (%.2f images/s)",
+                        num_done,
+                        len(tasks),
+                        num_done / max(elapsed, 1e-6),
+                    )
+    return num_done, num_failed
+
+
+def precompute(model_config, image_files, num_sessions, num_threads):
+    """Precompute image embeddings. Returns the exit code."""
+    from anylabeling.services.auto_labeling.precompute import (
+        precompute_embeddings,
+    )
+
+    try:
+        model = create_model(model_config)
+    except Exception as e:  # noqa
+        logging.error("Could not load model: %s", e)
+        return 1
+    if model.embedding_store is None:
+        logging.error("Embedding cache is disabled for this model")
+        return 1
+
+    def on_progress(done, total):
+        if done % 10 == 0 or done == total:
+            logging.info("Precomputed %d/%d embeddings", done, total)
+
+    start_time = time.time()
+    encoders = model.create_encoders(num_sessions, num_threads)
+    num_done, num_failed = precompute_embeddings(
+        model.embedding_store,
+        encoders,
+        image_files,
+        on_progress=on_progress,
+    )
+    logging.info(
+        "Finished in %.1fs: %d embeddings, %d failed",
+        time.time() - start_time,
+        num_done - num_failed,
+        num_failed,
+    )
+    return 1 if num_failed else 0
+
+
+def check_embedding_dtype(model_config, image_files, dtype, points_per_side=4):
+    """Compare the masks decoded from compressed image embeddings with the
+    masks decoded from float32 embeddings, for a grid of point prompts.
+    Returns the exit code."""
+    import numpy as np
+
+    from anylabeling.services.auto_labeling.embedding_compression import (
+        compress_embedding,
+        decompress_embedding,
+    )
+    from anylabeling.services.auto_labeling.model import Model
+    from anylabeling.views.labeling.utils.opencv import qt_img_to_rgb_cv_img
+
+    try:
+        model = create_model(model_config)
+    except Exception as e:  # noqa
+        logging.error("Could not load model: %s", e)
+        return 1
+
+    def _to_mask(roi, offset, size):
+        mask = np.zeros(size, dtype=bool)
+        if roi is not None:
+            x, y = offset
+            mask[y : y + roi.shape[0], x : x + roi.shape[1]] = roi > 0
+        return mask
+
+    ious = []
+    for image_file in image_files:
+        image = Model.load_image_from_filename(image_file)
+        if image is None:
+            logging.warning("Could not read image: %s", image_file)
+            continue
+        embedding = model.model.encode(qt_img_to_rgb_cv_img(image, image_file))
+        compressed = decompress_embedding(compress_embedding(embedding, dtype))
+        size = embedding["original_size"]
+        image_ious = []
+        for i in range(points_per_side):
+            for j in range(points_per_side):
+                marks = [
+                    {
+                        "type": "point",
+                        "data": [
+                            (j + 0.5) * size[1] / points_per_side,
+                            (i + 0.5) * size[0] / points_per_side,
+                        ],
+                        "label": 1,
+                    }
+                ]
+                reference = _to_mask(
+                    *model.model.predict_mask_roi(embedding, marks), size
+                )
+                mask = _to_mask(
+                    *model.model.predict_mask_roi(compressed, marks), size
+                )
+                union = np.logical_or(reference, mask).sum()
+                intersection = np.logical_and(reference, mask).sum()
+                image_ious.append(intersection / union if union else 1.0)
+        logging.info(
+            "%s: mask IoU mean %.4f, min %.4f",
+            image_file,
+            np.mean(image_ious),
+            np.min(image_ious),
+        )
+        ious.extend(image_ious)
+
+    if not ious:
+        logging.error("No image could be checked")
+        return 1
+    logging.info(
+        "%s embeddings: mask IoU mean %.4f, min %.4f over %d masks",
+        dtype,
+        np.mean(ious),
+        np.min(ious),
+        len(ious),
+    )
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run auto labeling on a folder of images without GUI"
+    )
+    parser.add_argument(
+        "--model",
+        "-m",
+        required=True,
+        help=(
+            "model config: path to a yaml file, a built-in config file "
+            "(e.g. :/yolov5s.yaml) or a model name in models.yaml"
+        ),
+    )
+    parser.add_argument(
+        "--images", "-i", required=True, help="image file or directory"
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        default=None,
+        help="output directory for label files (default: next to images)",
+    )
+    parser.add_argument(
+        "--workers",
+        "-j",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of worker processes (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="number of ONNXRuntime threads per worker (default: 1)",
+    )
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="overwrite existing label files",
+    )
+    parser.add_argument(
+        "--precompute-embeddings",
+        action="store_true",
+        help=(
+            "only precompute image embeddings of a SAM-like model into "
+            "the embedding cache (one encoder session per worker)"
+        ),
+    )
+    parser.add_argument(
+        "--check-embedding-dtype",
+        choices=["float16", "int8"],
+        default=None,
+        help=(
+            "only compare the masks of a SAM-like model decoded from "
+            "image embeddings compressed to this dtype (see embedding_dtype "
+            "in the model config) with the masks of float32 embeddings"
+        ),
+    )
+    parser.add_argument(
+        "--logger-level",
+        default="info",
+        choices=["debug", "info", "warning", "fatal", "error"],
+        help="logger level",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=getattr(logging, args.logger_level.upper()),
+        format="%(asctime)s %(levelname)s %(message)s",
+    )
+
+    try:
+        model_config = load_model_config(args.model)
+    except Exception as e:  # noqa
+        logging.error("Could not load model config: %s", e)
+        sys.exit(1)
+    supported_classes = (
+        EMBEDDING_MODEL_CLASSES
+        if args.precompute_embeddings or args.check_embedding_dtype
+        else MODEL_CLASSES
+    )
+    if model_config.get("type") not in supported_classes:
+        logging.error(
+            "Model type is not supported in batch mode: %s",
+            model_config.get("type"),
+        )
+        sys.exit(1)
+
+    if osp.isdir(args.images):
+        image_dir = args.images
+        image_files = scan_all_images(args.images)
+    elif osp.isfile(args.images):
+        image_dir = osp.dirname(args.images)
+        image_files = [args.images]
+    else:
+        logging.error("Image file or directory not found: %s", args.images)
+        sys.exit(1)
+    logging.info("Found %d images", len(image_files))
+
+    if args.check_embedding_dtype:
+        sys.exit(
+            check_embedding_dtype(
+                model_config, image_files, args.check_embedding_dtype
+            )
+        )
+    if args.precompute_embeddings:
+        sys.exit(
+            precompute(model_config, image_files, args.workers, args.threads)
+        )
+
+    # Download model files once in the main process, so that workers
+    # do not race for the same files
+    try:
+        create_model(model_config).unload()
+    except Exception as e:  # noqa
+        logging.error("Could not load model: %s", e)
+        sys.exit(1)
+
+    num_done, num_failed = run_batch(
+        model_config,
+        image_files,
+        image_dir,
+        output_dir=args.output,
+        num_workers=args.workers,
+        num_threads=args.threads,
+        overwrite=args.overwrite,
+    )
+    logging.info(
+        "Finished: %d images labeled, %d failed",
+        num_done - num_failed,
+        num_failed,
+    )
+    sys.exit(1 if num_failed else 0)
+
+
+if __name__ == "__main__":
+    main()
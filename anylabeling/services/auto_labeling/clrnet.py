@@ -13,6 +13,7 @@ from anylabeling.app_info import __preferred_device__
 from anylabeling.views.labeling.shape import Shape
 from anylabeling.views.labeling.utils.opencv import qt_img_to_rgb_cv_img
 from .model import Model
+from .model_cache import create_inference_session
 from .types import AutoLabelingResult
 
 
@@ -59,7 +60,7 @@ class CLRNet(Model):
         if __preferred_device__ == "GPU":
             self.providers = ['CUDAExecutionProvider']
 
-        self.net = ort.InferenceSession(
+        self.net = create_inference_session(
                         model_abs_path, 
                         providers=self.providers,
                         sess_options=self.sess_opts,
@@ -0,0 +1,306 @@
+"""Resumable model downloader with parallel chunks and integrity checks."""
+
+import hashlib
+import http.client
+import json
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+
+
+class DownloadError(Exception):
+    """Download failed or the downloaded file is invalid"""
+
+
+class DownloadCancelled(DownloadError):
+    """Download stopped by the user"""
+
+
+class Downloader:
+    """Download a file over HTTP(S).
+
+    The file is written to ``<output_path>.part`` and renamed when it is
+    complete and its SHA-256 digest matches the expected one. When the
+    server supports HTTP range requests, the file is downloaded in
+    parallel chunks and the progress of each chunk is saved to
+    ``<output_path>.part.json``, so an interrupted download resumes where
+    it stopped.
+    """
+
+    CHUNK_SIZE = 8 * 1024 * 1024
+    BLOCK_SIZE = 256 * 1024
+    # Save the progress of the chunks at most every n seconds
+    SAVE_STATE_INTERVAL = 1.0
+
+    def __init__(
+        self,
+        num_connections=4,
+        max_retries=5,
+        timeout=60,
+        on_progress=None,
+        is_stopped=None,
+    ):
+        self.num_connections = max(1, int(num_connections))
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.on_progress = on_progress
+        self.is_stopped = is_stopped
+        self.lock = threading.Lock()
+
+    def download(self, url, output_path, sha256=None):
+        """Download url to output_path. Raises DownloadError on failure."""
+        part_path = output_path + ".part"
+        state_path = part_path + ".json"
+        size, etag, accept_ranges = self.get_remote_info(url)
+
+        state = None
+        if size is not None and accept_ranges:
+            state = self.load_state(state_path, url, size, etag)
+            if state is None or not os.path.isfile(part_path):
+                state = self.create_state(url, size, etag)
+                with open(part_path, "wb") as f:
+                    f.truncate(size)
+            self.download_chunks(url, part_path, state_path, state)
+        else:
+            # No range requests: download from the start in one stream
+            self.download_stream(url, part_path, size)
+
+        if sha256:
+            digest = self.get_sha256(part_path)
+            if digest.lower() != sha256.lower():
+                self.remove(part_path, state_path)
+                raise DownloadError(
+                    f"Checksum mismatch for {url}: "
+                    f"expected {sha256}, got {digest}"
+                )
+        os.replace(part_path, output_path)
+        self.remove(state_path)
+        return output_path
+
+    def open(self, url, headers=None):
+        request = urllib.request.Request(url, headers=headers or {})
+        return urllib.request.urlopen(request, timeout=self.timeout)
+
+    def get_remote_info(self, url):
+        """Return (size, etag, accept_ranges) of a remote file"""
+        try:
+            # A 1-byte range request tells both the size and whether
+            # ranges are supported, also for servers not handling HEAD
+            with self.open(url, {"Range": "bytes=0-0"}) as response:
+                etag = response.headers.get("ETag") or response.headers.get(
+                    "Last-Modified"
+                )
+                if response.status == 206:
+                    content_range = response.headers.get("Content-Range", "")
+                    total = content_range.rpartition("/")[2]
+                    if total.isdigit():
+                        return int(total), etag, True
+                length = response.headers.get("Content-Length")
+                size = int(length) if length and length.isdigit() else None
+                return size, etag, False
+        except (urllib.error.URLError, OSError) as e:
+            raise DownloadError(f"Could not connect to {url}: {e}") from e
+
+    @classmethod
+    def create_state(cls, url, size, etag):
+        return {
+            "url": url,
+            "size": size,
+            "etag": etag,
+            # [start, end (exclusive), downloaded bytes]
+            "chunks": [
+                [start, min(start + cls.CHUNK_SIZE, size), 0]
+                for start in range(0, size, cls.CHUNK_SIZE)
+            ],
+        }
+
+    @staticmethod
+    def load_state(state_path, url, size, etag):
+        """Load the state of an interrupted download of the same file"""
+        try:
+            with open(state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (
+            state.get("url") != url
+            or state.get("size") != size
+            or state.get("etag") != etag
+        ):
+            return None
+        return state
+
+    def save_state(self, state_path, state):
+        tmp_path = state_path + ".tmp"
+        with self.lock:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(state, f)
+            os.replace(tmp_path, state_path)
+
+    def report_progress(self, downloaded, total):
+        if self.on_progress is not None:
+            self.on_progress(downloaded, total)
+
+    def check_stopped(self):
+        if self.is_stopped is not None and self.is_stopped():
+            raise DownloadCancelled("Download cancelled")
+
+    def download_chunks(self, url, part_path, state_path, state):
+        """Download the missing parts of the chunks in parallel"""
+        size = state["size"]
+        chunks = [c for c in state["chunks"] if c[0] + c[2] < c[1]]
+        progress = {
+            "downloaded": sum(c[2] for c in state["chunks"]),
+            "saved_at": time.monotonic(),
+        }
+        self.report_progress(progress["downloaded"], size)
+        pending = iter(chunks)
+        errors = []
+
+        def _on_data(chunk, num_bytes):
+            with self.lock:
+                chunk[2] += num_bytes
+                progress["downloaded"] += num_bytes
+                downloaded = progress["downloaded"]
+                save = (
+                    time.monotonic() - progress["saved_at"]
+                    > self.SAVE_STATE_INTERVAL
+                )
+                if save:
+                    progress["saved_at"] = time.monotonic()
+            if save:
+                self.save_state(state_path, state)
+            self.report_progress(downloaded, size)
+
+        def _worker():
+            # Unbuffered, so the saved progress never covers data lost
+            # in a buffer when the app is killed
+            with open(part_path, "r+b", buffering=0) as f:
+                while not errors:
+                    with self.lock:
+                        chunk = next(pending, None)
+                    if chunk is None:
+                        return
+                    try:
+                        self.download_chunk(url, f, chunk, _on_data)
+                    except Exception as e:  # noqa
+                        errors.append(e)
+
+        threads = [
+            threading.Thread(target=_worker, daemon=True)
+            for _ in range(min(self.num_connections, len(chunks)))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.save_state(state_path, state)
+        if errors:
+            if isinstance(errors[0], DownloadError):
+                raise errors[0]
+            raise DownloadError(f"Could not download {url}: {errors[0]}")
+
+    def download_chunk(self, url, f, chunk, on_data):
+        """Download the rest of a chunk, retrying on connection errors"""
+        start, end, _ = chunk
+        retries = 0
+        while start + chunk[2] < end:
+            self.check_stopped()
+            offset = start + chunk[2]
+            headers = {"Range": f"bytes={offset}-{end - 1}"}
+            try:
+                with self.open(url, headers) as response:
+                    if response.status != 206:
+                        raise DownloadError(
+                            f"Server does not support range requests: {url}"
+                        )
+                    while offset < end:
+                        self.check_stopped()
+                        data = response.read(
+                            min(self.BLOCK_SIZE, end - offset)
+                        )
+                        if not data:
+                            raise ConnectionError(
+                                "Connection closed before the end of the "
+                                "chunk"
+                            )
+                        f.seek(offset)
+                        f.write(data)
+                        offset += len(data)
+                        on_data(chunk, len(data))
+            except (
+                urllib.error.URLError,
+                http.client.HTTPException,
+                OSError,
+            ) as e:
+                retries += 1
+                if retries > self.max_retries:
+                    raise DownloadError(
+                        f"Could not download {url}: {e}"
+                    ) from e
+                logging.warning(
+                    "Download of %s interrupted (%s), retrying...", url, e
+                )
+                time.sleep(min(2**retries, 30))
+
+    def download_stream(self, url, part_path, size):
+        """Download a file in one stream, from the start"""
+        retries = 0
+        while True:
+            self.check_stopped()
+            downloaded = 0
+            try:
+                with self.open(url) as response, open(part_path, "wb") as f:
+                    while True:
+                        self.check_stopped()
+                        data = response.read(self.BLOCK_SIZE)
+                        if not data:
+                            break
+                        f.write(data)
+                        downloaded += len(data)
+                        self.report_progress(downloaded, size)
+                if size is None or downloaded == size:
+                    return
+                raise DownloadError(
+                    f"Incomplete download of {url}: "
+                    f"{downloaded} of {size} bytes"
+                )
+            except DownloadCancelled:
+                raise
+            except (
+                urllib.error.URLError,
+                http.client.HTTPException,
+                OSError,
+                DownloadError,
+            ) as e:
+                retries += 1
+                if retries > self.max_retries:
+                    self.remove(part_path)
+                    if isinstance(e, DownloadError):
+                        raise
+                    raise DownloadError(
+                        f"Could not download {url}: {e}"
+                    ) from e
+                logging.warning(
+                    "Download of %s interrupted (%s), retrying...", url, e
+                )
+                time.sleep(min(2**retries, 30))
+
+    @staticmethod
+    def get_sha256(path):
+        sha256 = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                sha256.update(block)
+        return sha256.hexdigest()
+
+    @staticmethod
+    def remove(*paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
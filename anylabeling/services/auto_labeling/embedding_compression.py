@@ -0,0 +1,44 @@
+"""Compact in-memory storage of the image embeddings of SAM-like models."""
+
+import numpy as np
+
+# float32: no compression, float16: half the size, int8: a quarter of the
+# size with one scale per channel
+EMBEDDING_DTYPES = ("float32", "float16", "int8")
+
+
+def compress_embedding(embedding, dtype="float32"):
+    """Copy of an embedding (as returned by encode()) whose image
+    embedding is stored as the given dtype"""
+    if dtype == "float32":
+        return embedding
+    image_embedding = embedding["image_embedding"]
+    if dtype == "float16":
+        compressed = image_embedding.astype(np.float16)
+    elif dtype == "int8":
+        # Symmetric quantization with one scale per channel (axis 1)
+        axes = tuple(i for i in range(image_embedding.ndim) if i != 1)
+        scales = np.abs(image_embedding).max(axis=axes, keepdims=True) / 127
+        scales = np.maximum(scales, np.finfo(np.float32).tiny).astype(
+            np.float32
+        )
+        values = np.clip(np.round(image_embedding / scales), -127, 127)
+        compressed = {"values": values.astype(np.int8), "scales": scales}
+    else:
+        raise ValueError(f"Unsupported embedding dtype: {dtype}")
+    return {**embedding, "image_embedding": compressed}
+
+
+def decompress_embedding(embedding):
+    """Embedding with a float32 image embedding, for the decoder"""
+    image_embedding = embedding["image_embedding"]
+    if isinstance(image_embedding, dict):
+        image_embedding = (
+            image_embedding["values"].astype(np.float32)
+            * image_embedding["scales"]
+        )
+    elif image_embedding.dtype != np.float32:
+        image_embedding = image_embedding.astype(np.float32)
+    else:
+        return embedding
+    return {**embedding, "image_embedding": image_embedding}
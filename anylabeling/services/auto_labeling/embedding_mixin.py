@@ -0,0 +1,146 @@
+"""Image embedding caches of the SAM-like models."""
+
+import logging
+
+from .embedding_compression import (
+    EMBEDDING_DTYPES,
+    compress_embedding,
+    decompress_embedding,
+)
+from .embedding_store import EmbeddingStore
+from .lru_cache import embedding_cache, get_nbytes
+from .precompute import clone_encoders
+
+
+class EmbeddingMixin:
+    """Caches of the image embeddings of a SAM-like model, a Model whose
+    self.model encodes images (see precompute.clone_encoders).
+
+    Embeddings are kept in the memory cache shared by all models,
+    compressed to embedding_dtype, and in the on-disk embedding store at
+    full precision.
+    """
+
+    # Config fields changing the image embeddings of an encoder, part of
+    # the identity of the encoder in the embedding store
+    EMBEDDING_CONFIG_NAMES = (
+        "type",
+        "input_size",
+        "max_width",
+        "max_height",
+        "target_size",
+    )
+    # Number of next files preloaded before the size of an embedding is
+    # known, unless preloaded_size is set in the config
+    DEFAULT_PRELOADED_SIZE = 7
+
+    def init_embedding_cache(self, encoder_model_abs_path):
+        """
+        Set up the memory cache and the on-disk cache of the embeddings
+        of an encoder
+        """
+        self.image_embedding_cache = embedding_cache
+        self.encoder_model_abs_path = encoder_model_abs_path
+        self.embedding_store = self.create_embedding_store(
+            encoder_model_abs_path
+        )
+        self.embedding_dtype = self.get_embedding_dtype()
+        # Size in bytes of the last embedding cached in memory
+        self.embedding_nbytes = 0
+
+    def create_embedding_store(self, encoder_model_abs_path):
+        """
+        Create persistent on-disk cache for image embeddings.
+        It can be disabled by setting embedding_cache_size (MB) to 0.
+        """
+        max_size_mb = self.config.get("embedding_cache_size", 4096)
+        if not max_size_mb:
+            return None
+        try:
+            return EmbeddingStore(
+                self.config["name"],
+                encoder_model_abs_path,
+                max_size_mb,
+                encoder_config={
+                    name: self.config[name]
+                    for name in self.EMBEDDING_CONFIG_NAMES
+                    if name in self.config
+                },
+            )
+        except Exception as e:  # noqa
+            logging.warning("Could not create embedding cache: %s", e)
+            return None
+
+    def get_embedding_dtype(self):
+        """
+        Get the dtype of the image embeddings kept in memory, set by
+        embedding_dtype: float32 (default), float16 or int8.
+        """
+        dtype = self.config.get("embedding_dtype", "float32")
+        if dtype not in EMBEDDING_DTYPES:
+            raise ValueError(f"Unsupported embedding_dtype: {dtype}")
+        return dtype
+
+    def get_preloaded_size(self):
+        """
+        Get the number of next files whose embeddings are preloaded:
+        preloaded_size in config, otherwise as many compressed embeddings
+        as fit in half of the memory cache, the other half keeping the
+        embeddings of the files already seen.
+        """
+        preloaded_size = self.config.get("preloaded_size")
+        if preloaded_size is not None:
+            return max(0, int(preloaded_size))
+        max_bytes = self.image_embedding_cache.max_bytes
+        if max_bytes is None or not self.embedding_nbytes:
+            return self.DEFAULT_PRELOADED_SIZE
+        return max(1, max_bytes // 2 // self.embedding_nbytes)
+
+    def put_compressed_embedding(self, key, image_embedding):
+        """
+        Put image embedding into memory cache, compressed to
+        embedding_dtype. Returns the compressed embedding.
+        """
+        compressed = compress_embedding(image_embedding, self.embedding_dtype)
+        self.embedding_nbytes = get_nbytes(compressed)
+        self.image_embedding_cache.put(key, compressed)
+        return compressed
+
+    def create_encoders(self, num_sessions=1, num_threads=0):
+        """
+        Create encoders with their own sessions for precomputing embeddings
+        """
+        return clone_encoders(
+            self.model, self.encoder_model_abs_path, num_sessions, num_threads
+        )
+
+    def get_cached_embedding(self, filename):
+        """
+        Get image embedding from memory cache or on-disk cache.
+        Embeddings are always returned after a round trip through the
+        compression of embedding_dtype, so that the masks do not depend
+        on the cache which had the embedding.
+        """
+        key = (self.encoder_model_abs_path, filename)
+        compressed = self.image_embedding_cache.get(key)
+        if compressed is None and self.embedding_store is not None:
+            image_embedding = self.embedding_store.get(filename)
+            if image_embedding is not None:
+                compressed = self.put_compressed_embedding(
+                    key, image_embedding
+                )
+        if compressed is None:
+            return None
+        return decompress_embedding(compressed)
+
+    def cache_embedding(self, filename, image_embedding):
+        """
+        Put image embedding into memory cache and on-disk cache. Returns
+        the embedding as get_cached_embedding() would.
+        """
+        compressed = self.put_compressed_embedding(
+            (self.encoder_model_abs_path, filename), image_embedding
+        )
+        if self.embedding_store is not None:
+            self.embedding_store.put(filename, image_embedding)
+        return decompress_embedding(compressed)
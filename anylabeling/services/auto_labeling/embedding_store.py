@@ -0,0 +1,224 @@
+"""Persistent on-disk cache for image embeddings."""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+from .model_cache import model_artifact_cache
+
+
+class EmbeddingStore:
+    """Persistent on-disk LRU cache for image embeddings.
+
+    Entries are keyed by the image content hash and the encoder identity
+    (checksum of the encoder file and the config of its preprocessing),
+    so they survive app restarts, model reloads and file renames. Each
+    entry is a folder holding one .npy file per array (memory-mapped on
+    read) and a meta.json file for the other values.
+    """
+
+    META_FILE = "meta.json"
+    # Temporary folders older than this (in seconds) are left over from
+    # interrupted writes, newer ones may be written by another process
+    TMP_MAX_AGE = 3600
+
+    def __init__(
+        self,
+        model_name,
+        encoder_path,
+        max_size_mb=4096,
+        root=None,
+        encoder_config=None,
+    ):
+        if root is None:
+            root = os.path.join(
+                os.path.expanduser("~"), "anylabeling_data", "embeddings"
+            )
+        self.root = os.path.join(root, model_name)
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.encoder_id = self.get_encoder_id(encoder_path, encoder_config)
+        self.lock = threading.Lock()
+        self._hashes = {}  # (path, size, mtime) -> content hash
+        self._entries = OrderedDict()  # key -> size in bytes, LRU order
+        self._total_size = 0
+        os.makedirs(self.root, exist_ok=True)
+        self._load_index()
+
+    @staticmethod
+    def get_encoder_id(encoder_path, encoder_config=None):
+        """Identify an encoder by the checksum of its file and the config
+        of its preprocessing (e.g. input size)"""
+        try:
+            checksum = model_artifact_cache.get_sha256(encoder_path)
+        except OSError:
+            checksum = os.path.basename(encoder_path)
+        config = json.dumps(encoder_config or {}, sort_keys=True, default=str)
+        return f"{checksum}:{config}"
+
+    def _load_index(self):
+        """Build the LRU index from the entries on disk"""
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if not os.path.isdir(path):
+                continue
+            try:
+                mtime = os.path.getmtime(path)
+                if name.startswith("."):
+                    if time.time() - mtime > self.TMP_MAX_AGE:
+                        # Unfinished write
+                        shutil.rmtree(path, ignore_errors=True)
+                    continue
+                if not os.path.isfile(os.path.join(path, self.META_FILE)):
+                    shutil.rmtree(path, ignore_errors=True)
+                    continue
+                size = self.get_size(path)
+            except OSError:
+                # Removed by another process in the meantime
+                continue
+            entries.append((mtime, name, size))
+        for _, name, size in sorted(entries):
+            self._entries[name] = size
+            self._total_size += size
+
+    @staticmethod
+    def get_size(path):
+        """Size in bytes of the files of an entry"""
+        return sum(
+            os.path.getsize(os.path.join(path, f)) for f in os.listdir(path)
+        )
+
+    def get_key(self, filename):
+        """Get cache key of an image file. Returns None if not available."""
+        if not filename or not os.path.isfile(filename):
+            return None
+        stat = os.stat(filename)
+        file_id = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+        content_hash = self._hashes.get(file_id)
+        if content_hash is None:
+            sha = hashlib.sha256()
+            with open(filename, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    sha.update(chunk)
+            content_hash = sha.hexdigest()
+            self._hashes[file_id] = content_hash
+        return hashlib.sha256(
+            f"{self.encoder_id}:{content_hash}".encode("utf-8")
+        ).hexdigest()[:40]
+
+    def find(self, filename):
+        """Returns True if the embedding of the image is cached"""
+        key = self.get_key(filename)
+        with self.lock:
+            return key is not None and key in self._entries
+
+    def get(self, filename):
+        """Get embedding of an image. Returns None if not cached."""
+        key = self.get_key(filename)
+        if key is None:
+            return None
+        with self.lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+        path = os.path.join(self.root, key)
+        try:
+            with open(os.path.join(path, self.META_FILE), "r") as f:
+                meta = json.load(f)
+            embedding = {}
+            for name, value in meta["values"].items():
+                embedding[name] = (
+                    tuple(value) if isinstance(value, list) else value
+                )
+            for name in meta["arrays"]:
+                embedding[name] = np.load(
+                    os.path.join(path, f"{name}.npy"), mmap_mode="r"
+                )
+            os.utime(path)
+        except Exception as e:  # noqa
+            logging.warning("Could not read cached embedding: %s", e)
+            self._remove(key)
+            return None
+        return embedding
+
+    def put(self, filename, embedding):
+        """Save embedding of an image"""
+        key = self.get_key(filename)
+        if key is None or self.max_size <= 0:
+            return
+        with self.lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return
+
+        # Write to a temporary folder first, then rename atomically
+        tmp_path = os.path.join(self.root, f".{key}.{uuid.uuid4().hex}")
+        path = os.path.join(self.root, key)
+        try:
+            os.makedirs(tmp_path)
+            meta = {"arrays": [], "values": {}}
+            for name, value in embedding.items():
+                if isinstance(value, np.ndarray):
+                    np.save(os.path.join(tmp_path, f"{name}.npy"), value)
+                    meta["arrays"].append(name)
+                else:
+                    meta["values"][name] = (
+                        [int(v) for v in value]
+                        if isinstance(value, (tuple, list))
+                        else value
+                    )
+            with open(os.path.join(tmp_path, self.META_FILE), "w") as f:
+                json.dump(meta, f)
+            size = self.get_size(tmp_path)
+            try:
+                os.replace(tmp_path, path)
+            except OSError:
+                if not os.path.isdir(path):
+                    raise
+                # Written by another process in the meantime, use it
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                size = self.get_size(path)
+        except Exception as e:  # noqa
+            logging.warning("Could not save embedding to cache: %s", e)
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return
+
+        with self.lock:
+            if key in self._entries:
+                # Added by another thread in the meantime
+                self._entries.move_to_end(key)
+                return
+            self._entries[key] = size
+            self._total_size += size
+            evicted = []
+            while self._total_size > self.max_size and len(self._entries) > 1:
+                old_key, old_size = self._entries.popitem(last=False)
+                self._total_size -= old_size
+                evicted.append(old_key)
+        for old_key in evicted:
+            shutil.rmtree(os.path.join(self.root, old_key), ignore_errors=True)
+
+    def _remove(self, key):
+        """Remove an entry"""
+        with self.lock:
+            size = self._entries.pop(key, None)
+            if size is not None:
+                self._total_size -= size
+        shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+
+    def clear(self):
+        """Remove all entries"""
+        with self.lock:
+            keys = list(self._entries)
+            self._entries.clear()
+            self._total_size = 0
+        for key in keys:
+            shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
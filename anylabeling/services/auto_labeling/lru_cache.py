@@ -2,32 +2,113 @@
 from collections import OrderedDict
 import threading
 
+from .metrics import registry
+
+
+def get_nbytes(value):
+    """Size in bytes of the arrays of a value (e.g. an image embedding),
+    in nested dicts, lists and tuples"""
+    if isinstance(value, dict):
+        return sum(get_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(get_nbytes(v) for v in value)
+    return getattr(value, "nbytes", 0)
+
 
 class LRUCache:
-    """Thread-safe LRU cache implementation."""
+    """Thread-safe LRU cache implementation.
 
-    def __init__(self, maxsize=10):
+    The cache holds at most maxsize items (no limit if None) and, if
+    max_bytes is set, at most max_bytes of values as measured by
+    get_nbytes. The most recent item is always kept. Hits, misses and
+    evictions are counted, and also recorded in the metrics registry as
+    "<name>.hits" etc. if a name is given.
+    """
+
+    def __init__(self, maxsize=10, max_bytes=None, name=None):
         self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.name = name
         self.lock = threading.Lock()
         self._cache = OrderedDict()
+        self._sizes = {}
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _count(self, counter):
+        setattr(self, counter, getattr(self, counter) + 1)
+        if self.name:
+            registry.inc(f"{self.name}.{counter}")
+
+    def _remove(self, key):
+        self.nbytes -= self._sizes.pop(key)
+        return self._cache.pop(key)
+
+    def _evict(self):
+        while len(self._cache) > 1 and (
+            (self.maxsize is not None and len(self._cache) > self.maxsize)
+            or (self.max_bytes is not None and self.nbytes > self.max_bytes)
+        ):
+            self._remove(next(iter(self._cache)))
+            self._count("evictions")
 
     def get(self, key):
         """Get value from cache. Returns None if key is not present."""
         with self.lock:
             if key not in self._cache:
+                self._count("misses")
                 return None
+            self._count("hits")
             self._cache.move_to_end(key)
             return self._cache[key]
 
     def put(self, key, value):
-        """Put value into cache. If cache is full, oldest item is evicted."""
+        """Put value into cache. If cache is full, oldest items are
+        evicted."""
         with self.lock:
+            if key in self._cache:
+                self._remove(key)
             self._cache[key] = value
-            self._cache.move_to_end(key)
-            if len(self._cache) > self.maxsize:
-                self._cache.popitem(last=False)
+            self._sizes[key] = get_nbytes(value)
+            self.nbytes += self._sizes[key]
+            self._evict()
+
+    def pop(self, key):
+        """Remove key from cache and return its value.
+        Returns None if key is not present."""
+        with self.lock:
+            if key not in self._cache:
+                return None
+            return self._remove(key)
 
     def find(self, key):
         """Returns True if key is in cache, False otherwise."""
         with self.lock:
             return key in self._cache
+
+    def resize(self, maxsize=None, max_bytes=None):
+        """Change the limits of the cache, evicting items if needed"""
+        with self.lock:
+            self.maxsize = maxsize
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def stats(self):
+        """Number of items, size in bytes, hits, misses and evictions"""
+        with self.lock:
+            return {
+                "items": len(self._cache),
+                "nbytes": self.nbytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+# Image embeddings of all SAM-like models, by (encoder path, filename).
+# Its budget is set from the app config by the model manager.
+embedding_cache = LRUCache(
+    maxsize=None, max_bytes=1024 * 1024 * 1024, name="embedding_cache"
+)
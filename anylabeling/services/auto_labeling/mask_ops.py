@@ -0,0 +1,82 @@
+"""Mask operations shared by the Segment Anything models."""
+
+import math
+
+import cv2
+import numpy as np
+
+from .metrics import traced
+
+
+@traced()
+def upsample_mask_roi(mask, transform_matrix, original_size):
+    """Upsample the region of the positive logits of a low resolution mask
+    to the original image.
+
+    transform_matrix maps the coordinates of the mask to the coordinates
+    of the original image (H, W). Only the bounding region of the object
+    is warped, so the cost does not depend on the image resolution.
+    Returns the binary mask (0 or 255) of the region and the (x, y)
+    offset of the region in the original image, or (None, None) if the
+    mask is empty.
+    """
+    rows = np.flatnonzero((mask > 0.0).any(axis=1))
+    if len(rows) == 0:
+        return None, None
+    cols = np.flatnonzero((mask > 0.0).any(axis=0))
+
+    # Interpolated values are positive up to one pixel away from the
+    # positive logits
+    corners = np.array(
+        [
+            [cols[0] - 1, rows[0] - 1, 1],
+            [cols[-1] + 1, rows[0] - 1, 1],
+            [cols[0] - 1, rows[-1] + 1, 1],
+            [cols[-1] + 1, rows[-1] + 1, 1],
+        ],
+        dtype=np.float64,
+    )
+    corners = corners @ transform_matrix[:2].T
+    height, width = original_size
+    x1 = min(max(0, math.floor(corners[:, 0].min())), width)
+    y1 = min(max(0, math.floor(corners[:, 1].min())), height)
+    x2 = min(max(0, math.ceil(corners[:, 0].max()) + 1), width)
+    y2 = min(max(0, math.ceil(corners[:, 1].max()) + 1), height)
+    if x2 <= x1 or y2 <= y1:
+        return None, None
+
+    roi_matrix = np.array(transform_matrix[:2], dtype=np.float64)
+    roi_matrix[:, 2] -= [x1, y1]
+    roi = cv2.warpAffine(
+        mask,
+        roi_matrix,
+        (x2 - x1, y2 - y1),
+        flags=cv2.INTER_LINEAR,
+    )
+    return (roi > 0.0).astype(np.uint8) * 255, (x1, y1)
+
+
+def get_stability_scores(logits, threshold=0.0, offset=1.0):
+    """Stability scores of a batch of mask logits (N, H, W): IoU of the
+    masks binarized at threshold + offset and threshold - offset."""
+    intersections = (logits > threshold + offset).sum(axis=(-2, -1))
+    unions = (logits > threshold - offset).sum(axis=(-2, -1))
+    return intersections / np.maximum(unions, 1)
+
+
+@traced()
+def mask_nms(masks, scores, iou_threshold):
+    """Non maximum suppression of binary masks (N, H, W) by their IoU.
+    Returns the indices of the kept masks, by decreasing score."""
+    order = np.argsort(-scores)
+    flat_masks = masks[order].reshape(len(order), -1).astype(np.float32)
+    areas = flat_masks.sum(axis=1)
+    intersections = flat_masks @ flat_masks.T
+    ious = intersections / np.maximum(
+        areas[:, None] + areas[None, :] - intersections, 1.0
+    )
+    keep = np.ones(len(order), dtype=bool)
+    for i in range(len(order)):
+        if keep[i]:
+            keep[i + 1 :] &= ious[i, i + 1 :] <= iou_threshold
+    return order[keep]
@@ -0,0 +1,216 @@
+"""Spans, counters and histograms to profile the auto labeling models."""
+
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+class Histogram:
+    """Distribution of the last observed values"""
+
+    def __init__(self, max_samples=1000):
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+        self.samples = deque(maxlen=max_samples)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+        self.samples.append(value)
+
+    def percentile(self, q):
+        """Percentile (0-100) of the last observed values"""
+        if not self.samples:
+            return None
+        values = sorted(self.samples)
+        index = min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))
+        return values[index]
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+        }
+
+
+class Span:
+    """A timed section of code, possibly containing other spans"""
+
+    def __init__(self, registry, name, category, args):
+        self.registry = registry
+        self.name = name
+        self.category = category
+        self.args = args
+        self.children = []
+        self.start = None
+        self.duration = None
+
+    def __enter__(self):
+        self.registry._enter(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration = time.perf_counter() - self.start
+        self.registry._exit(self)
+        return False
+
+    @property
+    def self_duration(self):
+        """Duration without the time spent in child spans"""
+        return self.duration - sum(
+            child.duration
+            for child in self.children
+            if child.duration is not None
+        )
+
+    def breakdown(self):
+        """Time spent in each nested span (without its own child spans),
+        summed by name, in ms"""
+        stages = {}
+        spans = list(self.children)
+        while spans:
+            span = spans.pop(0)
+            if span.duration is None:
+                continue
+            stages[span.name] = (
+                stages.get(span.name, 0.0) + span.self_duration * 1000
+            )
+            spans.extend(span.children)
+        return {
+            "name": self.name,
+            "total_ms": (self.duration or 0.0) * 1000,
+            "stages": stages,
+        }
+
+
+class MetricsRegistry:
+    """Thread-safe registry of counters, histograms and trace events.
+
+    Spans record their duration (in ms) into the histogram of their name
+    and are kept as trace events, which can be exported in the Chrome
+    trace format (chrome://tracing or https://ui.perfetto.dev).
+    """
+
+    def __init__(self, max_trace_events=10000):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.trace_events = deque(maxlen=max_trace_events)
+        self._local = threading.local()
+        self._time_origin = time.perf_counter()
+
+    def inc(self, name, value=1):
+        """Increment a counter"""
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        """Record a value into a histogram"""
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def span(self, name, category=None, **args):
+        """Context manager timing a section of code. Without category,
+        the category of the enclosing span is used.
+
+        Usage:
+            with registry.span("encode"):
+                ...
+        """
+        return Span(self, name, category, args)
+
+    def _enter(self, span):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        if stack:
+            stack[-1].children.append(span)
+        if span.category is None:
+            span.category = stack[-1].category if stack else "auto_labeling"
+        stack.append(span)
+
+    def _exit(self, span):
+        stack = self._local.stack
+        if stack and stack[-1] is span:
+            stack.pop()
+        self.observe(f"{span.category}.{span.name}", span.duration * 1000)
+        event = {
+            "name": span.name,
+            "cat": span.category,
+            "ph": "X",
+            "ts": (span.start - self._time_origin) * 1e6,
+            "dur": span.duration * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+        }
+        if span.args:
+            event["args"] = {k: str(v) for k, v in span.args.items()}
+        with self.lock:
+            self.trace_events.append(event)
+
+    def snapshot(self):
+        """Current counters and histograms"""
+        with self.lock:
+            return {
+                "counters": dict(self.counters),
+                "histograms": {
+                    name: histogram.to_dict()
+                    for name, histogram in self.histograms.items()
+                },
+            }
+
+    def export_chrome_trace(self, filename):
+        """Save the trace events as Chrome trace JSON"""
+        with self.lock:
+            events = list(self.trace_events)
+        events.sort(key=lambda event: event["ts"])
+        with open(filename, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "traceEvents": events,
+                    "displayTimeUnit": "ms",
+                    "otherData": self.snapshot(),
+                },
+                f,
+            )
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.trace_events.clear()
+
+
+# Registry shared by all models
+registry = MetricsRegistry()
+
+
+def traced(name=None, category=None):
+    """Decorator recording each call of a function as a span"""
+
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with registry.span(span_name, category):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
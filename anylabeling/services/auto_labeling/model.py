@@ -1,9 +1,12 @@
+import functools
+import hashlib
+import json
 import logging
 import os
 import pathlib
+import threading
 import yaml
 import onnx
-import urllib.request
 from urllib.parse import urlparse
 
 from PyQt5.QtCore import QCoreApplication
@@ -21,11 +24,21 @@ socket.setdefaulttimeout(240)  # Prevent timeout when downloading models
 from abc import abstractmethod
 
 
-from PyQt5.QtCore import QFile, QObject
-from PyQt5.QtGui import QImage
+from PyQt5.QtCore import QFile, QObject, QPointF, QThread
 
+from anylabeling.utils import GenericWorker
+from . import slicing
+from .downloader import Downloader
+from .lru_cache import LRUCache
+from .metrics import registry
+from .model_cache import model_artifact_cache
 from .types import AutoLabelingResult
 from anylabeling.views.labeling.label_file import LabelFile, LabelFileError
+from anylabeling.views.labeling.shape import Shape
+from anylabeling.views.labeling.utils.opencv import (
+    DecodedImage,
+    qt_img_to_rgb_cv_img,
+)
 
 
 class Model(QObject):
@@ -41,6 +54,19 @@ class Model(QObject):
         }
         default_output_mode = "rectangle"
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Record every prediction of the model into the metrics registry
+        predict_shapes = cls.__dict__.get("predict_shapes")
+        if predict_shapes is not None:
+
+            @functools.wraps(predict_shapes)
+            def traced_predict_shapes(self, *args, **kwargs):
+                with self.span("predict_shapes"):
+                    return predict_shapes(self, *args, **kwargs)
+
+            cls.predict_shapes = traced_predict_shapes
+
     def __init__(self, model_config, on_message) -> None:
         super().__init__()
         self.on_message = on_message
@@ -67,6 +93,25 @@ class Model(QObject):
             config=self.config,
         )
         self.output_mode = self.Meta.default_output_mode
+        self.batch_size = max(1, int(self.config.get("batch_size", 1)))
+
+        # Results of the inference on the next files, see
+        # on_next_files_changed()
+        self.result_cache = LRUCache(self.config.get("result_cache_size", 20))
+        self.config_hash = self.get_config_hash(self.config)
+        self.prediction_lock = threading.Lock()
+        # Model files used by the model, see get_memory_size()
+        self.model_abs_paths = []
+        self.next_files_thread = None
+        self.next_files_worker = None
+        self.stop_next_files_inference = False
+
+    def span(self, name, **args):
+        """
+        Context manager recording the time of a stage of the model
+        into the metrics registry, e.g. `with self.span("encode"): ...`
+        """
+        return registry.span(name, self.config.get("type", "model"), **args)
 
     def get_required_widgets(self):
         """
@@ -86,6 +131,7 @@ class Model(QObject):
             # Relative path to executable or absolute path?
             model_abs_path = os.path.abspath(model_path)
             if os.path.exists(model_abs_path):
+                self.model_abs_paths.append(model_abs_path)
                 return model_abs_path
 
             # Relative path to config file?
@@ -95,6 +141,7 @@ class Model(QObject):
                 os.path.join(config_folder, model_path)
             )
             if os.path.exists(model_abs_path):
+                self.model_abs_paths.append(model_abs_path)
                 return model_abs_path
 
             raise QCoreApplication.translate(
@@ -127,21 +174,21 @@ class Model(QObject):
                 filename,
             )
         )
+        # Optional SHA-256 digest of the model file in the config:
+        # `sha256` for `model_path`, `encoder_sha256` for
+        # `encoder_model_path`...
+        expected_sha256 = model_config.get(
+            model_path_field_name.replace("model_path", "sha256")
+        )
         if os.path.exists(model_abs_path):
-            if model_abs_path.lower().endswith(".onnx"):
-                try:
-                    onnx.checker.check_model(model_abs_path)
-                except onnx.checker.ValidationError as e:
-                    logging.warning("The model is invalid: %s", str(e))
-                    logging.warning("Action: Delete and redownload...")
-                    try:
-                        os.remove(model_abs_path)
-                    except Exception as e:  # noqa
-                        logging.warning("Could not delete: %s", str(e))
-                else:
-                    return model_abs_path
-            else:
+            if self.check_model_file(model_abs_path, expected_sha256):
+                self.model_abs_paths.append(model_abs_path)
                 return model_abs_path
+            logging.warning("Action: Delete and redownload...")
+            try:
+                os.remove(model_abs_path)
+            except Exception as e:  # noqa
+                logging.warning("Could not delete: %s", str(e))
         pathlib.Path(model_abs_path).parent.mkdir(parents=True, exist_ok=True)
 
         # Download url
@@ -153,28 +200,83 @@ class Model(QObject):
         logging.info(
             "Downloading %s to %s", ellipsis_download_url, model_abs_path
         )
-        try:
-            # Download and show progress
-            def _progress(count, block_size, total_size):
-                percent = int(count * block_size * 100 / total_size)
-                self.on_message(
-                    QCoreApplication.translate(
-                        "Model", "Downloading {download_url}: {percent}%"
-                    ).format(
-                        download_url=ellipsis_download_url, percent=percent
-                    )
-                )
+        # Download and show progress
+        last_percent = [None]
+
+        def _progress(downloaded, total_size):
+            if not total_size:
+                return
+            percent = int(downloaded * 100 / total_size)
+            if percent == last_percent[0]:
+                return
+            last_percent[0] = percent
+            self.on_message(
+                QCoreApplication.translate(
+                    "Model", "Downloading {download_url}: {percent}%"
+                ).format(download_url=ellipsis_download_url, percent=percent)
+            )
 
-            urllib.request.urlretrieve(
-                download_url, model_abs_path, reporthook=_progress
+        downloader = Downloader(
+            num_connections=self.config.get("download_connections", 4),
+            on_progress=_progress,
+        )
+        try:
+            downloader.download(
+                download_url, model_abs_path, sha256=expected_sha256
             )
         except Exception as e:  # noqa
             print(f"Could not download {download_url}: {e}")
             self.on_message(f"Could not download {download_url}")
             return None
 
+        if not self.check_model_file(model_abs_path):
+            self.on_message(f"Downloaded model is invalid: {download_url}")
+            try:
+                os.remove(model_abs_path)
+            except Exception as e:  # noqa
+                logging.warning("Could not delete: %s", str(e))
+            return None
+
+        self.model_abs_paths.append(model_abs_path)
         return model_abs_path
 
+    @staticmethod
+    def check_model_file(model_abs_path, expected_sha256=None):
+        """
+        Check a downloaded model file. An unchanged file is only checked
+        once, the result is kept in the model artifact cache.
+        """
+        if expected_sha256 and (
+            model_artifact_cache.get_sha256(model_abs_path).lower()
+            != expected_sha256.lower()
+        ):
+            logging.warning("The model checksum does not match")
+            return False
+        if not model_abs_path.lower().endswith(".onnx"):
+            return True
+        if model_artifact_cache.is_validated(model_abs_path):
+            return True
+        try:
+            onnx.checker.check_model(model_abs_path)
+        except onnx.checker.ValidationError as e:
+            logging.warning("The model is invalid: %s", str(e))
+            return False
+        model_artifact_cache.set_validated(model_abs_path)
+        return True
+
+    def get_memory_size(self):
+        """
+        Approximate memory used by the model, in bytes: the size of
+        its model files, which are loaded in memory by the sessions
+        """
+        size = 0
+        for model_abs_path in set(self.model_abs_paths):
+            try:
+                size += os.path.getsize(model_abs_path)
+            except OSError:
+                pass
+        return size
+
     def check_missing_config(self, config_names, config):
         """
         Check if config has all required config names
@@ -190,6 +292,167 @@ class Model(QObject):
         """
         raise NotImplementedError
 
+    def predict_shapes_batch(self, images, image_paths=None):
+        """
+        Predict a list of images and return a list of AnyLabeling results.
+        Models supporting batched inference override this function.
+        """
+        if image_paths is None:
+            image_paths = [None] * len(images)
+        return [
+            self.predict_shapes(image, image_path)
+            for image, image_path in zip(images, image_paths)
+        ]
+
+    def detect_batch(self, cv_images):
+        """
+        Detect objects in a list of RGB images. Returns for each image a
+        list of detections: dicts with x1, y1, x2, y2, label, score and
+        optionally the polygon points of the object.
+        Models supporting sliced inference override this function.
+        """
+        raise NotImplementedError
+
+    def get_slice_size(self):
+        """
+        Get (width, height) of the tiles of sliced inference, None if
+        sliced inference is disabled (no slice_size in config)
+        """
+        slice_size = self.config.get("slice_size")
+        if not slice_size:
+            return None
+        if isinstance(slice_size, int):
+            return slice_size, slice_size
+        return tuple(slice_size)
+
+    def use_sliced_inference(self, image, image_path=None):
+        """
+        Return True if the image is larger than the tiles of sliced
+        inference. The size is read from the header of the file when the
+        format has a windowed reader, so image may be None.
+        """
+        slice_size = self.get_slice_size()
+        if slice_size is None:
+            return False
+        size = slicing.get_image_size(image, image_path)
+        if size is None:
+            return False
+        return size[0] > slice_size[0] or size[1] > slice_size[1]
+
+    def predict_shapes_sliced(self, image, image_path=None):
+        """
+        Predict shapes from a large image by running detect_batch() on
+        overlapping tiles and merging the detections of all tiles.
+        The image may be None if image_path has a windowed reader.
+        Raises an exception if the image cannot be read, instead of
+        returning an empty result.
+        """
+        slice_width, slice_height = self.get_slice_size()
+        overlap = self.config.get("slice_overlap", 0.2)
+        with self.span("read_tiles"):
+            reader = slicing.open_tile_reader(image, image_path)
+
+        infos = []
+        try:
+            windows = slicing.get_slice_windows(
+                reader.width, reader.height, slice_width, slice_height, overlap
+            )
+            for batch in self.split_batches(windows):
+                with self.span("read_tiles"):
+                    tiles = [reader.read(*window) for window in batch]
+                for (x, y, _, _), tile_infos in zip(
+                    batch, self.detect_batch(tiles)
+                ):
+                    infos.extend(slicing.shift_infos(tile_infos, x, y))
+
+            # Objects larger than a tile are detected on the whole image
+            if self.config.get("slice_full_image", True):
+                with self.span("read_tiles"):
+                    thumbnail = reader.read_thumbnail(
+                        2 * max(slice_width, slice_height)
+                    )
+                scale = reader.width / thumbnail.shape[1]
+                infos.extend(
+                    slicing.shift_infos(
+                        self.detect_batch([thumbnail])[0], 0, 0, scale
+                    )
+                )
+        finally:
+            reader.close()
+
+        with self.span("merge_tiles"):
+            infos = slicing.merge_infos(
+                infos,
+                method=self.config.get("slice_merge", "nms"),
+                threshold=self.config.get("slice_merge_threshold", 0.5),
+            )
+        return AutoLabelingResult(
+            self.build_sliced_shapes(infos), replace=True
+        )
+
+    @staticmethod
+    def build_sliced_shapes(infos):
+        """
+        Convert merged detections of sliced inference to shapes
+        """
+        shapes = []
+        for info in infos:
+            if "points" in info:
+                shape = Shape(
+                    label=info["label"], shape_type="polygon", flags={}
+                )
+                for x, y in info["points"]:
+                    shape.add_point(QPointF(int(x), int(y)))
+                shape.close()
+            else:
+                shape = Shape(
+                    label=info["label"], shape_type="rectangle", flags={}
+                )
+                shape.add_point(QPointF(info["x1"], info["y1"]))
+                shape.add_point(QPointF(info["x2"], info["y2"]))
+            shapes.append(shape)
+        return shapes
+
+    def check_batch_size(self, net):
+        """
+        Limit the batch size to 1 if the network input has a fixed batch axis
+        """
+        input_batch = net.get_inputs()[0].shape[0]
+        if self.batch_size > 1 and isinstance(input_batch, int):
+            logging.warning(
+                "Model input has a fixed batch size of %s, "
+                "batched inference is disabled.",
+                input_batch,
+            )
+            self.batch_size = 1
+
+    def split_batches(self, items):
+        """
+        Split a list of items into batches of batch_size
+        """
+        for i in range(0, len(items), self.batch_size):
+            yield items[i : i + self.batch_size]
+
+    @staticmethod
+    def load_rgb_images(images, image_paths=None):
+        """
+        Convert a list of images to RGB numpy arrays.
+        Images which can not be converted are returned as None.
+        """
+        if image_paths is None:
+            image_paths = [None] * len(images)
+        cv_images = []
+        for image, image_path in zip(images, image_paths):
+            cv_image = None
+            if image is not None:
+                try:
+                    cv_image = qt_img_to_rgb_cv_img(image, image_path)
+                except Exception as e:  # noqa
+                    logging.warning("Could not load image: %s", image_path)
+                    logging.warning(e)
+            cv_images.append(cv_image)
+        return cv_images
+
     @abstractmethod
     def unload(self):
         """
@@ -199,19 +462,22 @@ class Model(QObject):
 
     @staticmethod
     def load_image_from_filename(filename):
-        """Load image from labeling file and return image data and image path."""
+        """Load image from labeling file. Returns None on error."""
         label_file = os.path.splitext(filename)[0] + ".json"
+        image = None
         if QFile.exists(label_file) and LabelFile.is_label_file(label_file):
             try:
                 label_file = LabelFile(label_file)
             except LabelFileError as e:
                 logging.error("Error reading {}: {}".format(label_file, e))
-                return None, None
-            image_data = label_file.image_data
+                return None
+            if label_file.image_file is None:
+                image = DecodedImage.from_data(label_file.image_data)
+            else:
+                image = DecodedImage.from_file(label_file.image_file)
         else:
-            image_data = LabelFile.load_image_file(filename)
-        image = QImage.fromData(image_data)
-        if image.isNull():
+            image = DecodedImage.from_file(filename)
+        if image is None:
             logging.error("Error reading {}".format(filename))
         return image
 
@@ -219,8 +485,97 @@ class Model(QObject):
         """
         Handle next files changed. This function can preload next files
         and run inference to save time for user.
+        By default, predict_shapes() is run on the next files in a thread
+        and the results are cached for predict_shapes_cached().
+        """
+        if (
+            self.next_files_thread is not None
+            and self.next_files_thread.isRunning()
+        ):
+            return
+        self.stop_next_files_inference = False
+        self.next_files_thread = QThread()
+        self.next_files_worker = GenericWorker(
+            self.predict_next_files, next_files
+        )
+        self.next_files_worker.finished.connect(self.next_files_thread.quit)
+        self.next_files_worker.moveToThread(self.next_files_thread)
+        self.next_files_thread.started.connect(self.next_files_worker.run)
+        self.next_files_thread.start()
+
+    def predict_next_files(self, files):
         """
-        pass
+        Run inference on files and cache the results
+        """
+        for filename in files:
+            if self.stop_next_files_inference:
+                return
+            key = self.get_result_cache_key(filename)
+            if key is None or self.result_cache.find(key):
+                continue
+            image = self.load_image_from_filename(filename)
+            if image is None:
+                continue
+            try:
+                with self.prediction_lock:
+                    result = self.predict_shapes(image, filename)
+            except Exception as e:  # noqa
+                logging.warning("Could not run inference on %s", filename)
+                logging.warning(e)
+                continue
+            # Failed predictions are not cached
+            if isinstance(result, AutoLabelingResult):
+                self.result_cache.put(key, result)
+
+    def stop_next_files_thread(self):
+        """
+        Stop inference on next files and wait for the thread to finish
+        """
+        self.stop_next_files_inference = True
+        if self.next_files_thread is not None:
+            self.next_files_thread.quit()
+            self.next_files_thread.wait()
+
+    def predict_shapes_cached(self, image, filename=None):
+        """
+        Return the cached result of a file if available, otherwise run
+        predict_shapes()
+        """
+        key = self.get_result_cache_key(filename)
+        # Wait for a running inference, it may be on the same file
+        with self.prediction_lock:
+            if key is not None:
+                result = self.result_cache.pop(key)
+                if result is not None:
+                    registry.inc("result_cache.hits")
+                    return result
+                registry.inc("result_cache.misses")
+            return self.predict_shapes(image, filename)
+
+    @staticmethod
+    def get_config_hash(config):
+        """
+        Get hash of a model config
+        """
+        config = {k: v for k, v in config.items() if k != "model"}
+        return hashlib.sha1(
+            json.dumps(config, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+
+    def get_result_cache_key(self, filename):
+        """
+        Get result cache key of a file. Returns None if not available.
+        """
+        try:
+            mtime = os.stat(filename).st_mtime_ns
+        except (OSError, TypeError):
+            return None
+        return (
+            os.path.abspath(filename),
+            mtime,
+            self.config_hash,
+            self.output_mode,
+        )
 
     def set_output_mode(self, mode):
         """
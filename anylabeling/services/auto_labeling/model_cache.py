@@ -0,0 +1,263 @@
+"""Persistent cache of model artifacts: checksums, validation results and
+graphs optimized by ONNXRuntime."""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+import onnxruntime as ort
+
+
+class ModelArtifactCache:
+    """Persistent cache of model artifacts.
+
+    Each model file is recorded with its size, modification time and
+    SHA-256 checksum, so that an unchanged file is validated only once.
+    Sessions are created from the graph optimized by ONNXRuntime the first
+    time a model is loaded, so later loads skip most of the graph
+    optimization.
+
+    Graphs are saved with the optimizations up to the extended level,
+    which do not depend on the CPU. The layout optimizations of the ALL
+    level are specific to the CPU and run each time a graph is loaded.
+    """
+
+    INDEX_FILE = "index.json"
+    SAVED_LEVEL = ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+
+    def __init__(self, root=None):
+        if root is None:
+            root = os.path.join(
+                os.path.expanduser("~"), "anylabeling_data", "model_cache"
+            )
+        self.root = root
+        self.lock = threading.Lock()
+        self._index = None
+        # Intra-op threads of the sessions whose options do not set them
+        # (0: ONNXRuntime default, one thread per core)
+        self.num_threads = 0
+
+    @staticmethod
+    def get_file_id(model_path):
+        stat = os.stat(model_path)
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    @staticmethod
+    def get_checksum(model_path):
+        """SHA-256 checksum of a file"""
+        sha256 = hashlib.sha256()
+        with open(model_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def _load_index(self):
+        if self._index is not None:
+            return self._index
+        self._index = {}
+        try:
+            with open(
+                os.path.join(self.root, self.INDEX_FILE), "r", encoding="utf-8"
+            ) as f:
+                self._index = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logging.warning("Could not read model cache index: %s", e)
+        return self._index
+
+    def _save_index(self):
+        index_file = os.path.join(self.root, self.INDEX_FILE)
+        tmp_file = f"{index_file}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(self._index, f, indent=2)
+            os.replace(tmp_file, index_file)
+        except OSError as e:
+            logging.warning("Could not save model cache index: %s", e)
+
+    def _get_record(self, model_path):
+        """Record of an unchanged model file, or a new record.
+        Must be called with the lock held."""
+        model_path = os.path.abspath(model_path)
+        index = self._load_index()
+        file_id = self.get_file_id(model_path)
+        record = index.get(model_path)
+        if record is None or any(
+            record.get(k) != v for k, v in file_id.items()
+        ):
+            if record is not None:
+                self._remove_optimized(record)
+            record = dict(file_id, sha256=None, validated=False, optimized={})
+            index[model_path] = record
+        return record
+
+    def _remove_optimized(self, record):
+        for filename in record.get("optimized", {}).values():
+            if not filename:
+                continue
+            try:
+                os.remove(os.path.join(self.root, filename))
+            except OSError:
+                pass
+        record["optimized"] = {}
+
+    def get_sha256(self, model_path):
+        """SHA-256 checksum of a model file, computed once per file"""
+        with self.lock:
+            record = self._get_record(model_path)
+            if record["sha256"] is None:
+                record["sha256"] = self.get_checksum(model_path)
+                self._save_index()
+            return record["sha256"]
+
+    def is_validated(self, model_path):
+        """Return True if the file was validated and has not changed"""
+        with self.lock:
+            try:
+                return self._get_record(model_path)["validated"]
+            except OSError:
+                return False
+
+    def set_validated(self, model_path):
+        """Record that a model file is valid"""
+        with self.lock:
+            record = self._get_record(model_path)
+            if record["sha256"] is None:
+                record["sha256"] = self.get_checksum(model_path)
+            record["validated"] = True
+            self._save_index()
+
+    def get_optimized_key(self, model_path, providers):
+        """Key of the optimized graph of a model. Optimized graphs depend
+        on the ONNXRuntime version, the execution providers and the
+        optimization level."""
+        return hashlib.sha1(
+            json.dumps(
+                [
+                    self.get_sha256(model_path),
+                    ort.__version__,
+                    list(providers),
+                    int(self.SAVED_LEVEL),
+                ]
+            ).encode("utf-8")
+        ).hexdigest()
+
+    def _load_optimized(self, optimized_path, providers, sess_options):
+        """Create a session from a saved optimized graph"""
+        level = sess_options.graph_optimization_level
+        if int(level) <= int(self.SAVED_LEVEL):
+            sess_options.graph_optimization_level = (
+                ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+            )
+        try:
+            return ort.InferenceSession(
+                optimized_path, providers=providers, sess_options=sess_options
+            )
+        finally:
+            sess_options.graph_optimization_level = level
+
+    def create_session(self, model_path, providers=None, sess_options=None):
+        """Create an InferenceSession from the optimized graph of a model.
+        The optimized graph is saved the first time."""
+        if providers is None:
+            providers = ort.get_available_providers()
+        if sess_options is None:
+            sess_options = ort.SessionOptions()
+        if self.num_threads and not sess_options.intra_op_num_threads:
+            sess_options.intra_op_num_threads = self.num_threads
+        try:
+            key = self.get_optimized_key(model_path, providers)
+            with self.lock:
+                filename = self._get_record(model_path)["optimized"].get(
+                    key, ""
+                )
+        except OSError as e:
+            logging.warning("Could not cache model %s: %s", model_path, e)
+            filename = None
+        if filename is None:
+            # The optimized graph could not be saved before (e.g. models
+            # larger than 2GB), do not try again
+            return ort.InferenceSession(
+                model_path, providers=providers, sess_options=sess_options
+            )
+
+        # Session options are shared by the sessions of some models, so
+        # they are restored after use
+        level = sess_options.graph_optimization_level
+        optimized_path = os.path.join(self.root, f"{key}.onnx")
+        if filename and os.path.isfile(optimized_path):
+            try:
+                return self._load_optimized(
+                    optimized_path, providers, sess_options
+                )
+            except Exception as e:  # noqa
+                logging.warning(
+                    "Could not load optimized model %s: %s", optimized_path, e
+                )
+
+        tmp_path = (
+            f"{optimized_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        )
+        sess_options.optimized_model_filepath = tmp_path
+        if int(level) > int(self.SAVED_LEVEL):
+            sess_options.graph_optimization_level = self.SAVED_LEVEL
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            session = ort.InferenceSession(
+                model_path, providers=providers, sess_options=sess_options
+            )
+            os.replace(tmp_path, optimized_path)
+            filename = os.path.basename(optimized_path)
+        except Exception as e:  # noqa
+            logging.warning(
+                "Could not save optimized model of %s: %s", model_path, e
+            )
+            session = None
+            filename = None
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+        finally:
+            sess_options.optimized_model_filepath = ""
+            sess_options.graph_optimization_level = level
+
+        with self.lock:
+            record = self._get_record(model_path)
+            # Optimized graphs of other versions or providers
+            self._remove_optimized(record)
+            record["optimized"][key] = filename
+            self._save_index()
+
+        if session is not None and int(level) > int(self.SAVED_LEVEL):
+            # The session was created at the saved level, run the layout
+            # optimizations on the saved graph
+            try:
+                session = self._load_optimized(
+                    optimized_path, providers, sess_options
+                )
+            except Exception as e:  # noqa
+                logging.warning(
+                    "Could not load optimized model %s: %s", optimized_path, e
+                )
+                session = None
+        if session is None:
+            session = ort.InferenceSession(
+                model_path, providers=providers, sess_options=sess_options
+            )
+        return session
+
+
+# Cache shared by all models
+model_artifact_cache = ModelArtifactCache()
+
+
+def create_inference_session(model_path, providers=None, sess_options=None):
+    """Create an ONNXRuntime session using the model artifact cache"""
+    return model_artifact_cache.create_session(
+        model_path, providers=providers, sess_options=sess_options
+    )
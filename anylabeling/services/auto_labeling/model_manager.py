@@ -8,6 +8,9 @@ import yaml
 from PyQt5.QtCore import QObject, QThread, pyqtSignal, pyqtSlot
 
 from anylabeling.configs import auto_labeling as auto_labeling_configs
+from anylabeling.services.auto_labeling.lru_cache import embedding_cache
+from anylabeling.services.auto_labeling.metrics import registry
+from anylabeling.services.auto_labeling.model_pool import ModelPool
 from anylabeling.services.auto_labeling.types import AutoLabelingResult
 from anylabeling.utils import GenericWorker
 
@@ -19,6 +22,13 @@ class ModelManager(QObject):
 
     MAX_NUM_CUSTOM_MODELS = 5
 
+    # Models which use marks from the canvas
+    MARKS_MODEL_TYPES = [
+        "segment_anything",
+        "sam_med2d",
+        "yolov5_sam",
+    ]
+
     model_configs_changed = pyqtSignal(list)
     new_model_status = pyqtSignal(str)
     model_loaded = pyqtSignal(dict)
@@ -29,6 +39,8 @@ class ModelManager(QObject):
     prediction_finished = pyqtSignal()
     request_next_files_requested = pyqtSignal()
     output_modes_changed = pyqtSignal(dict, str)
+    new_timing_breakdown = pyqtSignal(dict)
+    new_embedding_cache_stats = pyqtSignal(dict)
 
     def __init__(self):
         super().__init__()
@@ -42,6 +54,25 @@ class ModelManager(QObject):
         self.model_execution_thread = None
         self.model_execution_thread_lock = Lock()
 
+        self.precompute_thread = None
+        self.precompute_worker = None
+        self.precompute_stopped = False
+
+        # Recently used models are kept loaded to switch back instantly
+        model_pool_config = get_config().get("model_pool", {})
+        self.model_pool = ModelPool(
+            max_models=model_pool_config.get("max_models", 2),
+            max_memory_mb=model_pool_config.get("max_memory_mb", 4096),
+        )
+
+        # Image embeddings of the SAM-like models, shared by all of them
+        embedding_cache_config = get_config().get("embedding_cache", {})
+        embedding_cache.resize(
+            max_bytes=embedding_cache_config.get("max_memory_mb", 1024)
+            * 1024
+            * 1024
+        )
+
         self.load_model_configs()
 
     def load_model_configs(self):
@@ -276,11 +307,20 @@ class ModelManager(QObject):
 
     def _load_model(self, model_id):
         """Load and return model info"""
+        self.stop_precompute_embeddings()
         if self.loaded_model_config is not None:
-            self.loaded_model_config["model"].unload()
+            # The model stays loaded in the model pool
+            self._deactivate_model(self.loaded_model_config["model"])
             self.loaded_model_config = None
             self.auto_segmentation_model_unselected.emit()
 
+        # Reuse the model if it is still loaded
+        model_config = self.model_pool.get(self.model_configs[model_id])
+        if model_config is not None:
+            return self._activate_pooled_model(model_config)
+
+        # The model pool evicts models over its limits only once the new
+        # model is loaded, so that a failed load does not unload others
         model_config = copy.deepcopy(self.model_configs[model_id])
         if model_config["type"] == "yolov5":
             from .yolov5 import YOLOv5
@@ -643,6 +683,33 @@ class ModelManager(QObject):
         else:
             raise Exception(f"Unknown model type: {model_config['type']}")
 
+        self.model_pool.put(model_config)
+        self.loaded_model_config = model_config
+        return self.loaded_model_config
+
+    @staticmethod
+    def _deactivate_model(model):
+        """Stop the background work of a model which stays in the pool"""
+        model.stop_next_files_thread()
+        # Preloading of the embeddings of the next files (SAM-like models)
+        if getattr(model, "pre_inference_thread", None) is not None:
+            model.stop_inference = True
+            model.pre_inference_thread.quit()
+            model.pre_inference_thread.wait()
+
+    def _activate_pooled_model(self, model_config):
+        """Make a model of the model pool the loaded model"""
+        model = model_config["model"]
+        if hasattr(model, "stop_inference"):
+            model.stop_inference = False
+        model.set_output_mode(model.Meta.default_output_mode)
+        if model_config["type"] in self.MARKS_MODEL_TYPES:
+            # Marks belong to the image of the last time the model was used
+            model.set_auto_labeling_marks([])
+            self.auto_segmentation_model_selected.emit()
+            self.request_next_files_requested.emit()
+        else:
+            self.auto_segmentation_model_unselected.emit()
         self.loaded_model_config = model_config
         return self.loaded_model_config
 
@@ -650,23 +717,18 @@ class ModelManager(QObject):
         """Set auto labeling marks
         (For example, for segment_anything model, it is the marks for)
         """
-        marks_model_list = [
-            "segment_anything", 
-            "sam_med2d", 
-            "yolov5_sam",
-        ]
         if (
             self.loaded_model_config is None
-            or self.loaded_model_config["type"] not in marks_model_list
+            or self.loaded_model_config["type"] not in self.MARKS_MODEL_TYPES
         ):
             return
         self.loaded_model_config["model"].set_auto_labeling_marks(marks)
 
     def unload_model(self):
-        """Unload model"""
-        if self.loaded_model_config is not None:
-            self.loaded_model_config["model"].unload()
-            self.loaded_model_config = None
+        """Unload all models"""
+        self.stop_precompute_embeddings()
+        self.loaded_model_config = None
+        self.model_pool.clear()
 
     def predict_shapes(self, image, filename=None):
         """Predict shapes.
@@ -680,9 +742,13 @@ class ModelManager(QObject):
             self.prediction_finished.emit()
             return
         try:
-            auto_labeling_result = self.loaded_model_config[
-                "model"
-            ].predict_shapes(image, filename)
+            with registry.span("auto_labeling", "model_manager") as span:
+                auto_labeling_result = self.loaded_model_config[
+                    "model"
+                ].predict_shapes_cached(image, filename)
+            self.new_timing_breakdown.emit(span.breakdown())
+            if self.loaded_model_config["type"] in self.MARKS_MODEL_TYPES:
+                self.new_embedding_cache_stats.emit(embedding_cache.stats())
             self.new_auto_labeling_result.emit(auto_labeling_result)
         except Exception as e:  # noqa
             print(f"Error in predict_shapes: {e}")
@@ -738,13 +804,130 @@ class ModelManager(QObject):
             )
             self.model_execution_thread.start()
 
+    @staticmethod
+    def export_trace(filename):
+        """Save the recorded spans of the models as Chrome trace JSON"""
+        registry.export_chrome_trace(filename)
+
     def on_next_files_changed(self, next_files):
         """Run prediction on next files in advance to save inference time later"""
         if self.loaded_model_config is None:
             return
 
-        # Currently only segment_anything-like model supports this feature
-        if self.loaded_model_config["type"] not in ["segment_anything", "sam_med2d", "yolov5_sam"]:
+        # Other models run the whole prediction in advance
+        if (
+            self.loaded_model_config["type"] not in self.MARKS_MODEL_TYPES
+            and not get_config()["speculative_inference"]["enabled"]
+        ):
             return
 
         self.loaded_model_config["model"].on_next_files_changed(next_files)
+
+    def is_marks_model_loaded(self):
+        """Return True if the loaded model uses marks from the canvas"""
+        return (
+            self.loaded_model_config is not None
+            and self.loaded_model_config["type"] in self.MARKS_MODEL_TYPES
+        )
+
+    def precompute_embeddings(self, filenames):
+        """Encode all files in a thread and save their image embeddings
+        to the on-disk cache. Files which are already cached are skipped.
+        """
+        if self.loaded_model_config is None:
+            self.new_model_status.emit(
+                self.tr("Model is not loaded. Choose a mode to continue.")
+            )
+            return
+        model = self.loaded_model_config["model"]
+        if (
+            not hasattr(model, "create_encoders")
+            or getattr(model, "embedding_store", None) is None
+        ):
+            self.new_model_status.emit(
+                self.tr(
+                    "The current model does not support precomputing"
+                    " embeddings."
+                )
+            )
+            return
+        if (
+            self.precompute_thread is not None
+            and self.precompute_thread.isRunning()
+        ):
+            self.new_model_status.emit(
+                self.tr("Embeddings are being precomputed. Please wait...")
+            )
+            return
+        if not filenames:
+            return
+
+        config = get_config().get("precompute_embeddings") or {}
+        self.precompute_stopped = False
+        self.precompute_thread = QThread()
+        self.precompute_worker = GenericWorker(
+            self._precompute_embeddings,
+            model,
+            list(filenames),
+            config.get("num_sessions", 1),
+            config.get("num_threads", 0),
+        )
+        self.precompute_worker.finished.connect(self.precompute_thread.quit)
+        self.precompute_worker.moveToThread(self.precompute_thread)
+        self.precompute_thread.started.connect(self.precompute_worker.run)
+        self.precompute_thread.start()
+
+    def _precompute_embeddings(
+        self, model, filenames, num_sessions, num_threads
+    ):
+        """Precompute embeddings and report progress"""
+        from .precompute import precompute_embeddings
+
+        try:
+            encoders = model.create_encoders(num_sessions, num_threads)
+        except Exception as e:  # noqa
+            print(f"Error in precomputing embeddings: {e}")
+            self.new_model_status.emit(
+                self.tr("Error in precomputing embeddings: {error}").format(
+                    error=str(e)
+                )
+            )
+            return
+
+        def _on_progress(done, total):
+            self.new_model_status.emit(
+                self.tr("Precomputing embeddings: {done}/{total}").format(
+                    done=done, total=total
+                )
+            )
+
+        def _is_stopped():
+            return self.precompute_stopped or getattr(
+                model, "stop_inference", False
+            )
+
+        done, failed = precompute_embeddings(
+            model.embedding_store,
+            encoders,
+            filenames,
+            on_progress=_on_progress,
+            is_stopped=_is_stopped,
+        )
+        if _is_stopped():
+            self.new_model_status.emit(
+                self.tr(
+                    "Precomputing embeddings stopped: {done}/{total}."
+                    " Run it again to resume."
+                ).format(done=done, total=len(filenames))
+            )
+            return
+        self.new_model_status.emit(
+            self.tr(
+                "Finished precomputing embeddings: {done} images,"
+                " {failed} failed."
+            ).format(done=done - failed, failed=failed)
+        )
+
+    def stop_precompute_embeddings(self):
+        """Stop precomputing embeddings"""
+        self.precompute_stopped = True
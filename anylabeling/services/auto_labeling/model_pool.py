@@ -0,0 +1,108 @@
+"""Pool of loaded models, to switch between recently used models without
+loading them again."""
+
+import logging
+import threading
+from collections import OrderedDict
+
+from .model import Model
+
+
+class ModelPool:
+    """Thread-safe LRU pool of loaded models.
+
+    Keeps at most max_models models, and evicts the least recently used
+    ones while the total size of the model files is above max_memory_mb.
+    The most recently used model is always kept. Evicted models are
+    unloaded.
+    """
+
+    def __init__(self, max_models=2, max_memory_mb=4096):
+        self.max_models = max(1, int(max_models))
+        self.max_memory = max_memory_mb * 1024 * 1024
+        self.lock = threading.Lock()
+        # config_file -> (config_key, model_config)
+        self._models = OrderedDict()
+
+    @staticmethod
+    def get_config_key(model_config):
+        """Key of the content of a model config, ignoring runtime fields"""
+        return Model.get_config_hash(
+            {k: v for k, v in model_config.items() if k != "last_used"}
+        )
+
+    def get(self, model_config):
+        """Return the loaded model config for a model config, or None.
+        A model loaded from an outdated config is evicted."""
+        config_file = model_config["config_file"]
+        with self.lock:
+            entry = self._models.get(config_file)
+            if entry is None:
+                return None
+            if entry[0] == self.get_config_key(model_config):
+                self._models.move_to_end(config_file)
+                return entry[1]
+            del self._models[config_file]
+        self._unload([entry[1]])
+        return None
+
+    def put(self, loaded_model_config):
+        """Add a loaded model config, then evict models over the limits"""
+        config_file = loaded_model_config["config_file"]
+        with self.lock:
+            self._models[config_file] = (
+                self.get_config_key(loaded_model_config),
+                loaded_model_config,
+            )
+            self._models.move_to_end(config_file)
+            evicted = self._evict()
+        self._unload(evicted)
+
+    def clear(self):
+        """Unload all models"""
+        with self.lock:
+            evicted = [entry[1] for entry in self._models.values()]
+            self._models.clear()
+        self._unload(evicted)
+
+    def memory_size(self):
+        """Approximate memory used by the models of the pool, in bytes"""
+        with self.lock:
+            return sum(
+                entry[1]["model"].get_memory_size()
+                for entry in self._models.values()
+            )
+
+    def __len__(self):
+        with self.lock:
+            return len(self._models)
+
+    def __contains__(self, config_file):
+        with self.lock:
+            return config_file in self._models
+
+    def _evict(self):
+        """Remove the least recently used models over the limits.
+        Must be called with the lock held, returns the removed models."""
+        evicted = []
+        sizes = {
+            config_file: entry[1]["model"].get_memory_size()
+            for config_file, entry in self._models.items()
+        }
+        total_size = sum(sizes.values())
+        while self._models and (
+            len(self._models) > self.max_models
+            or (total_size > self.max_memory and len(self._models) > 1)
+        ):
+            config_file, entry = self._models.popitem(last=False)
+            total_size -= sizes[config_file]
+            evicted.append(entry[1])
+        return evicted
+
+    @staticmethod
+    def _unload(model_configs):
+        for model_config in model_configs:
+            logging.info("Unloading model: %s", model_config.get("name"))
+            model = model_config["model"]
+            model.stop_next_files_thread()
+            model.unload()
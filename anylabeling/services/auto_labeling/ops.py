@@ -0,0 +1,270 @@
+"""Box operations and NMS shared by the detection models."""
+
+import cv2
+import numpy as np
+
+
+def letterbox(
+    im,
+    new_shape=(640, 640),
+    color=(114, 114, 114),
+    auto=False,
+    scaleup=True,
+    stride=32,
+    return_int=False,
+):
+    """Resize and pad image while meeting stride-multiple constraints."""
+    shape = im.shape[:2]  # current shape [height, width]
+    if isinstance(new_shape, int):
+        new_shape = (new_shape, new_shape)
+    elif isinstance(new_shape, list) and len(new_shape) == 1:
+        new_shape = (new_shape[0], new_shape[0])
+
+    # Scale ratio (new / old)
+    r = min(new_shape[0] / shape[0], new_shape[1] / shape[1])
+    if not scaleup:  # only scale down, do not scale up (for better val mAP)
+        r = min(r, 1.0)
+
+    # Compute padding
+    new_unpad = int(round(shape[1] * r)), int(round(shape[0] * r))
+    dw, dh = new_shape[1] - new_unpad[0], new_shape[0] - new_unpad[1]
+
+    if auto:  # minimum rectangle
+        dw, dh = np.mod(dw, stride), np.mod(dh, stride)  # wh padding
+
+    dw /= 2  # divide padding into 2 sides
+    dh /= 2
+
+    if shape[::-1] != new_unpad:  # resize
+        im = cv2.resize(im, new_unpad, interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    im = cv2.copyMakeBorder(
+        im, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color
+    )  # add border
+    if not return_int:
+        return im, r, (dw, dh)
+    return im, r, (left, top)
+
+
+def xywh2xyxy(x):
+    """Convert boxes with shape [n, 4] from [x, y, w, h] to [x1, y1, x2, y2]
+    where x1y1 is top-left, x2y2 is bottom-right."""
+    y = np.copy(x)
+    y[:, 0] = x[:, 0] - x[:, 2] / 2  # top left x
+    y[:, 1] = x[:, 1] - x[:, 3] / 2  # top left y
+    y[:, 2] = x[:, 0] + x[:, 2] / 2  # bottom right x
+    y[:, 3] = x[:, 1] + x[:, 3] / 2  # bottom right y
+    return y
+
+
+def rescale(ori_shape, boxes, target_shape):
+    """Rescale boxes from the letterboxed shape to the original image shape"""
+    ratio = min(ori_shape[0] / target_shape[0], ori_shape[1] / target_shape[1])
+    padding = (
+        (ori_shape[1] - target_shape[1] * ratio) / 2,
+        (ori_shape[0] - target_shape[0] * ratio) / 2,
+    )
+    boxes[:, [0, 2]] -= padding[0]
+    boxes[:, [1, 3]] -= padding[1]
+    boxes[:, :4] /= ratio
+    boxes[:, 0] = np.clip(boxes[:, 0], 0, target_shape[1])  # x1
+    boxes[:, 1] = np.clip(boxes[:, 1], 0, target_shape[0])  # y1
+    boxes[:, 2] = np.clip(boxes[:, 2], 0, target_shape[1])  # x2
+    boxes[:, 3] = np.clip(boxes[:, 3], 0, target_shape[0])  # y2
+    return boxes
+
+
+def box_area(boxes):
+    return (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+
+def box_iou(box1, box2):
+    """IoU matrix (N x M) of boxes in [x1, y1, x2, y2] format"""
+    area1 = box_area(box1)  # N
+    area2 = box_area(box2)  # M
+    # broadcasting
+    lt = np.maximum(box1[:, np.newaxis, :2], box2[:, :2])
+    rb = np.minimum(box1[:, np.newaxis, 2:], box2[:, 2:])
+    wh = np.maximum(0, rb - lt)  # [N, M, 2]
+    inter = wh[:, :, 0] * wh[:, :, 1]
+    return inter / (area1[:, np.newaxis] + area2 - inter)
+
+
+def _to_xywh(boxes):
+    """[x1, y1, x2, y2] boxes to [x, y, w, h] for cv2.dnn"""
+    boxes = np.asarray(boxes, dtype=np.float64)
+    xywh = boxes[:, :4].copy()
+    xywh[:, 2:] -= xywh[:, :2]
+    return xywh
+
+
+def numpy_nms(boxes, scores, iou_threshold):
+    """Greedy NMS of boxes in [x1, y1, x2, y2] format.
+
+    Returns the indices of the kept boxes, by decreasing score.
+    """
+    if len(boxes) == 0:
+        return np.zeros((0,), dtype=np.int64)
+    scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+    # cv2.dnn requires a score threshold >= 0 and only keeps the boxes
+    # scoring above it, scores are already filtered by the callers
+    if hasattr(cv2, "dnn") and scores.min() > 0:
+        keep = cv2.dnn.NMSBoxes(
+            _to_xywh(boxes).tolist(),
+            scores.tolist(),
+            0.0,
+            float(iou_threshold),
+        )
+        return np.asarray(keep, dtype=np.int64).reshape(-1)
+
+    # Vectorized IoU of the best box against all remaining boxes
+    boxes = np.asarray(boxes, dtype=np.float64)
+    x1, y1, x2, y2 = (boxes[:, i] for i in range(4))
+    areas = (x2 - x1) * (y2 - y1)
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        w = np.maximum(
+            0, np.minimum(x2[i], x2[rest]) - np.maximum(x1[i], x1[rest])
+        )
+        h = np.maximum(
+            0, np.minimum(y2[i], y2[rest]) - np.maximum(y1[i], y1[rest])
+        )
+        inter = w * h
+        iou = inter / (areas[i] + areas[rest] - inter)
+        order = rest[iou <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+def batched_nms(boxes, scores, class_ids, iou_threshold, agnostic=False):
+    """Class-aware NMS: boxes only suppress boxes of the same class.
+
+    Returns the indices of the kept boxes, by decreasing score.
+    """
+    if len(boxes) == 0 or agnostic:
+        return numpy_nms(boxes, scores, iou_threshold)
+    class_ids = np.asarray(class_ids).reshape(-1).astype(np.int64)
+    scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+    if (
+        hasattr(cv2, "dnn")
+        and hasattr(cv2.dnn, "NMSBoxesBatched")
+        and scores.min() > 0
+    ):
+        keep = cv2.dnn.NMSBoxesBatched(
+            _to_xywh(boxes).tolist(),
+            scores.tolist(),
+            class_ids.tolist(),
+            0.0,
+            float(iou_threshold),
+        )
+        keep = np.asarray(keep, dtype=np.int64).reshape(-1)
+        return keep[np.argsort(-scores[keep], kind="stable")]
+
+    # Offset boxes by class, so that boxes of different classes
+    # never overlap
+    boxes = np.asarray(boxes, dtype=np.float64)[:, :4]
+    offset = boxes.max() - min(boxes.min(), 0) + 1
+    return numpy_nms(
+        boxes + (class_ids * offset)[:, None], scores, iou_threshold
+    )
+
+
+def non_max_suppression(
+    prediction,
+    conf_thres=0.25,
+    iou_thres=0.45,
+    classes=None,
+    agnostic=False,
+    multi_label=False,
+    max_det=1000,
+):
+    """Runs Non-Maximum Suppression (NMS) on YOLOv5-like inference results.
+    This code is borrowed from: https://github.com/ultralytics/yolov5/blob/47233e1698b89fc437a4fb9463c815e9171be955/utils/general.py#L775
+    Args:
+        prediction: (tensor), with shape [B, N, 5 + num_classes],
+            N is the number of bboxes.
+        conf_thres: (float) confidence threshold.
+        iou_thres: (float) iou threshold.
+        classes: (None or list[int]), if a list is provided,
+            nms only keep the classes you provide.
+        agnostic: (bool), when it is set to True, we do class-independent
+            nms, otherwise, different class would do nms respectively.
+        multi_label: (bool), when it is set to True, one box can have multi
+            labels, otherwise, one box only have one label.
+        max_det:(int), max number of output bboxes.
+
+    Returns:
+        list of detections, echo item is one tensor with shape
+        (num_boxes, 6), 6 is for [xyxy, conf, cls].
+    """
+    num_classes = prediction.shape[2] - 5  # number of classes
+    pred_candidates = np.logical_and(
+        prediction[..., 4] > conf_thres,
+        np.max(prediction[..., 5:], axis=-1) > conf_thres,
+    )  # candidates
+    # Check the parameters.
+    assert (
+        0 <= conf_thres <= 1
+    ), f"conf_thresh must be in 0.0 to 1.0, however {conf_thres} is provided."
+    assert (
+        0 <= iou_thres <= 1
+    ), f"iou_thres must be in 0.0 to 1.0, however {iou_thres} is provided."
+
+    # Function settings.
+    max_nms = 30000  # maximum number of boxes put into NMS
+    multi_label &= num_classes > 1  # multiple labels per box
+
+    output = [np.zeros((0, 6))] * prediction.shape[0]
+    for img_idx, x in enumerate(prediction):  # image index, image inference
+        x = x[pred_candidates[img_idx]]  # confidence
+
+        # If no box remains, skip the next process.
+        if not x.shape[0]:
+            continue
+
+        # confidence multiply the objectness
+        x[:, 5:] *= x[:, 4:5]  # conf = obj_conf * cls_conf
+
+        # (center x, center y, width, height) to (x1, y1, x2, y2)
+        box = xywh2xyxy(x[:, :4])
+
+        # Detections matrix's shape is (n,6),
+        # each row represents (xyxy, conf, cls)
+        if multi_label:
+            box_idx, class_idx = np.nonzero(x[:, 5:] > conf_thres)
+            box = box[box_idx]
+            conf = x[box_idx, class_idx + 5][:, None]
+            class_idx = class_idx[:, None].astype(float)
+            x = np.concatenate((box, conf, class_idx), axis=1)
+        else:
+            conf = np.max(x[:, 5:], axis=1, keepdims=True)
+            class_idx = np.argmax(x[:, 5:], axis=1)
+            x = np.concatenate(
+                (box, conf, class_idx[:, None].astype(float)), axis=1
+            )[conf.flatten() > conf_thres]
+
+        # Filter by class, only keep boxes whose category is in classes.
+        if classes is not None:
+            x = x[(x[:, 5:6] == np.array(classes)).any(1)]
+
+        # Check shape
+        num_box = x.shape[0]  # number of boxes
+        if not num_box:  # no boxes kept.
+            continue
+        elif num_box > max_nms:  # excess max boxes' number.
+            x = x[np.argsort(-x[:, 4])[:max_nms]]  # sort by confidence
+
+        # Batched NMS
+        keep_box_idx = batched_nms(
+            x[:, :4], x[:, 4], x[:, 5], iou_thres, agnostic=agnostic
+        )
+        if keep_box_idx.shape[0] > max_det:  # limit detections
+            keep_box_idx = keep_box_idx[:max_det]
+
+        output[img_idx] = x[keep_box_idx]
+
+    return output
@@ -11,6 +11,7 @@ from anylabeling.app_info import __preferred_device__
 from anylabeling.views.labeling.shape import Shape
 from anylabeling.views.labeling.utils.opencv import qt_img_to_rgb_cv_img
 from .model import Model
+from .model_cache import create_inference_session
 from .types import AutoLabelingResult
 from .ppocr_utils.text_system import TextSystem
 
@@ -54,7 +55,7 @@ class PPOCRv4(Model):
 
         if __preferred_device__ == "GPU":
             self.providers = ['CUDAExecutionProvider']
-        net = ort.InferenceSession(
+        net = create_inference_session(
                     model_abs_path, 
                     providers=self.providers,
                     sess_options=self.sess_opts,
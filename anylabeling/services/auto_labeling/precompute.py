@@ -0,0 +1,81 @@
+"""Precompute image embeddings of a whole image list."""
+
+import copy
+import logging
+import threading
+
+import onnxruntime as ort
+
+from anylabeling.views.labeling.utils.opencv import qt_img_to_rgb_cv_img
+
+from .model_cache import create_inference_session
+
+
+def clone_encoders(model, encoder_model_path, num_sessions=1, num_threads=0):
+    """Clone a SAM-like model with one new encoder session per clone.
+
+    The clones share everything with the original model except the encoder
+    session, so they can run the encoder in parallel threads.
+    """
+    if num_sessions <= 1 and not num_threads:
+        return [model]
+    sess_opts = ort.SessionOptions()
+    if num_threads:
+        sess_opts.intra_op_num_threads = int(num_threads)
+    providers = model.encoder_session.get_providers()
+    encoders = []
+    for _ in range(max(1, num_sessions)):
+        encoder = copy.copy(model)
+        encoder.encoder_session = create_inference_session(
+            encoder_model_path, providers=providers, sess_options=sess_opts
+        )
+        encoders.append(encoder)
+    return encoders
+
+
+def precompute_embeddings(
+    store, encoders, filenames, on_progress=None, is_stopped=None
+):
+    """Encode images and save their embeddings to an embedding store.
+
+    Each encoder runs in its own thread. Images already in the store are
+    skipped, so an interrupted job can simply be started again.
+    Returns the number of processed and failed images.
+    """
+    lock = threading.Lock()
+    pending = iter(list(filenames))
+    total = len(filenames)
+    counts = {"done": 0, "failed": 0}
+
+    def _worker(encoder):
+        while True:
+            if is_stopped is not None and is_stopped():
+                return
+            with lock:
+                filename = next(pending, None)
+            if filename is None:
+                return
+            failed = False
+            try:
+                if not store.find(filename):
+                    cv_image = qt_img_to_rgb_cv_img(None, filename)
+                    store.put(filename, encoder.encode(cv_image))
+            except Exception as e:  # noqa
+                logging.warning("Could not encode %s: %s", filename, e)
+                failed = True
+            with lock:
+                counts["done"] += 1
+                counts["failed"] += int(failed)
+                done = counts["done"]
+            if on_progress is not None:
+                on_progress(done, total)
+
+    threads = [
+        threading.Thread(target=_worker, args=(encoder,), daemon=True)
+        for encoder in encoders
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return counts["done"], counts["failed"]
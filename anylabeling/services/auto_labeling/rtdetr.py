@@ -11,6 +11,7 @@ from anylabeling.app_info import __preferred_device__
 from anylabeling.views.labeling.shape import Shape
 from anylabeling.views.labeling.utils.opencv import qt_img_to_rgb_cv_img
 from .model import Model
+from .model_cache import create_inference_session
 from .types import AutoLabelingResult
 
 
@@ -54,12 +55,13 @@ class RTDETR(Model):
         if __preferred_device__ == "GPU":
             self.providers = ['CUDAExecutionProvider']
 
-        self.net = ort.InferenceSession(
+        self.net = create_inference_session(
                         model_abs_path, 
                         providers=self.providers,
                         sess_options=self.sess_opts,
                     )
         self.classes = self.config["classes"]
+        self.check_batch_size(self.net)
 
     @staticmethod
     def bbox_cxcywh_to_xyxy(boxes):
@@ -72,15 +74,15 @@ class RTDETR(Model):
 
         return np.stack([x1, y1, x2, y2], axis=1)
 
-    def pre_process(self, input_image):
+    def prepare_input(self, input_image):
         """
-        Pre-processes the input image before feeding it to the network.
-        
+        Resizes and normalizes the input image to a [1, 3, H, W] blob.
+
         Args:
             input_image (numpy.ndarray): The input image to be processed.
-        
+
         Returns:
-            numpy.ndarray: The pre-processed output.
+            numpy.ndarray: The input blob.
         """
         # Get the image width and height
         image_h, image_w = input_image.shape[:2]
@@ -97,7 +99,19 @@ class RTDETR(Model):
         img = img.transpose(2, 0, 1)
         img = np.expand_dims(img, 0)
         blob = np.ascontiguousarray(img, dtype=np.float32)
+        return blob
 
+    def pre_process(self, input_image):
+        """
+        Pre-processes the input image before feeding it to the network.
+        
+        Args:
+            input_image (numpy.ndarray): The input image to be processed.
+        
+        Returns:
+            numpy.ndarray: The pre-processed output.
+        """
+        blob = self.prepare_input(input_image)
         outs = self.net.run(None, {'image': blob})[0][0]
 
         return outs
@@ -164,6 +178,9 @@ class RTDETR(Model):
         if image is None:
             return []
 
+        if self.use_sliced_inference(image, image_path):
+            return self.predict_shapes_sliced(image, image_path)
+
         try:
             image = qt_img_to_rgb_cv_img(image, image_path)
         except Exception as e:  # noqa
@@ -173,16 +190,51 @@ class RTDETR(Model):
 
         detections = self.pre_process(image)
         boxes = self.post_process(image, detections)
-        shapes = []
+        result = AutoLabelingResult(self.build_shapes(boxes), replace=True)
+        return result
 
+    def predict_shapes_batch(self, images, image_paths=None):
+        """
+        Predict shapes from a list of images with batched inference
+        """
+        if self.get_slice_size() is not None:
+            # Large images are sliced one by one
+            return super().predict_shapes_batch(images, image_paths)
+        cv_images = self.load_rgb_images(images, image_paths)
+        results = [[] for _ in cv_images]
+        indices = [i for i, image in enumerate(cv_images) if image is not None]
+        for batch in self.split_batches(indices):
+            blob = np.concatenate([self.prepare_input(cv_images[i]) for i in batch])
+            outs = self.net.run(None, {'image': blob})[0]
+            for j, i in enumerate(batch):
+                boxes = self.post_process(cv_images[i], outs[j])
+                results[i] = AutoLabelingResult(self.build_shapes(boxes), replace=True)
+        return results
+
+    def detect_batch(self, cv_images):
+        """
+        Detect objects in a list of RGB images with batched inference
+        """
+        detections = []
+        for batch in self.split_batches(cv_images):
+            blob = np.concatenate([self.prepare_input(image) for image in batch])
+            outs = self.net.run(None, {'image': blob})[0]
+            for j, image in enumerate(batch):
+                detections.append(self.post_process(image, outs[j]))
+        return detections
+
+    @staticmethod
+    def build_shapes(boxes):
+        """
+        Convert post-processed detections to shapes
+        """
+        shapes = []
         for box in boxes:
             shape = Shape(label=box["label"], shape_type="rectangle", flags={})
             shape.add_point(QtCore.QPointF(box["x1"], box["y1"]))
             shape.add_point(QtCore.QPointF(box["x2"], box["y2"]))
             shapes.append(shape)
-
-        result = AutoLabelingResult(shapes, replace=True)
-        return result
+        return shapes
 
     def unload(self):
         del self.net
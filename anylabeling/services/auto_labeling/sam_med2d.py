@@ -14,8 +14,11 @@ from anylabeling.utils import GenericWorker
 from anylabeling.views.labeling.shape import Shape
 from anylabeling.views.labeling.utils.opencv import qt_img_to_rgb_cv_img
 
-from .lru_cache import LRUCache
+from .mask_ops import upsample_mask_roi
+from .embedding_mixin import EmbeddingMixin
+from .metrics import traced
 from .model import Model
+from .model_cache import create_inference_session
 from .types import AutoLabelingResult
 
 class SegmentAnythingONNX:
@@ -39,8 +42,8 @@ class SegmentAnythingONNX:
         else:
             logging.warning("No available providers for ONNXRuntime")
 
-        self.encoder_session = ort.InferenceSession(encoder_model_path, providers=providers)
-        self.decoder_session = ort.InferenceSession(decoder_model_path, providers=providers)
+        self.encoder_session = create_inference_session(encoder_model_path, providers=providers)
+        self.decoder_session = create_inference_session(decoder_model_path, providers=providers)
 
         self.encoder_input_name = self.encoder_session.get_inputs()[0].name
         self.encoder_input_shape = self.encoder_session.get_inputs()[0].shape
@@ -77,6 +80,7 @@ class SegmentAnythingONNX:
 
         return input_image
 
+    @traced()
     def encode(self, cv_image):
         """
         Calculate embedding and metadata for a single image.
@@ -116,8 +120,10 @@ class SegmentAnythingONNX:
         coords[..., 1] = coords[..., 1] * (new_h / old_h)
         return coords
 
-    def run_decoder(self, image_embedding, original_size, prompt):
-        """Run decoder"""
+    @traced()
+    def run_decoder(self, image_embedding, original_size, prompt, output_size=None):
+        """Run decoder. The masks are resized to output_size (H, W), by
+        default the original image size."""
         point_coords, point_labels = self.get_input_points(prompt)
 
         if point_coords is None or point_labels is None:
@@ -148,7 +154,7 @@ class SegmentAnythingONNX:
                       "point_labels": point_labels,
                       "mask_input": mask_input,
                       "has_mask_input": has_mask_input,
-                      "orig_im_size": np.array(original_size, dtype=np.float32)}
+                      "orig_im_size": np.array(output_size or original_size, dtype=np.float32)}
         masks, _, _ = self.decoder_session.run(None, input_dict)
 
         return masks
@@ -165,7 +171,34 @@ class SegmentAnythingONNX:
 
         return masks
 
-class SAM_Med2D(Model):
+    def predict_mask_roi(self, embedding, prompt):
+        """
+        Predict the mask of an object for a single image, upsampled to the
+        original image size in the region of the object only.
+        Returns the binary mask of the region and its (x, y) offset.
+        """
+        # Decode at the encoder input size, the image is stretched to it
+        input_h, input_w = self.encoder_input_size
+        masks = self.run_decoder(
+            embedding["image_embedding"],
+            embedding["original_size"],
+            prompt,
+            output_size=(input_h, input_w),
+        )
+        height, width = embedding["original_size"]
+        scale_x, scale_y = width / input_w, height / input_h
+        transform_matrix = np.array(
+            [
+                [scale_x, 0, 0.5 * scale_x - 0.5],
+                [0, scale_y, 0.5 * scale_y - 0.5],
+            ]
+        )
+        mask = masks[0][0] if len(masks.shape) == 4 else masks[0]
+        return upsample_mask_roi(
+            mask, transform_matrix, embedding["original_size"]
+        )
+
+class SAM_Med2D(EmbeddingMixin, Model):
     """Segmentation model using SAM_Med2D"""
 
     class Meta:
@@ -232,9 +265,7 @@ class SAM_Med2D(Model):
         self.marks = []
 
         # Cache for image embedding
-        self.cache_size = 10
-        self.preloaded_size = self.cache_size - 3
-        self.image_embedding_cache = LRUCache(self.cache_size)
+        self.init_embedding_cache(encoder_model_abs_path)
 
         # Pre-inference worker
         self.pre_inference_thread = None
@@ -245,16 +276,18 @@ class SAM_Med2D(Model):
         """Set auto labeling marks"""
         self.marks = marks
 
-    def post_process(self, masks):
+    @traced()
+    def post_process(self, masks, offset=(0, 0)):
         """
-        Post process masks
+        Post process masks. The masks may be a region of the image at
+        offset (x, y).
         """
         # Find contours
         masks[masks > 0.0] = 255
         masks[masks <= 0.0] = 0
         masks = masks.astype(np.uint8)
         contours, _ = cv2.findContours(
-            masks, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE
+            masks, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE, offset=offset
         )
 
         # Refine contours
@@ -361,26 +394,24 @@ class SAM_Med2D(Model):
         shapes = []
         try:
             # Use cached image embedding if possible
-            cached_data = self.image_embedding_cache.get(filename)
+            cached_data = self.get_cached_embedding(filename)
             if cached_data is not None:
                 image_embedding = cached_data
             else:
-                cv_image = qt_img_to_rgb_cv_img(image, filename)
+                with self.span("decode"):
+                    cv_image = qt_img_to_rgb_cv_img(image, filename)
                 if self.stop_inference:
                     return AutoLabelingResult([], replace=False)
-                image_embedding = self.model.encode(cv_image)
-                self.image_embedding_cache.put(
-                    filename,
-                    image_embedding,
+                image_embedding = self.cache_embedding(
+                    filename, self.model.encode(cv_image)
                 )
             if self.stop_inference:
                 return AutoLabelingResult([], replace=False)
-            masks = self.model.predict_masks(image_embedding, self.marks)
-            if len(masks.shape) == 4:
-                masks = masks[0][0]
-            else:
-                masks = masks[0]
-            shapes = self.post_process(masks)
+            mask, offset = self.model.predict_mask_roi(
+                image_embedding, self.marks
+            )
+            if mask is not None:
+                shapes = self.post_process(mask, offset)
         except Exception as e:  # noqa
             logging.warning("Could not inference model")
             logging.warning(e)
@@ -399,9 +430,13 @@ class SAM_Med2D(Model):
         """
         Preload next files, run inference and cache results
         """
-        files = files[: self.preloaded_size]
+        files = files[: self.get_preloaded_size()]
         for filename in files:
-            if self.image_embedding_cache.find(filename):
+            if self.image_embedding_cache.find(
+                (self.encoder_model_abs_path, filename)
+            ):
+                continue
+            if self.get_cached_embedding(filename) is not None:
                 continue
             image = self.load_image_from_filename(filename)
             if image is None:
@@ -410,10 +445,7 @@ class SAM_Med2D(Model):
                 return
             cv_image = qt_img_to_rgb_cv_img(image)
             image_embedding = self.model.encode(cv_image)
-            self.image_embedding_cache.put(
-                filename,
-                image_embedding,
-            )
+            self.cache_embedding(filename, image_embedding)
 
     def on_next_files_changed(self, next_files):
         """
@@ -1,15 +1,22 @@
 import logging
+import math
 from copy import deepcopy
 
 import cv2
 import numpy as np
 import onnxruntime
 
+from .mask_ops import get_stability_scores, mask_nms, upsample_mask_roi
+from .metrics import traced
+from .model_cache import create_inference_session
+
 
 class SegmentAnythingONNX:
     """Segmentation model using SegmentAnything"""
 
-    def __init__(self, encoder_model_path, decoder_model_path) -> None:
+    def __init__(
+        self, encoder_model_path, decoder_model_path, decoder_batch_size=16
+    ) -> None:
         self.target_size = 1024
         self.input_size = (684, 1024)
 
@@ -26,13 +33,22 @@ class SegmentAnythingONNX:
             )
         else:
             logging.warning("No available providers for ONNXRuntime")
-        self.encoder_session = onnxruntime.InferenceSession(
+        self.encoder_session = create_inference_session(
             encoder_model_path, providers=providers
         )
         self.encoder_input_name = self.encoder_session.get_inputs()[0].name
-        self.decoder_session = onnxruntime.InferenceSession(
+        self.decoder_session = create_inference_session(
             decoder_model_path, providers=providers
         )
+        # Number of prompts decoded per run of the decoder when segmenting
+        # everything. Decoders exported with a fixed batch axis decode one
+        # prompt at a time.
+        self.decoder_batch_size = max(1, int(decoder_batch_size))
+        for decoder_input in self.decoder_session.get_inputs():
+            if decoder_input.name == "point_coords" and isinstance(
+                decoder_input.shape[0], int
+            ):
+                self.decoder_batch_size = 1
 
     def get_input_points(self, prompt):
         """Get input points"""
@@ -83,10 +99,24 @@ class SegmentAnythingONNX:
         coords[..., 1] = coords[..., 1] * (new_h / old_h)
         return coords
 
+    @traced()
     def run_decoder(
         self, image_embedding, original_size, transform_matrix, prompt
     ):
         """Run decoder"""
+        masks = self.decode(image_embedding, transform_matrix, prompt)
+
+        # Transform the masks back to the original image size.
+        inv_transform_matrix = np.linalg.inv(transform_matrix)
+        transformed_masks = self.transform_masks(
+            masks, original_size, inv_transform_matrix
+        )
+
+        return transformed_masks
+
+    @traced()
+    def decode(self, image_embedding, transform_matrix, prompt):
+        """Run decoder, returns the masks at the input size"""
         input_points, input_labels = self.get_input_points(prompt)
 
         # Add a batch index, concatenate a padding point, and transform.
@@ -124,15 +154,9 @@ class SegmentAnythingONNX:
             "orig_im_size": np.array(self.input_size, dtype=np.float32),
         }
         masks, _, _ = self.decoder_session.run(None, decoder_inputs)
+        return masks
 
-        # Transform the masks back to the original image size.
-        inv_transform_matrix = np.linalg.inv(transform_matrix)
-        transformed_masks = self.transform_masks(
-            masks, original_size, inv_transform_matrix
-        )
-
-        return transformed_masks
-
+    @traced()
     def transform_masks(self, masks, original_size, transform_matrix):
         """Transform masks
         Transform the masks back to the original image size.
@@ -152,6 +176,7 @@ class SegmentAnythingONNX:
             output_masks.append(batch_masks)
         return np.array(output_masks)
 
+    @traced()
     def encode(self, cv_image):
         """
         Calculate embedding and metadata for a single image.
@@ -197,4 +222,129 @@ class SegmentAnythingONNX:
             prompt,
         )
 
-        return masks
\ No newline at end of file
+        return masks
+
+    def predict_mask_roi(self, embedding, prompt):
+        """
+        Predict the mask of an object for a single image, upsampled to the
+        original image size in the region of the object only.
+        Returns the binary mask of the region and its (x, y) offset.
+        """
+        masks = self.decode(
+            embedding["image_embedding"],
+            embedding["transform_matrix"],
+            prompt,
+        )
+        mask = masks[0][0] if len(masks.shape) == 4 else masks[0]
+        return upsample_mask_roi(
+            mask,
+            np.linalg.inv(embedding["transform_matrix"]),
+            embedding["original_size"],
+        )
+
+    @traced()
+    def generate_masks(
+        self,
+        embedding,
+        points_per_side=32,
+        pred_iou_thresh=0.88,
+        stability_score_thresh=0.95,
+        mask_nms_thresh=0.7,
+    ):
+        """
+        Segment everything: decode a grid of single point prompts over the
+        image, keep the confident and stable masks and remove duplicates
+        by mask NMS. The masks are filtered on the low resolution logits
+        of the decoder, only the kept ones are upsampled.
+        Returns a list of (mask, offset) pairs, see predict_mask_roi.
+        """
+        image_embedding = embedding["image_embedding"]
+        transform_matrix = embedding["transform_matrix"]
+        original_size = embedding["original_size"]
+
+        # One positive point and a padding point per prompt
+        steps = (np.arange(points_per_side) + 0.5) / points_per_side
+        grid_x, grid_y = np.meshgrid(
+            steps * original_size[1], steps * original_size[0]
+        )
+        points = np.stack([grid_x.ravel(), grid_y.ravel()], axis=1)
+        onnx_coords = np.stack([points, np.zeros_like(points)], axis=1)
+        onnx_coords = self.apply_coords(
+            onnx_coords, self.input_size, self.target_size
+        )
+        onnx_coords = (
+            onnx_coords @ transform_matrix[:2, :2].T + transform_matrix[:2, 2]
+        ).astype(np.float32)
+        onnx_labels = np.tile(
+            np.array([1, -1], dtype=np.float32), (len(points), 1)
+        )
+
+        # Region of the image in the low resolution masks
+        image_h = original_size[0] * transform_matrix[1, 1]
+        image_w = original_size[1] * transform_matrix[0, 0]
+
+        logits, scores = [], []
+        start = 0
+        while start < len(points):
+            end = start + self.decoder_batch_size
+            try:
+                _, iou_predictions, low_res_masks = self.decoder_session.run(
+                    None,
+                    {
+                        "image_embeddings": image_embedding,
+                        "point_coords": onnx_coords[start:end],
+                        "point_labels": onnx_labels[start:end],
+                        "mask_input": np.zeros(
+                            (1, 1, 256, 256), dtype=np.float32
+                        ),
+                        "has_mask_input": np.zeros(1, dtype=np.float32),
+                        "orig_im_size": np.array(
+                            self.input_size, dtype=np.float32
+                        ),
+                    },
+                )
+            except Exception as e:  # noqa
+                if self.decoder_batch_size == 1:
+                    raise
+                logging.warning(
+                    "Batched decoding failed, decoding prompts one by one: %s",
+                    e,
+                )
+                self.decoder_batch_size = 1
+                continue
+            start = end
+
+            scale = self.target_size / low_res_masks.shape[-1]
+            low_res_masks = low_res_masks[
+                ..., : math.ceil(image_h / scale), : math.ceil(image_w / scale)
+            ]
+            low_res_masks = low_res_masks.reshape(
+                -1, *low_res_masks.shape[-2:]
+            )
+            iou_predictions = iou_predictions.reshape(-1)
+            keep = (iou_predictions > pred_iou_thresh) & (
+                get_stability_scores(low_res_masks) > stability_score_thresh
+            )
+            logits.append(low_res_masks[keep])
+            scores.append(iou_predictions[keep])
+
+        logits = np.concatenate(logits)
+        scores = np.concatenate(scores)
+        if len(logits) == 0:
+            return []
+        keep = mask_nms(logits > 0.0, scores, mask_nms_thresh)
+
+        # Low resolution masks to the input size (align_corners=False),
+        # then to the original image
+        low_res_matrix = np.array(
+            [
+                [scale, 0, 0.5 * scale - 0.5],
+                [0, scale, 0.5 * scale - 0.5],
+                [0, 0, 1],
+            ]
+        )
+        mask_matrix = np.linalg.inv(transform_matrix) @ low_res_matrix
+        return [
+            upsample_mask_roi(logits[i], mask_matrix, original_size)
+            for i in keep
+        ]
@@ -12,13 +12,14 @@ from anylabeling.utils import GenericWorker
 from anylabeling.views.labeling.shape import Shape
 from anylabeling.views.labeling.utils.opencv import qt_img_to_rgb_cv_img
 
-from .lru_cache import LRUCache
+from .embedding_mixin import EmbeddingMixin
+from .metrics import traced
 from .model import Model
 from .types import AutoLabelingResult
 from .sam_onnx import SegmentAnythingONNX
 
 
-class SegmentAnything(Model):
+class SegmentAnything(EmbeddingMixin, Model):
     """Segmentation model using SegmentAnything"""
 
     class Meta:
@@ -32,6 +33,7 @@ class SegmentAnything(Model):
         widgets = [
             "output_label",
             "output_select_combobox",
+            "button_run",
             "button_add_point",
             "button_remove_point",
             "button_add_rect",
@@ -41,6 +43,7 @@ class SegmentAnything(Model):
         output_modes = {
             "polygon": QCoreApplication.translate("Model", "Polygon"),
             "rectangle": QCoreApplication.translate("Model", "Rectangle"),
+            "everything": QCoreApplication.translate("Model", "Everything"),
         }
         default_output_mode = "polygon"
 
@@ -79,17 +82,25 @@ class SegmentAnything(Model):
 
         # Load models
         self.model = SegmentAnythingONNX(
-            encoder_model_abs_path, decoder_model_abs_path
+            encoder_model_abs_path,
+            decoder_model_abs_path,
+            self.config.get("decoder_batch_size", 16),
         )
 
+        # Parameters of the "everything" mode (automatic mask generation)
+        self.points_per_side = self.config.get("points_per_side", 32)
+        self.pred_iou_thresh = self.config.get("pred_iou_thresh", 0.88)
+        self.stability_score_thresh = self.config.get(
+            "stability_score_thresh", 0.95
+        )
+        self.mask_nms_thresh = self.config.get("mask_nms_thresh", 0.7)
+
         # Mark for auto labeling
         # points, rectangles
         self.marks = []
 
         # Cache for image embedding
-        self.cache_size = 10
-        self.preloaded_size = self.cache_size - 3
-        self.image_embedding_cache = LRUCache(self.cache_size)
+        self.init_embedding_cache(encoder_model_abs_path)
 
         # Pre-inference worker
         self.pre_inference_thread = None
@@ -100,16 +111,18 @@ class SegmentAnything(Model):
         """Set auto labeling marks"""
         self.marks = marks
 
-    def post_process(self, masks):
+    @traced()
+    def post_process(self, masks, offset=(0, 0)):
         """
-        Post process masks
+        Post process masks. The masks may be a region of the image at
+        offset (x, y).
         """
         # Find contours
         masks[masks > 0.0] = 255
         masks[masks <= 0.0] = 0
         masks = masks.astype(np.uint8)
         contours, _ = cv2.findContours(
-            masks, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE
+            masks, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE, offset=offset
         )
 
         # Refine contours
@@ -144,7 +157,7 @@ class SegmentAnything(Model):
 
         # Contours to shapes
         shapes = []
-        if self.output_mode == "polygon":
+        if self.output_mode in ("polygon", "everything"):
             for approx in approx_contours:
                 # Scale points
                 points = approx.reshape(-1, 2)
@@ -209,32 +222,35 @@ class SegmentAnything(Model):
         """
         Predict shapes from image
         """
-        if image is None or not self.marks:
+        everything = not self.marks and self.output_mode == "everything"
+        if image is None or not (self.marks or everything):
             return AutoLabelingResult([], replace=False)
-        
+
         shapes = []
         try:
             # Use cached image embedding if possible
-            cached_data = self.image_embedding_cache.get(filename)
+            cached_data = self.get_cached_embedding(filename)
             if cached_data is not None:
                 image_embedding = cached_data
             else:
-                cv_image = qt_img_to_rgb_cv_img(image, filename)
+                with self.span("decode"):
+                    cv_image = qt_img_to_rgb_cv_img(image, filename)
                 if self.stop_inference:
                     return AutoLabelingResult([], replace=False)
-                image_embedding = self.model.encode(cv_image)
-                self.image_embedding_cache.put(
-                    filename,
-                    image_embedding,
+                image_embedding = self.cache_embedding(
+                    filename, self.model.encode(cv_image)
                 )
             if self.stop_inference:
                 return AutoLabelingResult([], replace=False)
-            masks = self.model.predict_masks(image_embedding, self.marks)
-            if len(masks.shape) == 4:
-                masks = masks[0][0]
-            else:
-                masks = masks[0]
-            shapes = self.post_process(masks)
+            if everything:
+                return AutoLabelingResult(
+                    self.segment_everything(image_embedding), replace=False
+                )
+            mask, offset = self.model.predict_mask_roi(
+                image_embedding, self.marks
+            )
+            if mask is not None:
+                shapes = self.post_process(mask, offset)
         except Exception as e:  # noqa
             logging.warning("Could not inference model")
             logging.warning(e)
@@ -244,6 +260,26 @@ class SegmentAnything(Model):
         result = AutoLabelingResult(shapes, replace=False)
         return result
 
+    def segment_everything(self, image_embedding):
+        """
+        Propose a polygon for every object of an image, from a grid of
+        point prompts
+        """
+        shapes = []
+        for mask, offset in self.model.generate_masks(
+            image_embedding,
+            points_per_side=self.points_per_side,
+            pred_iou_thresh=self.pred_iou_thresh,
+            stability_score_thresh=self.stability_score_thresh,
+            mask_nms_thresh=self.mask_nms_thresh,
+        ):
+            if mask is not None:
+                shapes.extend(self.post_process(mask, offset))
+        # Regular shapes, not replaced by the next prompt
+        for shape in shapes:
+            shape.label = "object"
+        return shapes
+
     def unload(self):
         self.stop_inference = True
         if self.pre_inference_thread:
@@ -253,9 +289,13 @@ class SegmentAnything(Model):
         """
         Preload next files, run inference and cache results
         """
-        files = files[: self.preloaded_size]
+        files = files[: self.get_preloaded_size()]
         for filename in files:
-            if self.image_embedding_cache.find(filename):
+            if self.image_embedding_cache.find(
+                (self.encoder_model_abs_path, filename)
+            ):
+                continue
+            if self.get_cached_embedding(filename) is not None:
                 continue
             image = self.load_image_from_filename(filename)
             if image is None:
@@ -264,10 +304,7 @@ class SegmentAnything(Model):
                 return
             cv_image = qt_img_to_rgb_cv_img(image)
             image_embedding = self.model.encode(cv_image)
-            self.image_embedding_cache.put(
-                filename,
-                image_embedding,
-            )
+            self.cache_embedding(filename, image_embedding)
 
     def on_next_files_changed(self, next_files):
         """
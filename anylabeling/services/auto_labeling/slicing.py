@@ -0,0 +1,271 @@
+"""Sliced inference on large images.
+
+Large images are cut into overlapping tiles of the input size of the
+model, the tiles are run through the model in batches, and the
+detections of all tiles are merged, so that small objects are not lost
+when the whole image is downscaled to the input size. Tiles are read
+through a windowed reader when the image format allows it, otherwise
+from the decoded image.
+"""
+
+import logging
+import os
+
+import cv2
+import numpy as np
+
+from anylabeling.views.labeling.utils.opencv import (
+    DecodedImage,
+    qt_img_to_rgb_cv_img,
+)
+
+# Formats read by OpenSlide (whole slide images)
+OPENSLIDE_EXTENSIONS = (
+    ".svs",
+    ".ndpi",
+    ".mrxs",
+    ".scn",
+    ".vms",
+    ".vmu",
+    ".bif",
+    ".svslide",
+)
+# Formats read by rasterio (e.g. GeoTIFF)
+RASTERIO_EXTENSIONS = (".tif", ".tiff", ".jp2", ".img", ".vrt")
+
+
+class ArrayTileReader:
+    """Read tiles from a decoded RGB image"""
+
+    def __init__(self, array):
+        self.array = array
+        self.height, self.width = array.shape[:2]
+
+    def read(self, x, y, width, height):
+        return self.array[y : y + height, x : x + width]
+
+    def read_thumbnail(self, max_size):
+        scale = max_size / max(self.width, self.height)
+        if scale >= 1:
+            return self.array
+        return cv2.resize(
+            self.array,
+            (round(self.width * scale), round(self.height * scale)),
+            interpolation=cv2.INTER_AREA,
+        )
+
+    def close(self):
+        pass
+
+
+class OpenSlideTileReader:
+    """Read tiles from the full resolution level of a whole slide image"""
+
+    def __init__(self, filename):
+        import openslide
+
+        self.slide = openslide.OpenSlide(filename)
+        self.width, self.height = self.slide.dimensions
+
+    def read(self, x, y, width, height):
+        region = self.slide.read_region((x, y), 0, (width, height))
+        return np.asarray(region.convert("RGB"))
+
+    def read_thumbnail(self, max_size):
+        thumbnail = self.slide.get_thumbnail((max_size, max_size))
+        return np.asarray(thumbnail.convert("RGB"))
+
+    def close(self):
+        self.slide.close()
+
+
+class RasterioTileReader:
+    """Read tiles from an 8bit raster (e.g. a tiled GeoTIFF)"""
+
+    def __init__(self, filename):
+        import rasterio
+
+        self.dataset = rasterio.open(filename)
+        if self.dataset.count not in (1, 3, 4) or any(
+            dtype != "uint8" for dtype in self.dataset.dtypes
+        ):
+            self.dataset.close()
+            raise ValueError("Only 8bit gray, RGB and RGBA rasters")
+        self.width, self.height = self.dataset.width, self.dataset.height
+        self.bands = [1, 1, 1] if self.dataset.count == 1 else [1, 2, 3]
+
+    @staticmethod
+    def to_rgb(bands):
+        return np.ascontiguousarray(bands.transpose(1, 2, 0))
+
+    def read(self, x, y, width, height):
+        from rasterio.windows import Window
+
+        return self.to_rgb(
+            self.dataset.read(self.bands, window=Window(x, y, width, height))
+        )
+
+    def read_thumbnail(self, max_size):
+        scale = min(1.0, max_size / max(self.width, self.height))
+        out_shape = (
+            len(self.bands),
+            max(1, round(self.height * scale)),
+            max(1, round(self.width * scale)),
+        )
+        # Uses the overviews of the raster if available
+        return self.to_rgb(self.dataset.read(self.bands, out_shape=out_shape))
+
+    def close(self):
+        self.dataset.close()
+
+
+def open_windowed_reader(image_path):
+    """Open a windowed reader for an image file. Returns None if the
+    format is not supported or if its optional dependency
+    (openslide-python or rasterio) is not installed."""
+    extension = os.path.splitext(image_path)[1].lower()
+    readers = []
+    if extension in OPENSLIDE_EXTENSIONS:
+        readers.append(OpenSlideTileReader)
+    if extension in RASTERIO_EXTENSIONS:
+        readers.append(RasterioTileReader)
+    for reader in readers:
+        try:
+            return reader(image_path)
+        except ImportError:
+            continue
+        except Exception as e:  # noqa
+            logging.warning(
+                "Could not open %s with %s: %s",
+                image_path,
+                reader.__name__,
+                e,
+            )
+    return None
+
+
+def get_image_size(image, image_path=None):
+    """(width, height) of an image, or None if unknown.
+
+    The size of a file with a windowed reader is read from its header, so
+    the image does not have to be decoded.
+    """
+    reader = open_windowed_reader(image_path) if image_path else None
+    if reader is not None:
+        try:
+            return reader.width, reader.height
+        finally:
+            reader.close()
+    if image is None:
+        return None
+    return image.width(), image.height()
+
+
+def open_tile_reader(image, image_path=None):
+    """Open a tile reader for an image.
+
+    The file is read through a windowed reader when its format allows
+    it, even if the image is already decoded, since the reader does not
+    copy the whole image. Otherwise tiles are sliced from the decoded
+    image, which is decoded from the file if needed. Raises ValueError if
+    the image cannot be read.
+    """
+    reader = open_windowed_reader(image_path) if image_path else None
+    if reader is not None:
+        return reader
+    if image is None and image_path:
+        image = DecodedImage.from_file(image_path)
+    if image is None:
+        raise ValueError(f"Could not read image: {image_path}")
+    return ArrayTileReader(qt_img_to_rgb_cv_img(image, image_path))
+
+
+def get_slice_windows(width, height, slice_width, slice_height, overlap):
+    """Windows (x, y, w, h) of the tiles covering an image. Tiles overlap
+    by the given ratio of the tile size, the last tiles of a row or column
+    are moved inside the image."""
+    slice_width = min(slice_width, width)
+    slice_height = min(slice_height, height)
+
+    def _starts(size, slice_size):
+        step = max(1, int(slice_size * (1 - overlap)))
+        starts = list(range(0, max(1, size - slice_size + 1), step))
+        if starts[-1] + slice_size < size:
+            starts.append(size - slice_size)
+        return starts
+
+    return [
+        (x, y, slice_width, slice_height)
+        for y in _starts(height, slice_height)
+        for x in _starts(width, slice_width)
+    ]
+
+
+def shift_infos(infos, dx, dy, scale=1.0):
+    """Move detections of a tile to image coordinates"""
+    for info in infos:
+        info["x1"] = float(info["x1"]) * scale + dx
+        info["y1"] = float(info["y1"]) * scale + dy
+        info["x2"] = float(info["x2"]) * scale + dx
+        info["y2"] = float(info["y2"]) * scale + dy
+        if "points" in info:
+            info["points"] = [
+                [float(x) * scale + dx, float(y) * scale + dy]
+                for x, y in info["points"]
+            ]
+    return infos
+
+
+def get_overlaps(box, boxes, metric="ios"):
+    """Overlap of a box with other boxes: intersection over union ("iou")
+    or over the smaller box ("ios"). IOS also matches the partial boxes of
+    objects cut by the border of a tile."""
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    intersection = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    if metric == "iou":
+        denominator = area + areas - intersection
+    else:
+        denominator = np.minimum(area, areas)
+    return intersection / np.maximum(denominator, 1e-9)
+
+
+def merge_infos(infos, method="nms", threshold=0.5, metric="ios"):
+    """Merge the detections of overlapping tiles, by label.
+
+    "nms" keeps the best detection of each group of matching detections,
+    "wbf" (weighted boxes fusion) replaces the group by the average of
+    its boxes, weighted by their scores. Polygons are taken from the best
+    detection of a group.
+    """
+    merged = []
+    for label in dict.fromkeys(info["label"] for info in infos):
+        group = [info for info in infos if info["label"] == label]
+        group.sort(key=lambda info: -float(info["score"]))
+        boxes = np.array(
+            [[i["x1"], i["y1"], i["x2"], i["y2"]] for i in group],
+            dtype=np.float64,
+        )
+        scores = np.array([float(i["score"]) for i in group])
+        remaining = np.ones(len(group), dtype=bool)
+        for i in range(len(group)):
+            if not remaining[i]:
+                continue
+            matches = np.flatnonzero(remaining)
+            matches = matches[
+                get_overlaps(boxes[i], boxes[matches], metric) >= threshold
+            ]
+            remaining[matches] = False
+            info = dict(group[i])
+            if method == "wbf" and len(matches) > 1:
+                weights = scores[matches] / scores[matches].sum()
+                x1, y1, x2, y2 = weights @ boxes[matches]
+                info.update(
+                    x1=x1, y1=y1, x2=x2, y2=y2, score=scores[matches].mean()
+                )
+            merged.append(info)
+    return merged
@@ -10,7 +10,9 @@ from PyQt5.QtCore import QCoreApplication
 from anylabeling.app_info import __preferred_device__
 from anylabeling.views.labeling.shape import Shape
 from anylabeling.views.labeling.utils.opencv import qt_img_to_rgb_cv_img
+from . import ops
 from .model import Model
+from .model_cache import create_inference_session
 from .types import AutoLabelingResult
 
 YOLO_NAS_DEFAULT_PROCESSING_STEPS = [
@@ -228,7 +230,7 @@ class YOLO_NAS(Model):
         if __preferred_device__ == "GPU":
             self.providers = ['CUDAExecutionProvider']
 
-        self.net = ort.InferenceSession(
+        self.net = create_inference_session(
                         model_abs_path, 
                         providers=self.providers,
                         sess_options=self.sess_opts,
@@ -244,6 +246,7 @@ class YOLO_NAS(Model):
             self.config["nms_threshold"],
             self.config["score_threshold"],
         )
+        self.check_batch_size(self.net)
 
     def predict_shapes(self, image, image_path=None):
         """
@@ -253,6 +256,9 @@ class YOLO_NAS(Model):
         if image is None:
             return []
 
+        if self.use_sliced_inference(image, image_path):
+            return self.predict_shapes_sliced(image, image_path)
+
         try:
             image = qt_img_to_rgb_cv_img(image, image_path)
         except Exception as e:  # noqa
@@ -264,12 +270,92 @@ class YOLO_NAS(Model):
         inputs = self.net.get_inputs()[0].name
         outputs = self.net.run(None, {inputs: input_})
         boxes, scores, classes = self.post_process(outputs, prep_meta)
+        result = AutoLabelingResult(
+            self.build_shapes(boxes, scores, classes), replace=True
+        )
+        return result
+
+    def predict_shapes_batch(self, images, image_paths=None):
+        """
+        Predict shapes from a list of images with batched inference
+        """
+        if self.get_slice_size() is not None:
+            # Large images are sliced one by one
+            return super().predict_shapes_batch(images, image_paths)
+        cv_images = self.load_rgb_images(images, image_paths)
+        results = [[] for _ in cv_images]
+        indices = [i for i, image in enumerate(cv_images) if image is not None]
+        inputs = self.net.get_inputs()[0].name
+        for batch in self.split_batches(indices):
+            blobs, prep_metas = zip(*[self.pre_process(cv_images[i]) for i in batch])
+            batch_boxes, batch_scores = self.net.run(
+                None, {inputs: np.concatenate(blobs)}
+            )[:2]
+            for j, i in enumerate(batch):
+                boxes, scores, classes = self.post_process(
+                    [batch_boxes[j : j + 1], batch_scores[j : j + 1]],
+                    prep_metas[j],
+                )
+                results[i] = AutoLabelingResult(
+                    self.build_shapes(boxes, scores, classes), replace=True
+                )
+        return results
+
+    def select_boxes(self, boxes, scores, classes):
+        """
+        Filter post-processed detections by score and run NMS on them.
+        Returns the indices of the selected boxes.
+        """
         score_thres = self.config["score_threshold"]
         iou_thres = self.config["nms_threshold"]
-        selected = cv2.dnn.NMSBoxes(boxes, scores, score_thres, iou_thres)
+        candidates = np.flatnonzero(scores > score_thres)
+        boxes_xyxy = boxes[candidates].copy()
+        boxes_xyxy[:, 2:] += boxes_xyxy[:, :2]
+        return candidates[
+            ops.batched_nms(
+                boxes_xyxy,
+                scores[candidates],
+                classes[candidates],
+                iou_thres,
+            )
+        ]
 
+    def detect_batch(self, cv_images):
+        """
+        Detect objects in a list of RGB images with batched inference
+        """
+        detections = []
+        inputs = self.net.get_inputs()[0].name
+        for batch in self.split_batches(cv_images):
+            blobs, prep_metas = zip(*[self.pre_process(image) for image in batch])
+            batch_boxes, batch_scores = self.net.run(
+                None, {inputs: np.concatenate(blobs)}
+            )[:2]
+            for j in range(len(batch)):
+                boxes, scores, classes = self.post_process(
+                    [batch_boxes[j : j + 1], batch_scores[j : j + 1]],
+                    prep_metas[j],
+                )
+                infos = []
+                for i in self.select_boxes(boxes, scores, classes):
+                    x, y, w, h = boxes[i, :].flatten()
+                    infos.append({
+                        "x1": x,
+                        "y1": y,
+                        "x2": x + w,
+                        "y2": y + h,
+                        "label": self.config["classes"][classes[i]],
+                        "score": scores[i],
+                    })
+                detections.append(infos)
+        return detections
+
+    def build_shapes(self, boxes, scores, classes):
+        """
+        Run NMS on post-processed detections and convert them to shapes
+        """
         shapes = []
-        for i in selected:
+        for i in self.select_boxes(boxes, scores, classes):
             box = boxes[i, :].astype(np.int32).flatten()
             x, y, w, h = box[0], box[1], box[2], box[3]
             label = self.config["classes"][classes[i]]
@@ -277,9 +363,7 @@ class YOLO_NAS(Model):
             shape.add_point(QtCore.QPointF(x, y))
             shape.add_point(QtCore.QPointF(x + w, y + h))
             shapes.append(shape)
-
-        result = AutoLabelingResult(shapes, replace=True)
-        return result
+        return shapes
 
     def unload(self):
         del self.net
@@ -13,19 +13,34 @@ from anylabeling.app_info import __preferred_device__
 from anylabeling.views.labeling.shape import Shape
 from anylabeling.views.labeling.utils.opencv import qt_img_to_rgb_cv_img
 
+from . import ops
+from .mask_ops import upsample_mask_roi
+from .embedding_mixin import EmbeddingMixin
+from .metrics import traced
 from .model import Model
+from .model_cache import create_inference_session
 from .types import AutoLabelingResult
 
 
 class SegmentAnythingONNX:
     """Segmentation model using SegmentAnything"""
 
-    def __init__(self, encoder_session, decoder_session, target_size, input_size) -> None:
+    def __init__(
+        self, encoder_session, decoder_session, target_size, input_size, decoder_batch_size=16
+    ) -> None:
         self.target_size = target_size
         self.input_size = input_size
         self.encoder_session = encoder_session
         self.encoder_input_name = self.encoder_session.get_inputs()[0].name
         self.decoder_session = decoder_session
+        # Number of objects decoded per run of the decoder. Decoders exported
+        # with a fixed batch axis decode one object at a time.
+        self.decoder_batch_size = max(1, int(decoder_batch_size))
+        for decoder_input in self.decoder_session.get_inputs():
+            if decoder_input.name == "point_coords" and isinstance(
+                decoder_input.shape[0], int
+            ):
+                self.decoder_batch_size = 1
 
     def get_input_points(self, prompt):
         """Get input points"""
@@ -76,15 +91,10 @@ class SegmentAnythingONNX:
         coords[..., 1] = coords[..., 1] * (new_h / old_h)
         return coords
 
-    def run_decoder(
-        self, image_embedding, original_size, transform_matrix, prompt, transform_prompt
-    ):
-        """Run decoder"""
-        if transform_prompt:
-            input_points, input_labels = self.get_input_points(prompt)
-        else:
-            input_points, input_labels = prompt
-
+    def get_decoder_prompt(self, input_points, input_labels, transform_matrix):
+        """
+        Get the point coordinates and labels of a prompt for the decoder
+        """
         # Add a batch index, concatenate a padding point, and transform.
         onnx_coord = np.concatenate(
             [input_points, np.array([[0.0, 0.0]])], axis=0
@@ -106,12 +116,17 @@ class SegmentAnythingONNX:
         )
         onnx_coord = np.matmul(onnx_coord, transform_matrix.T)
         onnx_coord = onnx_coord[:, :, :2].astype(np.float32)
+        return onnx_coord, onnx_label
 
+    def get_decoder_inputs(self, image_embedding, onnx_coord, onnx_label):
+        """
+        Get the decoder inputs for a batch of prompts
+        """
         # Create an empty mask input and an indicator for no mask.
         onnx_mask_input = np.zeros((1, 1, 256, 256), dtype=np.float32)
         onnx_has_mask_input = np.zeros(1, dtype=np.float32)
 
-        decoder_inputs = {
+        return {
             "image_embeddings": image_embedding,
             "point_coords": onnx_coord,
             "point_labels": onnx_label,
@@ -119,7 +134,15 @@ class SegmentAnythingONNX:
             "has_mask_input": onnx_has_mask_input,
             "orig_im_size": np.array(self.input_size, dtype=np.float32),
         }
-        masks, _, _ = self.decoder_session.run(None, decoder_inputs)
+
+    @traced()
+    def run_decoder(
+        self, image_embedding, original_size, transform_matrix, prompt, transform_prompt
+    ):
+        """Run decoder"""
+        masks = self.decode(
+            image_embedding, transform_matrix, prompt, transform_prompt
+        )
 
         # Transform the masks back to the original image size.
         inv_transform_matrix = np.linalg.inv(transform_matrix)
@@ -129,6 +152,87 @@ class SegmentAnythingONNX:
 
         return transformed_masks
 
+    @traced()
+    def decode(
+        self, image_embedding, transform_matrix, prompt, transform_prompt=True
+    ):
+        """Run decoder, returns the masks at the input size"""
+        if transform_prompt:
+            input_points, input_labels = self.get_input_points(prompt)
+        else:
+            input_points, input_labels = prompt
+
+        onnx_coord, onnx_label = self.get_decoder_prompt(
+            input_points, input_labels, transform_matrix
+        )
+        decoder_inputs = self.get_decoder_inputs(
+            image_embedding, onnx_coord, onnx_label
+        )
+        masks, _, _ = self.decoder_session.run(None, decoder_inputs)
+        return masks
+
+    @traced()
+    def run_decoder_batch(
+        self, image_embedding, original_size, transform_matrix, prompts
+    ):
+        """
+        Run decoder on the prompts (points, labels) of several objects,
+        decoder_batch_size objects per run. Only the first mask of each
+        object is upsampled to the original image size, in the region of
+        the object. Returns a (mask, offset) pair per object, see
+        upsample_mask_roi.
+        """
+        if not prompts:
+            return []
+
+        # Pad the prompts with "not a point" points to stack them
+        num_points = max(len(points) for points, _ in prompts)
+        onnx_coords, onnx_labels = [], []
+        for input_points, input_labels in prompts:
+            padding = num_points - len(input_points)
+            onnx_coord, onnx_label = self.get_decoder_prompt(
+                np.concatenate([input_points, np.zeros((padding, 2))]),
+                np.concatenate([input_labels, -np.ones(padding)]),
+                transform_matrix,
+            )
+            onnx_coords.append(onnx_coord)
+            onnx_labels.append(onnx_label)
+        onnx_coords = np.concatenate(onnx_coords)
+        onnx_labels = np.concatenate(onnx_labels)
+
+        inv_transform_matrix = np.linalg.inv(transform_matrix)
+        transformed_masks = []
+        start = 0
+        while start < len(onnx_coords):
+            end = start + self.decoder_batch_size
+            try:
+                masks, _, _ = self.decoder_session.run(
+                    None,
+                    self.get_decoder_inputs(
+                        image_embedding,
+                        onnx_coords[start:end],
+                        onnx_labels[start:end],
+                    ),
+                )
+            except Exception as e:  # noqa
+                if self.decoder_batch_size == 1:
+                    raise
+                logging.warning(
+                    "Batched decoding failed, decoding objects one by one: %s", e
+                )
+                self.decoder_batch_size = 1
+                continue
+            transformed_masks.extend(
+                upsample_mask_roi(
+                    mask[0], inv_transform_matrix, original_size
+                )
+                for mask in masks
+            )
+            start = end
+
+        return transformed_masks
+
+    @traced()
     def transform_masks(self, masks, original_size, transform_matrix):
         """Transform masks
         Transform the masks back to the original image size.
@@ -148,6 +252,7 @@ class SegmentAnythingONNX:
             output_masks.append(batch_masks)
         return np.array(output_masks)
 
+    @traced()
     def encode(self, cv_image):
         """
         Calculate embedding and metadata for a single image.
@@ -196,8 +301,37 @@ class SegmentAnythingONNX:
 
         return masks
 
+    def predict_masks_batch(self, embedding, prompts):
+        """
+        Predict one mask per prompt (points, labels) for a single image.
+        """
+        return self.run_decoder_batch(
+            embedding["image_embedding"],
+            embedding["original_size"],
+            embedding["transform_matrix"],
+            prompts,
+        )
+
+    def predict_mask_roi(self, embedding, prompt):
+        """
+        Predict the mask of an object for a single image, upsampled to the
+        original image size in the region of the object only.
+        Returns the binary mask of the region and its (x, y) offset.
+        """
+        masks = self.decode(
+            embedding["image_embedding"],
+            embedding["transform_matrix"],
+            prompt,
+        )
+        mask = masks[0][0] if len(masks.shape) == 4 else masks[0]
+        return upsample_mask_roi(
+            mask,
+            np.linalg.inv(embedding["transform_matrix"]),
+            embedding["original_size"],
+        )
+
 
-class YOLOv5SegmentAnything(Model):
+class YOLOv5SegmentAnything(EmbeddingMixin, Model):
     """Segmentation model using YOLOv5 by SegmentAnything"""
 
     class Meta:
@@ -255,7 +389,7 @@ class YOLOv5SegmentAnything(Model):
                     "Model", "Could not download or initialize YOLOv5 model."
                 )
             )
-        self.net = ort.InferenceSession(
+        self.net = create_inference_session(
                         model_abs_path, 
                         providers=providers,
                         sess_options=sess_opts,
@@ -296,34 +430,43 @@ class YOLOv5SegmentAnything(Model):
         # Load models
         self.target_size = self.config["target_size"]
         self.input_size = (self.config["max_height"], self.config["max_width"])
-        self.encoder_session = ort.InferenceSession(
+        self.encoder_session = create_inference_session(
             encoder_model_abs_path, providers=providers, sess_options=sess_opts
         )
-        self.decoder_session = ort.InferenceSession(
+        self.decoder_session = create_inference_session(
             decoder_model_abs_path, providers=providers, sess_options=sess_opts
         )
         self.model = SegmentAnythingONNX(
-            self.encoder_session, self.decoder_session, self.target_size, self.input_size
+            self.encoder_session,
+            self.decoder_session,
+            self.target_size,
+            self.input_size,
+            self.config.get("decoder_batch_size", 16),
         )
 
         # Mark for auto labeling: [points, rectangles]
         self.marks = []
-        self.image_embed_cache = {}
+        # Images already labeled by the detector, later runs on them
+        # only segment the marks
+        self.detected_files = set()
+        self.init_embedding_cache(encoder_model_abs_path)
 
     def set_auto_labeling_marks(self, marks):
         """Set auto labeling marks"""
         self.marks = marks
 
-    def post_process(self, masks, label=None):
+    @traced()
+    def post_process(self, masks, label=None, offset=(0, 0)):
         """
-        Post process masks
+        Post process masks. The masks may be a region of the image at
+        offset (x, y).
         """
         # Find contours
         masks[masks > 0.0] = 255
         masks[masks <= 0.0] = 0
         masks = masks.astype(np.uint8)
         contours, _ = cv2.findContours(
-            masks, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE
+            masks, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_NONE, offset=offset
         )
 
         # Refine contours
@@ -427,35 +570,38 @@ class YOLOv5SegmentAnything(Model):
             return []
 
         try:
-            cv_image = qt_img_to_rgb_cv_img(image, filename)
+            with self.span("decode"):
+                cv_image = qt_img_to_rgb_cv_img(image, filename)
         except Exception as e:  # noqa
             logging.warning("Could not inference model")
             logging.warning(e)
             return []
         
-        if filename not in self.image_embed_cache:
-            image_embedding = self.model.encode(cv_image)
+        image_embedding = self.get_cached_embedding(filename)
+        if image_embedding is None:
+            image_embedding = self.cache_embedding(
+                filename, self.model.encode(cv_image)
+            )
+
+        if filename not in self.detected_files:
             processed_img, detections = self.yolo_pre_process(cv_image, self.net)
             prompts, labels = self.yolo_post_process(cv_image, processed_img, detections)
-            shapes = []
-            for prompt, label in zip(prompts, labels):
-                masks = self.model.predict_masks(image_embedding, prompt, transform_prompt=False)
-                if len(masks.shape) == 4:
-                    masks = masks[0][0]
-                else:
-                    masks = masks[0]
-                results = self.post_process(masks, label=label)
-                shapes.append(results)
+            masks = self.model.predict_masks_batch(image_embedding, prompts)
+            shapes = [
+                self.post_process(mask, label=label, offset=offset)
+                for (mask, offset), label in zip(masks, labels)
+                if mask is not None
+            ]
             result = AutoLabelingResult(shapes, replace=True)
-            self.image_embed_cache[filename] = image_embedding
+            self.detected_files.add(filename)
             return result
         else:
-            masks = self.model.predict_masks(self.image_embed_cache[filename], self.marks)
-            if len(masks.shape) == 4:
-                masks = masks[0][0]
-            else:
-                masks = masks[0]
-            shapes = self.post_process(masks)
+            mask, offset = self.model.predict_mask_roi(
+                image_embedding, self.marks
+            )
+            shapes = []
+            if mask is not None:
+                shapes = self.post_process(mask, offset=offset)
             result = AutoLabelingResult(shapes, replace=False)
             return result
 
@@ -463,7 +609,7 @@ class YOLOv5SegmentAnything(Model):
         """
         Pre-process the input RGB image before feeding it to the network.
         """
-        image = self.letterbox(input_image, self.img_size, stride=self.config['stride'])[0]
+        image = ops.letterbox(input_image, self.img_size, stride=self.config['stride'])[0]
         image = image.transpose((2, 0, 1)) # HWC to CHW
         image = np.ascontiguousarray(image).astype('float32')
         image /= 255  # 0 - 255 to 0.0 - 1.0
@@ -479,10 +625,14 @@ class YOLOv5SegmentAnything(Model):
         Post-process the network's output, to get the bounding boxes, key-points and
         their confidence scores.
         """
-        det = self.non_max_suppression(outputs)[0]
+        det = ops.non_max_suppression(
+            outputs,
+            conf_thres=self.config["confidence_threshold"],
+            iou_thres=self.config["nms_threshold"],
+        )[0]
         output_infos, labels = [], []
         if len(det):
-            det[:, :4] = self.rescale(img_processed.shape[2:], det[:, :4], img_src.shape).round()
+            det[:, :4] = ops.rescale(img_processed.shape[2:], det[:, :4], img_src.shape).round()
             for *xyxy, _, class_id in reversed(det):
                 x1, y1, x2, y2 = xyxy
                 prompt = [np.array([[int(x1), int(y1)], [int(x2), int(y2)]]), np.array([2, 3])]
@@ -507,172 +657,12 @@ class YOLOv5SegmentAnything(Model):
         # Upward revision the value x to make it evenly divisible by the divisor.
         return math.ceil(x / divisor) * divisor
 
-    @staticmethod
-    def letterbox(im, new_shape=(640, 640), color=(114, 114, 114), auto=False, scaleup=True, stride=32, return_int=False):
-        '''Resize and pad image while meeting stride-multiple constraints.'''
-        shape = im.shape[:2]  # current shape [height, width]
-        if isinstance(new_shape, int):
-            new_shape = (new_shape, new_shape)
-        elif isinstance(new_shape, list) and len(new_shape) == 1:
-            new_shape = (new_shape[0], new_shape[0])
-
-        # Scale ratio (new / old)
-        r = min(new_shape[0] / shape[0], new_shape[1] / shape[1])
-        if not scaleup:  # only scale down, do not scale up (for better val mAP)
-            r = min(r, 1.0)
-
-        # Compute padding
-        new_unpad = int(round(shape[1] * r)), int(round(shape[0] * r))
-        dw, dh = new_shape[1] - new_unpad[0], new_shape[0] - new_unpad[1]  # wh padding
-
-        if auto:  # minimum rectangle
-            dw, dh = np.mod(dw, stride), np.mod(dh, stride)  # wh padding
-
-        dw /= 2  # divide padding into 2 sides
-        dh /= 2
-
-        if shape[::-1] != new_unpad:  # resize
-            im = cv2.resize(im, new_unpad, interpolation=cv2.INTER_LINEAR)
-        top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
-        left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
-        im = cv2.copyMakeBorder(im, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)  # add border
-        if not return_int:
-            return im, r, (dw, dh)
-        else:
-            return im, r, (left, top)
-
-    @staticmethod
-    def xywh2xyxy(x):
-        '''Convert boxes with shape [n, 4] from [x, y, w, h] to [x1, y1, x2, y2] where x1y1 is top-left, x2y2=bottom-right.'''
-        y = np.copy(x)
-        y[:, 0] = x[:, 0] - x[:, 2] / 2  # top left x
-        y[:, 1] = x[:, 1] - x[:, 3] / 2  # top left y
-        y[:, 2] = x[:, 0] + x[:, 2] / 2  # bottom right x
-        y[:, 3] = x[:, 1] + x[:, 3] / 2  # bottom right y
-        return y
-
-    @staticmethod
-    def rescale(ori_shape, boxes, target_shape):
-        '''Rescale the output to the original image shape'''
-        ratio = min(ori_shape[0] / target_shape[0], ori_shape[1] / target_shape[1])
-        padding = ((ori_shape[1] - target_shape[1] * ratio) / 2, (ori_shape[0] - target_shape[0] * ratio) / 2)
-        boxes[:, [0, 2]] -= padding[0]
-        boxes[:, [1, 3]] -= padding[1]
-        boxes[:, :4] /= ratio
-        boxes[:, 0] = np.clip(boxes[:, 0], 0, target_shape[1])  # x1
-        boxes[:, 1] = np.clip(boxes[:, 1], 0, target_shape[0])  # y1
-        boxes[:, 2] = np.clip(boxes[:, 2], 0, target_shape[1])  # x2
-        boxes[:, 3] = np.clip(boxes[:, 3], 0, target_shape[0])  # y2
-        return boxes
-
-    def non_max_suppression(self, prediction, conf_thres=0.25, iou_thres=0.45, classes=None, agnostic=False, multi_label=False, max_det=1000):
-        """Runs Non-Maximum Suppression (NMS) on inference results.
-        This code is borrowed from: https://github.com/ultralytics/yolov5/blob/47233e1698b89fc437a4fb9463c815e9171be955/utils/general.py#L775
-        Args:
-            prediction: (tensor), with shape [N, 5 + num_classes], N is the number of bboxes.
-            conf_thres: (float) confidence threshold.
-            iou_thres: (float) iou threshold.
-            classes: (None or list[int]), if a list is provided, nms only keep the classes you provide.
-            agnostic: (bool), when it is set to True, we do class-independent nms, otherwise, different class would do nms respectively.
-            multi_label: (bool), when it is set to True, one box can have multi labels, otherwise, one box only huave one label.
-            max_det:(int), max number of output bboxes.
-
-        Returns:
-            list of detections, echo item is one tensor with shape (num_boxes, 6), 6 is for [xyxy, conf, cls].
+    def on_next_files_changed(self, next_files):
         """
-        conf_thres = self.config["confidence_threshold"]
-        iou_thres = self.config["nms_threshold"]
-
-        num_classes = prediction.shape[2] - 5  # number of classes
-        pred_candidates = np.logical_and(prediction[..., 4] > conf_thres, np.max(prediction[..., 5:], axis=-1) > conf_thres)  # candidates
-        # Check the parameters.
-        assert 0 <= conf_thres <= 1, f'conf_thresh must be in 0.0 to 1.0, however {conf_thres} is provided.'
-        assert 0 <= iou_thres <= 1, f'iou_thres must be in 0.0 to 1.0, however {iou_thres} is provided.'
-
-        # Function settings.
-        max_wh = 4096  # maximum box width and height
-        max_nms = 30000  # maximum number of boxes put into torchvision.ops.nms()
-        multi_label &= num_classes > 1  # multiple labels per box
-
-        output = [np.zeros((0, 6))] * prediction.shape[0]
-        for img_idx, x in enumerate(prediction):  # image index, image inference
-            x = x[pred_candidates[img_idx]]  # confidence
-
-            # If no box remains, skip the next process.
-            if not x.shape[0]:
-                continue
-
-            # confidence multiply the objectness
-            x[:, 5:] *= x[:, 4:5]  # conf = obj_conf * cls_conf
-
-            # (center x, center y, width, height) to (x1, y1, x2, y2)
-            box = self.xywh2xyxy(x[:, :4])
-
-            # Detections matrix's shape is  (n,6), each row represents (xyxy, conf, cls)
-            if multi_label:
-                box_idx, class_idx = np.nonzero(x[:, 5:] > conf_thres)
-                box = box[box_idx]
-                conf = x[box_idx, class_idx + 5][:, None]
-                class_idx = class_idx[:, None].astype(float)
-                x = np.concatenate((box, conf, class_idx), axis=1)
-            else:
-                conf = np.max(x[:, 5:], axis=1, keepdims=True)
-                class_idx = np.argmax(x[:, 5:], axis=1)
-                x = np.concatenate((box, conf, class_idx[:, None].astype(float)), axis=1)[conf.flatten() > conf_thres]
-
-            # Filter by class, only keep boxes whose category is in classes.
-            if classes is not None:
-                x = x[(x[:, 5:6] == np.array(classes)).any(1)]
-
-            # Check shape
-            num_box = x.shape[0]  # number of boxes
-            if not num_box:  # no boxes kept.
-                continue
-            elif num_box > max_nms:  # excess max boxes' number.
-                x = x[x[:, 4].argsort(descending=True)[:max_nms]]  # sort by confidence
-
-            # Batched NMS
-            class_offset = x[:, 5:6] * (0 if agnostic else max_wh)  # classes
-            boxes, scores = x[:, :4] + class_offset, x[:, 4]  # boxes (offset by class), scores
-            keep_box_idx = self.numpy_nms(boxes, scores, iou_thres)  # NMS
-            if keep_box_idx.shape[0] > max_det:  # limit detections
-                keep_box_idx = keep_box_idx[:max_det]
-
-            output[img_idx] = x[keep_box_idx]
-
-        return output
-
-    @staticmethod
-    def box_area(boxes :np.array):
-        return (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
-
-    def box_iou(self, box1: np.array, box2: np.array):
-        area1 = self.box_area(box1)  # N
-        area2 = self.box_area(box2)  # M
-        # broadcasting
-        lt = np.maximum(box1[:, np.newaxis, :2], box2[:, :2])
-        rb = np.minimum(box1[:, np.newaxis, 2:], box2[:, 2:])
-        wh = rb - lt
-        wh = np.maximum(0, wh) # [N, M, 2]
-        inter = wh[:, :, 0] * wh[:, :, 1]
-        iou = inter / (area1[:, np.newaxis] + area2 - inter)
-        return iou  # NxM
-
-    def numpy_nms(self, boxes: np.array, scores: np.array, iou_threshold :float):
-        idxs = scores.argsort()
-        keep = []
-        while idxs.size > 0:
-            max_score_index = idxs[-1]
-            max_score_box = boxes[max_score_index][None, :]
-            keep.append(max_score_index)
-            if idxs.size == 1:
-                break
-            idxs = idxs[:-1]
-            other_boxes = boxes[idxs]
-            ious = self.box_iou(max_score_box, other_boxes)
-            idxs = idxs[ious[0] <= iou_threshold]
-        keep = np.array(keep)  
-        return keep
+        Results depend on the marks of the current image,
+        so nothing is run in advance
+        """
+        pass
 
     def unload(self):
         del self.net
@@ -10,7 +10,9 @@ from PyQt5.QtCore import QCoreApplication
 from anylabeling.app_info import __preferred_device__
 from anylabeling.views.labeling.shape import Shape
 from anylabeling.views.labeling.utils.opencv import qt_img_to_rgb_cv_img
+from . import ops
 from .model import Model
+from .model_cache import create_inference_session
 from .types import AutoLabelingResult
 
 
@@ -55,16 +57,17 @@ class YOLOv8(Model):
         if __preferred_device__ == "GPU":
             self.providers = ['CUDAExecutionProvider']
 
-        self.net = ort.InferenceSession(
+        self.net = create_inference_session(
                         model_abs_path, 
                         providers=self.providers,
                         sess_options=self.sess_opts,
                     )
         self.classes = self.config["classes"]
+        self.check_batch_size(self.net)
 
-    def pre_process(self, input_image, net):
+    def prepare_input(self, input_image):
         """
-        Pre-process the input image before feeding it to the network.
+        Resize and normalize the input image to a [1, 3, H, W] blob.
         """
         # Resized
         input_img = cv2.resize(input_image, (640, 640))
@@ -77,6 +80,13 @@ class YOLOv8(Model):
         
         # Processed
         blob = input_img[np.newaxis, :, :, :].astype(np.float32)
+        return blob
+
+    def pre_process(self, input_image, net):
+        """
+        Pre-process the input image before feeding it to the network.
+        """
+        blob = self.prepare_input(input_image)
 
         inputs = net.get_inputs()[0].name
         outputs = net.run(None, {inputs: blob})[0]
@@ -89,49 +99,42 @@ class YOLOv8(Model):
         Post-process the network's output, to get the bounding boxes and
         their confidence scores.
         """
-        # Lists to hold respective values while unwrapping.
-        class_ids = []
-        confidences = []
-        boxes = []
-
-        # Rows.
-        rows = outputs.shape[1]
-
         image_height, image_width = input_image.shape[:2]
 
         # Resizing factor.
         x_factor = image_width / self.config["input_width"]
         y_factor = image_height / self.config["input_height"]
 
-        # Iterate through 8400 rows.
-        for r in range(rows):
-            row = outputs[0][r]
-            classes_scores = row[4:]
-
-            # Get the index of max class score and confidence.
-            _, confidence, _, (_, class_id) = cv2.minMaxLoc(classes_scores)
-
-            # Discard confidence lower than threshold
-            if confidence >= self.config["confidence_threshold"]:
-                confidences.append(confidence)
-                class_ids.append(class_id)
-
-                cx, cy, w, h = row[0], row[1], row[2], row[3]
-
-                left = int((cx - w / 2) * x_factor)
-                top = int((cy - h / 2) * y_factor)
-                width = int(w * x_factor)
-                height = int(h * y_factor)
-
-                box = np.array([left, top, width, height])
-                boxes.append(box)
+        # Get the class with the highest confidence of each row and
+        # discard rows with a confidence lower than threshold.
+        predictions = outputs[0]
+        classes_scores = predictions[:, 4:]
+        class_ids = np.argmax(classes_scores, axis=1)
+        confidences = classes_scores[np.arange(len(class_ids)), class_ids]
+        keep = confidences >= self.config["confidence_threshold"]
+        predictions = predictions[keep]
+        class_ids = class_ids[keep]
+        confidences = confidences[keep]
+
+        cx, cy, w, h = (predictions[:, i] for i in range(4))
+        boxes = np.stack(
+            [
+                ((cx - w / 2) * x_factor).astype(int),
+                ((cy - h / 2) * y_factor).astype(int),
+                (w * x_factor).astype(int),
+                (h * y_factor).astype(int),
+            ],
+            axis=1,
+        )
 
         # Perform non maximum suppression to eliminate redundant
         # overlapping boxes with lower confidences.
-        indices = cv2.dnn.NMSBoxes(
-            boxes,
+        boxes_xyxy = boxes.astype(np.float32)
+        boxes_xyxy[:, 2:] += boxes_xyxy[:, :2]
+        indices = ops.batched_nms(
+            boxes_xyxy,
             confidences,
-            self.config["confidence_threshold"],
+            class_ids,
             self.config["nms_threshold"],
         )
 
@@ -166,6 +169,9 @@ class YOLOv8(Model):
         if image is None:
             return []
 
+        if self.use_sliced_inference(image, image_path):
+            return self.predict_shapes_sliced(image, image_path)
+
         try:
             image = qt_img_to_rgb_cv_img(image, image_path)
         except Exception as e:  # noqa
@@ -175,16 +181,55 @@ class YOLOv8(Model):
 
         detections = self.pre_process(image, self.net)
         boxes = self.post_process(image, detections)
-        shapes = []
+        result = AutoLabelingResult(self.build_shapes(boxes), replace=True)
+        return result
 
+    def predict_shapes_batch(self, images, image_paths=None):
+        """
+        Predict shapes from a list of images with batched inference
+        """
+        if self.get_slice_size() is not None:
+            # Large images are sliced one by one
+            return super().predict_shapes_batch(images, image_paths)
+        cv_images = self.load_rgb_images(images, image_paths)
+        results = [[] for _ in cv_images]
+        indices = [i for i, image in enumerate(cv_images) if image is not None]
+        inputs = self.net.get_inputs()[0].name
+        for batch in self.split_batches(indices):
+            blob = np.concatenate([self.prepare_input(cv_images[i]) for i in batch])
+            outputs = self.net.run(None, {inputs: blob})[0]
+            outputs = np.transpose(outputs, (0, 2, 1))
+            for j, i in enumerate(batch):
+                boxes = self.post_process(cv_images[i], outputs[j : j + 1])
+                results[i] = AutoLabelingResult(self.build_shapes(boxes), replace=True)
+        return results
+
+    def detect_batch(self, cv_images):
+        """
+        Detect objects in a list of RGB images with batched inference
+        """
+        detections = []
+        inputs = self.net.get_inputs()[0].name
+        for batch in self.split_batches(cv_images):
+            blob = np.concatenate([self.prepare_input(image) for image in batch])
+            outputs = self.net.run(None, {inputs: blob})[0]
+            outputs = np.transpose(outputs, (0, 2, 1))
+            for j, image in enumerate(batch):
+                detections.append(self.post_process(image, outputs[j : j + 1]))
+        return detections
+
+    @staticmethod
+    def build_shapes(boxes):
+        """
+        Convert post-processed detections to shapes
+        """
+        shapes = []
         for box in boxes:
             shape = Shape(label=box["label"], shape_type="rectangle", flags={})
             shape.add_point(QtCore.QPointF(box["x1"], box["y1"]))
             shape.add_point(QtCore.QPointF(box["x2"], box["y2"]))
             shapes.append(shape)
-
-        result = AutoLabelingResult(shapes, replace=True)
-        return result
+        return shapes
 
     def unload(self):
         del self.net
\ No newline at end of file
@@ -11,7 +11,9 @@ from PyQt5.QtCore import QCoreApplication
 from anylabeling.app_info import __preferred_device__
 from anylabeling.views.labeling.shape import Shape
 from anylabeling.views.labeling.utils.opencv import qt_img_to_rgb_cv_img
+from . import ops
 from .model import Model
+from .model_cache import create_inference_session
 from .types import AutoLabelingResult
 
 
@@ -57,7 +59,7 @@ class YOLOv8_Seg(Model):
         if __preferred_device__ == "GPU":
             self.providers = ['CUDAExecutionProvider']
 
-        self.net = ort.InferenceSession(
+        self.net = create_inference_session(
                         model_abs_path, 
                         providers=self.providers,
                         sess_options=self.sess_opts,
@@ -68,6 +70,7 @@ class YOLOv8_Seg(Model):
         self.iou_threshold = self.config["nms_threshold"]
         self.conf_threshold = self.config["score_threshold"]
         self.classes = self.config["classes"]
+        self.check_batch_size(self.net)
 
     def preprocess(self, image):
         self.img_height, self.img_width = image.shape[:2]
@@ -174,7 +177,7 @@ class YOLOv8_Seg(Model):
         boxes = self.extract_boxes(box_predictions)
 
         # Apply non-maxima suppression to suppress weak, overlapping bounding boxes
-        indices = self.numpy_nms(boxes, scores, self.iou_threshold)
+        indices = ops.batched_nms(boxes, scores, class_ids, self.iou_threshold)
 
         return boxes[indices], scores[indices], class_ids[indices], mask_predictions[indices]
 
@@ -195,6 +198,9 @@ class YOLOv8_Seg(Model):
         if image is None:
             return []
 
+        if self.use_sliced_inference(image, image_path):
+            return self.predict_shapes_sliced(image, image_path)
+
         try:
             image = qt_img_to_rgb_cv_img(image, image_path)
         except Exception as e:  # noqa
@@ -226,6 +232,8 @@ class YOLOv8_Seg(Model):
 
             mask = mask_pred[i]
             points = self.get_largest_polygon(mask)
+            if not points:
+                continue
             shape = Shape(flags={})
             for point in points:
                 point[0] = int(point[0])
@@ -244,6 +252,37 @@ class YOLOv8_Seg(Model):
 
         return result
 
+    def detect_batch(self, cv_images):
+        """
+        Detect objects in a list of RGB images with batched inference
+        """
+        detections = []
+        for batch in self.split_batches(cv_images):
+            blob = np.concatenate([self.preprocess(image) for image in batch])
+            outputs = self.get_infer_results(blob)
+            for j, image in enumerate(batch):
+                self.img_height, self.img_width = image.shape[:2]
+                boxes, scores, class_ids, mask_pred = self.postprocess(
+                    [outputs[0][j : j + 1], outputs[1][j : j + 1]]
+                )
+                infos = []
+                for i, (box, class_id) in enumerate(zip(boxes, class_ids)):
+                    points = self.get_largest_polygon(mask_pred[i])
+                    if not points:
+                        continue
+                    x1, y1, x2, y2 = box
+                    infos.append({
+                        "x1": x1,
+                        "y1": y1,
+                        "x2": x2,
+                        "y2": y2,
+                        "label": self.classes[class_id],
+                        "score": scores[i],
+                        "points": points,
+                    })
+                detections.append(infos)
+        return detections
+
     @staticmethod
     def get_largest_polygon(mask, threshold=0.5):
         # Convert the mask image to binary image
@@ -252,7 +291,10 @@ class YOLOv8_Seg(Model):
         
         # Find contours
         contours, _ = cv2.findContours(binary, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        
+        if not contours:
+            # Empty mask, e.g. for a box smaller than a mask pixel
+            return []
+
         # Find the largest contour
         largest_contour = max(contours, key=cv2.contourArea)
         
@@ -267,16 +309,6 @@ class YOLOv8_Seg(Model):
         
         return points
     
-    @staticmethod
-    def xywh2xyxy(x):
-        # Convert bounding box (x, y, w, h) to bounding box (x1, y1, x2, y2)
-        y = np.copy(x)
-        y[..., 0] = x[..., 0] - x[..., 2] / 2
-        y[..., 1] = x[..., 1] - x[..., 3] / 2
-        y[..., 2] = x[..., 0] + x[..., 2] / 2
-        y[..., 3] = x[..., 1] + x[..., 3] / 2
-        return y
-
     @staticmethod
     def rescale_boxes(boxes, input_shape, image_shape):
 
@@ -287,52 +319,10 @@ class YOLOv8_Seg(Model):
 
         return boxes
 
-    @staticmethod
-    def compute_iou(box, boxes):
-        # Compute xmin, ymin, xmax, ymax for both boxes
-        xmin = np.maximum(box[0], boxes[:, 0])
-        ymin = np.maximum(box[1], boxes[:, 1])
-        xmax = np.minimum(box[2], boxes[:, 2])
-        ymax = np.minimum(box[3], boxes[:, 3])
-
-        # Compute intersection area
-        intersection_area = np.maximum(0, xmax - xmin) * np.maximum(0, ymax - ymin)
-
-        # Compute union area
-        box_area = (box[2] - box[0]) * (box[3] - box[1])
-        boxes_area = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
-        union_area = box_area + boxes_area - intersection_area
-
-        # Compute IoU
-        iou = intersection_area / union_area
-
-        return iou
-
     @staticmethod
     def numpy_sigmoid(x):
         return 1 / (1 + np.exp(-x))
 
-    def numpy_nms(self, boxes, scores, iou_threshold):
-        # Sort by score
-        sorted_indices = np.argsort(scores)[::-1]
-
-        keep_boxes = []
-        while sorted_indices.size > 0:
-            # Pick the last box
-            box_id = sorted_indices[0]
-            keep_boxes.append(box_id)
-
-            # Compute IoU of the picked box with the rest
-            ious = self.compute_iou(boxes[box_id, :], boxes[sorted_indices[1:], :])
-
-            # Remove boxes with IoU over the threshold
-            keep_indices = np.where(ious < iou_threshold)[0]
-
-            # print(keep_indices.shape, sorted_indices.shape)
-            sorted_indices = sorted_indices[keep_indices + 1]
-
-        return keep_boxes
-
     def extract_boxes(self, box_predictions):
         # Extract boxes from predictions
         boxes = box_predictions[:, :4]
@@ -343,7 +333,7 @@ class YOLOv8_Seg(Model):
                                    (self.img_height, self.img_width))
 
         # Convert boxes to xyxy format
-        boxes = self.xywh2xyxy(boxes)
+        boxes = ops.xywh2xyxy(boxes)
 
         # Check the boxes are within the image
         boxes[:, 0] = np.clip(boxes[:, 0], 0, self.img_width)
@@ -10,7 +10,9 @@ from PyQt5.QtCore import QCoreApplication
 from anylabeling.app_info import __preferred_device__
 from anylabeling.views.labeling.shape import Shape
 from anylabeling.views.labeling.utils.opencv import qt_img_to_rgb_cv_img
+from . import ops
 from .model import Model
+from .model_cache import create_inference_session
 from .types import AutoLabelingResult
 
 
@@ -56,7 +58,7 @@ class YOLOX(Model):
         if __preferred_device__ == "GPU":
             self.providers = ['CUDAExecutionProvider']
 
-        self.net = ort.InferenceSession(
+        self.net = create_inference_session(
                         model_abs_path, 
                         providers=self.providers,
                         sess_options=self.sess_opts,
@@ -64,10 +66,11 @@ class YOLOX(Model):
         self.p6 = self.config["p6"]
         self.classes = self.config["classes"]
         self.input_size = (self.config["input_height"], self.config["input_width"])
+        self.check_batch_size(self.net)
 
-    def pre_process(self, img, net, swap=(2, 0, 1)):
+    def prepare_input(self, img, swap=(2, 0, 1)):
         """
-        Pre-process the input RGB image before feeding it to the network.
+        Resize and pad the input RGB image to a [1, 3, H, W] blob.
         """
         if len(img.shape) == 3:
             padded_img = np.ones((self.input_size[0], self.input_size[1], 3), dtype=np.uint8) * 114
@@ -85,7 +88,14 @@ class YOLOX(Model):
         padded_img = padded_img.transpose(swap)
         padded_img = np.ascontiguousarray(padded_img, dtype=np.float32)
 
-        ort_inputs = {net.get_inputs()[0].name: padded_img[None, :, :, :]}
+        return r, padded_img[None, :, :, :]
+
+    def pre_process(self, img, net, swap=(2, 0, 1)):
+        """
+        Pre-process the input RGB image before feeding it to the network.
+        """
+        r, blob = self.prepare_input(img, swap)
+        ort_inputs = {net.get_inputs()[0].name: blob}
         outputs = net.run(None, ort_inputs)
 
         return r, outputs
@@ -126,6 +136,9 @@ class YOLOX(Model):
         if image is None:
             return []
 
+        if self.use_sliced_inference(image, image_path):
+            return self.predict_shapes_sliced(image, image_path)
+
         try:
             image = qt_img_to_rgb_cv_img(image, image_path)
         except Exception as e:  # noqa
@@ -136,8 +149,65 @@ class YOLOX(Model):
         ratio, outputs = self.pre_process(image, self.net)
         predictions = self.post_process(outputs[0])[0]
         results = self.rescale(predictions, ratio)
+        result = AutoLabelingResult(self.build_shapes(results), replace=True)
+
+        return result
 
+    def predict_shapes_batch(self, images, image_paths=None):
+        """
+        Predict shapes from a list of images with batched inference
+        """
+        if self.get_slice_size() is not None:
+            # Large images are sliced one by one
+            return super().predict_shapes_batch(images, image_paths)
+        cv_images = self.load_rgb_images(images, image_paths)
+        results = [[] for _ in cv_images]
+        indices = [i for i, image in enumerate(cv_images) if image is not None]
+        inputs = self.net.get_inputs()[0].name
+        for batch in self.split_batches(indices):
+            ratios, blobs = zip(*[self.prepare_input(cv_images[i]) for i in batch])
+            outputs = self.net.run(None, {inputs: np.concatenate(blobs)})[0]
+            predictions = self.post_process(outputs)
+            for j, i in enumerate(batch):
+                dets = self.rescale(predictions[j], ratios[j])
+                results[i] = AutoLabelingResult(self.build_shapes(dets), replace=True)
+        return results
+
+    def detect_batch(self, cv_images):
+        """
+        Detect objects in a list of RGB images with batched inference
+        """
+        detections = []
+        inputs = self.net.get_inputs()[0].name
+        for batch in self.split_batches(cv_images):
+            ratios, blobs = zip(*[self.prepare_input(image) for image in batch])
+            outputs = self.net.run(None, {inputs: np.concatenate(blobs)})[0]
+            predictions = self.post_process(outputs)
+            for j in range(len(batch)):
+                dets = self.rescale(predictions[j], ratios[j])
+                infos = []
+                if dets is not None:
+                    for x1, y1, x2, y2, score, cls_inds in dets:
+                        if score < self.config["score_threshold"]:
+                            continue
+                        infos.append({
+                            "x1": x1,
+                            "y1": y1,
+                            "x2": x2,
+                            "y2": y2,
+                            "label": self.classes[int(cls_inds)],
+                            "score": score,
+                        })
+                detections.append(infos)
+        return detections
+
+    def build_shapes(self, results):
+        """
+        Convert post-processed detections to shapes
+        """
         shapes = []
+        if results is None:
+            return shapes
         final_boxes, final_scores, final_cls_inds = results[:, :4], results[:, 4], results[:, 5]
         for box, score, cls_inds in zip(final_boxes, final_scores, final_cls_inds):
             if score < self.config["score_threshold"]:
@@ -147,10 +217,7 @@ class YOLOX(Model):
             rectangle_shape.add_point(QtCore.QPointF(x1, y1))
             rectangle_shape.add_point(QtCore.QPointF(x2, y2))
             shapes.append(rectangle_shape)
-
-        result = AutoLabelingResult(shapes, replace=True)
-
-        return result
+        return shapes
     
     def rescale(self, predictions, ratio):
         '''Rescale the output to the original image shape'''
@@ -182,42 +249,13 @@ class YOLOX(Model):
         valid_scores = cls_scores[valid_score_mask]
         valid_boxes = boxes[valid_score_mask]
         valid_cls_inds = cls_inds[valid_score_mask]
-        keep = self.nms(valid_boxes, valid_scores, nms_thr)
-        if keep:
+        keep = ops.numpy_nms(valid_boxes, valid_scores, nms_thr)
+        dets = None
+        if len(keep):
             dets = np.concatenate(
                 [valid_boxes[keep], valid_scores[keep, None], valid_cls_inds[keep, None]], 1
             )
         return dets
 
-    @staticmethod
-    def nms(boxes, scores, nms_thr):
-        """Single class NMS implemented in Numpy."""
-        x1 = boxes[:, 0]
-        y1 = boxes[:, 1]
-        x2 = boxes[:, 2]
-        y2 = boxes[:, 3]
-
-        areas = (x2 - x1 + 1) * (y2 - y1 + 1)
-        order = scores.argsort()[::-1]
-
-        keep = []
-        while order.size > 0:
-            i = order[0]
-            keep.append(i)
-            xx1 = np.maximum(x1[i], x1[order[1:]])
-            yy1 = np.maximum(y1[i], y1[order[1:]])
-            xx2 = np.minimum(x2[i], x2[order[1:]])
-            yy2 = np.minimum(y2[i], y2[order[1:]])
-
-            w = np.maximum(0.0, xx2 - xx1 + 1)
-            h = np.maximum(0.0, yy2 - yy1 + 1)
-            inter = w * h
-            ovr = inter / (areas[i] + areas[order[1:]] - inter)
-
-            inds = np.where(ovr <= nms_thr)[0]
-            order = order[inds + 1]
-
-        return keep
-
     def unload(self):
         del self.net
@@ -10,7 +10,9 @@ from PyQt5.QtCore import QCoreApplication
 from anylabeling.app_info import __preferred_device__
 from anylabeling.views.labeling.shape import Shape
 from anylabeling.views.labeling.utils.opencv import qt_img_to_rgb_cv_img
+from . import ops
 from .model import Model
+from .model_cache import create_inference_session
 from .types import AutoLabelingResult
 from .dwpose_onnx import inference_pose
 
@@ -76,7 +78,7 @@ class YOLOX_DWPose(Model):
             backend = cv2.dnn.DNN_BACKEND_OPENCV
             cv_providers = cv2.dnn.DNN_TARGET_CPU
 
-        self.det_net = ort.InferenceSession(
+        self.det_net = create_inference_session(
                         det_model_abs_path, 
                         providers=ox_providers,
                         sess_options=sess_opts,
@@ -256,43 +258,14 @@ class YOLOX_DWPose(Model):
         valid_scores = cls_scores[valid_score_mask]
         valid_boxes = boxes[valid_score_mask]
         valid_cls_inds = cls_inds[valid_score_mask]
-        keep = self.nms(valid_boxes, valid_scores, nms_thr)
-        if keep:
+        keep = ops.numpy_nms(valid_boxes, valid_scores, nms_thr)
+        dets = None
+        if len(keep):
             dets = np.concatenate(
                 [valid_boxes[keep], valid_scores[keep, None], valid_cls_inds[keep, None]], 1
             )
         return dets
 
-    @staticmethod
-    def nms(boxes, scores, nms_thr):
-        """Single class NMS implemented in Numpy."""
-        x1 = boxes[:, 0]
-        y1 = boxes[:, 1]
-        x2 = boxes[:, 2]
-        y2 = boxes[:, 3]
-
-        areas = (x2 - x1 + 1) * (y2 - y1 + 1)
-        order = scores.argsort()[::-1]
-
-        keep = []
-        while order.size > 0:
-            i = order[0]
-            keep.append(i)
-            xx1 = np.maximum(x1[i], x1[order[1:]])
-            yy1 = np.maximum(y1[i], y1[order[1:]])
-            xx2 = np.minimum(x2[i], x2[order[1:]])
-            yy2 = np.minimum(y2[i], y2[order[1:]])
-
-            w = np.maximum(0.0, xx2 - xx1 + 1)
-            h = np.maximum(0.0, yy2 - yy1 + 1)
-            inter = w * h
-            ovr = inter / (areas[i] + areas[order[1:]] - inter)
-
-            inds = np.where(ovr <= nms_thr)[0]
-            order = order[inds + 1]
-
-        return keep
-
     def unload(self):
         del self.det_net
         del self.pose_net
@@ -0,0 +1,170 @@
+"""Scan image folders in the background."""
+
+import hashlib
+import json
+import os
+import os.path as osp
+import threading
+import time
+
+import natsort
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from .logger import logger
+
+
+class ScanCache:
+    """Cache of the image files of scanned folders.
+
+    For each directory, its mtime, its image files (name, size, mtime) and
+    its subdirectories are kept. A directory is only listed again if its
+    mtime has changed, i.e. if entries were added, removed or renamed.
+    """
+
+    def __init__(self, root=None):
+        if root is None:
+            root = osp.join(
+                osp.expanduser("~"), "anylabeling_data", "scan_cache"
+            )
+        self.root = root
+        self.lock = threading.Lock()
+        self._dirs = {}  # cache file -> {dirpath: entry}
+
+    def get_cache_file(self, folder_path, extensions):
+        key = "\n".join([osp.abspath(folder_path)] + sorted(extensions))
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        return osp.join(self.root, f"{name}.json")
+
+    def load(self, folder_path, extensions):
+        """Get cached directories of a folder"""
+        cache_file = self.get_cache_file(folder_path, extensions)
+        with self.lock:
+            dirs = self._dirs.get(cache_file)
+        if dirs is not None:
+            return dirs
+        try:
+            with open(cache_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:  # noqa
+            logger.warning("Could not read scan cache: %s", e)
+            return {}
+
+    def save(self, folder_path, extensions, dirs):
+        """Save directories of a folder"""
+        cache_file = self.get_cache_file(folder_path, extensions)
+        with self.lock:
+            self._dirs[cache_file] = dirs
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                json.dump(dirs, f)
+            os.replace(tmp_file, cache_file)
+        except Exception as e:  # noqa
+            logger.warning("Could not save scan cache: %s", e)
+
+
+class FolderScanner(QObject):
+    """Find the images of a folder with os.scandir.
+
+    Images are reported in batches while the folder is being scanned,
+    then the full sorted list is reported once the scan has finished.
+    """
+
+    files_found = pyqtSignal(list)
+    scan_finished = pyqtSignal(list)
+
+    # Report found files at least this often (seconds)
+    REPORT_INTERVAL = 0.5
+
+    def __init__(self, folder_path, extensions, cache=None, batch_size=1000):
+        super().__init__()
+        self.folder_path = folder_path
+        self.extensions = tuple(ext.lower() for ext in extensions)
+        self.cache = cache
+        self.batch_size = batch_size
+        self.stopped = False
+
+    def stop(self):
+        self.stopped = True
+
+    def run(self):
+        cached_dirs = {}
+        if self.cache is not None:
+            cached_dirs = self.cache.load(self.folder_path, self.extensions)
+        dirs = {}
+        images = []
+        batch = []
+        last_report = 0
+        stack = [self.folder_path]
+        while stack:
+            if self.stopped:
+                return
+            dirpath = stack.pop()
+            entry = self.scan_dir(dirpath, cached_dirs.get(dirpath))
+            if entry is None:
+                continue
+            dirs[dirpath] = entry
+            batch.extend(osp.join(dirpath, name) for name, _, _ in entry[1])
+            # Subdirectories are scanned in sorted order
+            stack.extend(osp.join(dirpath, name) for name in entry[2][::-1])
+            if batch and (
+                not images
+                or len(batch) >= self.batch_size
+                or time.time() - last_report > self.REPORT_INTERVAL
+            ):
+                images.extend(batch)
+                self.files_found.emit(batch)
+                batch = []
+                last_report = time.time()
+        if batch:
+            images.extend(batch)
+            self.files_found.emit(batch)
+        if self.cache is not None:
+            self.cache.save(self.folder_path, self.extensions, dirs)
+        self.scan_finished.emit(natsort.os_sorted(images))
+
+    def scan_dir(self, dirpath, cached_entry=None):
+        """List a directory.
+
+        Returns [mtime, [[name, size, mtime], ...], [subdirectory, ...]],
+        the cached entry if the directory has not changed, or None on error.
+        """
+        try:
+            mtime = os.stat(dirpath).st_mtime_ns
+        except OSError as e:
+            logger.warning("Could not scan %s: %s", dirpath, e)
+            return None
+        if cached_entry is not None and cached_entry[0] == mtime:
+            return cached_entry
+
+        files = []
+        subdirs = []
+        try:
+            with os.scandir(dirpath) as it:
+                for dir_entry in it:
+                    if self.stopped:
+                        return None
+                    try:
+                        # Like os.walk, do not follow symlinks to directories
+                        if dir_entry.is_dir():
+                            if not dir_entry.is_symlink():
+                                subdirs.append(dir_entry.name)
+                        elif dir_entry.name.lower().endswith(self.extensions):
+                            stat = dir_entry.stat()
+                            files.append(
+                                [
+                                    dir_entry.name,
+                                    stat.st_size,
+                                    stat.st_mtime_ns,
+                                ]
+                            )
+                    except OSError:
+                        continue
+        except OSError as e:
+            logger.warning("Could not scan %s: %s", dirpath, e)
+            return None
+        files = natsort.os_sorted(files, key=lambda file: file[0])
+        return [mtime, files, natsort.os_sorted(subdirs)]
@@ -0,0 +1,143 @@
+"""Background loading of the images around the current image."""
+
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .label_file import LabelFile
+from .logger import logger
+from .utils.opencv import DecodedImage
+
+
+def get_mtime(filename):
+    """Get modification time of a file, None if it does not exist"""
+    try:
+        return os.stat(filename).st_mtime_ns
+    except OSError:
+        return None
+
+
+class PrefetchedImage:
+    """Decoded image and parsed label file of an image file"""
+
+    def __init__(self, filename, label_file_path):
+        self.filename = filename
+        self.label_file_path = label_file_path
+        self.mtimes = (get_mtime(filename), get_mtime(label_file_path))
+        self.label_file = None
+        self.image = None
+        if self.mtimes[1] is not None and LabelFile.is_label_file(
+            label_file_path
+        ):
+            self.label_file = LabelFile(label_file_path)
+            if self.label_file.image_file is None:
+                self.image = DecodedImage.from_data(self.label_file.image_data)
+            else:
+                self.image = DecodedImage.from_file(self.label_file.image_file)
+        else:
+            self.image = DecodedImage.from_file(filename)
+
+    @property
+    def nbytes(self):
+        return self.image.array.nbytes if self.image is not None else 0
+
+    def is_valid(self):
+        """Returns False if the files have changed since they were read"""
+        return self.image is not None and self.mtimes == (
+            get_mtime(self.filename),
+            get_mtime(self.label_file_path),
+        )
+
+
+class ImagePrefetcher:
+    """Load images and label files ahead of time in a thread pool.
+
+    Only the files of the last prefetch() call are kept. When the memory
+    limit is hit, the images at the end of that list are dropped.
+    """
+
+    def __init__(self, num_workers=2, max_memory_mb=1024):
+        self.max_memory = int(max_memory_mb * 1024 * 1024)
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(1, num_workers),
+            thread_name_prefix="image_prefetcher",
+        )
+        # Reentrant, as done callbacks may run in the submitting thread
+        self.lock = threading.RLock()
+        self._futures = OrderedDict()  # filename -> future, by priority
+
+    def prefetch(self, files):
+        """Start loading files, a list of (image file, label file path)
+        ordered by priority
+        """
+        with self.lock:
+            futures = OrderedDict()
+            for filename, label_file_path in files:
+                future = self._futures.pop(filename, None)
+                if future is None or (
+                    future.done()
+                    and (future.cancelled() or future.exception())
+                ):
+                    future = self.executor.submit(
+                        self._load, filename, label_file_path
+                    )
+                    future.add_done_callback(self._on_loaded)
+                futures[filename] = future
+            for future in self._futures.values():
+                future.cancel()
+            self._futures = futures
+
+    @staticmethod
+    def _load(filename, label_file_path):
+        try:
+            return PrefetchedImage(filename, label_file_path)
+        except Exception as e:  # noqa
+            logger.debug("Could not prefetch %s: %s", filename, e)
+            raise
+
+    def _on_loaded(self, _future):
+        """Drop the last images if the memory limit is exceeded"""
+        with self.lock:
+            total = 0
+            for filename, future in list(self._futures.items()):
+                if not future.done() or future.cancelled():
+                    continue
+                if future.exception() is not None:
+                    continue
+                total += future.result().nbytes
+                if total > self.max_memory:
+                    del self._futures[filename]
+
+    def take(self, filename, label_file_path):
+        """Get a prefetched image and remove it from the cache.
+
+        Waits if the image is being loaded. Returns None if the image was
+        not prefetched, could not be loaded or has changed on disk.
+        """
+        with self.lock:
+            future = self._futures.pop(filename, None)
+        if future is None or (not future.running() and future.cancel()):
+            return None
+        try:
+            prefetched = future.result()
+        except Exception:  # noqa
+            return None
+        if (
+            prefetched.label_file_path != label_file_path
+            or not prefetched.is_valid()
+        ):
+            return None
+        return prefetched
+
+    def clear(self):
+        """Drop all prefetched images"""
+        with self.lock:
+            for future in self._futures.values():
+                future.cancel()
+            self._futures.clear()
+
+    def shutdown(self):
+        """Stop the worker threads"""
+        self.clear()
+        self.executor.shutdown(wait=False)
@@ -27,14 +27,34 @@ class LabelFileError(Exception):
 class LabelFile:
     suffix = ".json"
 
+    # Image formats which can be used as they are, without re-encoding
+    raw_image_formats = ["BMP", "JPEG", "PNG"]
+
     def __init__(self, filename=None):
         self.shapes = []
         self.image_path = None
-        self.image_data = None
+        self.image_file = None
+        self.image_height = None
+        self.image_width = None
+        self._image_data = None
+        self._image_source = None
         if filename is not None:
             self.load(filename)
         self.filename = filename
 
+    @property
+    def image_data(self):
+        """Image data, which is only read from file when it is first used"""
+        if self._image_data is None and self._image_source is not None:
+            source, self._image_source = self._image_source, None
+            self._image_data = self.load_image_file(source)
+        return self._image_data
+
+    @image_data.setter
+    def image_data(self, value):
+        self._image_data = value
+        self._image_source = None
+
     @staticmethod
     def load_image_file(filename):
         try:
@@ -43,6 +63,14 @@ class LabelFile:
             logger.error("Failed opening image file: %s", filename)
             return None
 
+        # use the file as it is if it does not need to be converted
+        if image_pil.format in LabelFile.raw_image_formats and (
+            utils.get_exif_orientation(image_pil) in [None, 1]
+        ):
+            image_pil.close()
+            with open(filename, "rb") as f:
+                return f.read()
+
         # apply orientation to image according to exif
         image_pil = utils.apply_exif_orientation(image_pil)
 
@@ -84,16 +112,22 @@ class LabelFile:
                     "Loading JSON file (%s) of unknown version", filename
                 )
 
+            # Only read the image size here, image files are loaded lazily
             if data["imageData"] is not None:
                 image_data = base64.b64decode(data["imageData"])
+                image_source = None
+                image_size = utils.img_size(image_data, exif_orientation=False)
             else:
                 # relative path from label file to relative path from cwd
-                image_path = osp.join(osp.dirname(filename), data["imagePath"])
-                image_data = self.load_image_file(image_path)
+                image_data = None
+                image_source = osp.join(
+                    osp.dirname(filename), data["imagePath"]
+                )
+                image_size = utils.img_size(image_source)
             flags = data.get("flags") or {}
             image_path = data["imagePath"]
-            self._check_image_height_and_width(
-                base64.b64encode(image_data).decode("utf-8"),
+            image_height, image_width = self._check_image_height_and_width(
+                image_size,
                 data.get("imageHeight"),
                 data.get("imageWidth"),
             )
@@ -126,25 +160,28 @@ class LabelFile:
         self.flags = flags
         self.shapes = shapes
         self.image_path = image_path
-        self.image_data = image_data
+        self.image_file = image_source
+        self.image_height = image_height
+        self.image_width = image_width
+        self._image_data = image_data
+        self._image_source = image_source
         self.filename = filename
         self.other_data = other_data
 
     @staticmethod
-    def _check_image_height_and_width(image_data, image_height, image_width):
-        img_arr = utils.img_b64_to_arr(image_data)
-        if image_height is not None and img_arr.shape[0] != image_height:
+    def _check_image_height_and_width(image_size, image_height, image_width):
+        if image_height is not None and image_size[0] != image_height:
             logger.error(
                 "image_height does not match with image_data or image_path, "
                 "so getting image_height from actual image."
             )
-            image_height = img_arr.shape[0]
-        if image_width is not None and img_arr.shape[1] != image_width:
+            image_height = image_size[0]
+        if image_width is not None and image_size[1] != image_width:
             logger.error(
                 "image_width does not match with image_data or image_path, "
                 "so getting image_width from actual image."
             )
-            image_width = img_arr.shape[1]
+            image_width = image_size[1]
         return image_height, image_width
 
     def save(
@@ -159,10 +196,12 @@ class LabelFile:
         flags=None,
     ):
         if image_data is not None:
-            image_data = base64.b64encode(image_data).decode("utf-8")
             image_height, image_width = self._check_image_height_and_width(
-                image_data, image_height, image_width
+                utils.img_size(image_data, exif_orientation=False),
+                image_height,
+                image_width,
             )
+            image_data = base64.b64encode(image_data).decode("utf-8")
         if other_data is None:
             other_data = {}
         if flags is None:
@@ -7,7 +7,7 @@ import re
 import webbrowser
 
 import imgviz
-import natsort
+import PIL.Image
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtCore import Qt, pyqtSlot
 from PyQt5.QtWidgets import (
@@ -21,18 +21,23 @@ from PyQt5.QtWidgets import (
 )
 
 from anylabeling.services.auto_labeling.types import AutoLabelingMode
+from anylabeling.utils import GenericWorker
 
 from ...app_info import __appname__
 from . import utils
 from ...config import get_config, save_config
+from .folder_scanner import FolderScanner, ScanCache
+from .image_prefetcher import ImagePrefetcher
 from .label_file import LabelFile, LabelFileError
 from .logger import logger
 from .shape import Shape
+from .utils.opencv import DecodedImage
 from .widgets import (
     AutoLabelingWidget,
     BrightnessContrastDialog,
     Canvas,
     FileDialogPreview,
+    FileListWidget,
     LabelDialog,
     LabelListWidget,
     LabelListWidgetItem,
@@ -82,6 +87,16 @@ class LabelingWidget(LabelDialog):
             config = get_config()
         self._config = config
 
+        self.scan_cache = ScanCache()
+        self.folder_scanner = None
+        self.folder_scan_thread = None
+        self.folder_scan_worker = None
+
+        self.image_prefetcher = ImagePrefetcher(
+            num_workers=self._config["image_prefetch"]["num_workers"],
+            max_memory_mb=self._config["image_prefetch"]["max_memory_mb"],
+        )
+
         # set default shape colors
         Shape.line_color = QtGui.QColor(*self._config["shape"]["line_color"])
         Shape.fill_color = QtGui.QColor(*self._config["shape"]["fill_color"])
@@ -186,7 +201,7 @@ class LabelingWidget(LabelDialog):
         self.file_search = QtWidgets.QLineEdit()
         self.file_search.setPlaceholderText(self.tr("Search Filename"))
         self.file_search.textChanged.connect(self.file_search_changed)
-        self.file_list_widget = QtWidgets.QListWidget()
+        self.file_list_widget = FileListWidget(self.get_image_label_file)
         self.file_list_widget.itemSelectionChanged.connect(
             self.file_selection_changed
         )
@@ -216,6 +231,7 @@ class LabelingWidget(LabelDialog):
             epsilon=self._config["epsilon"],
             double_click=self._config["canvas"]["double_click"],
             num_backups=self._config["canvas"]["num_backups"],
+            tiled_rendering=self._config["canvas"]["tiled_rendering"],
         )
         self.canvas.zoom_request.connect(self.zoom_request)
 
@@ -690,6 +706,16 @@ class LabelingWidget(LabelDialog):
             "brain",
             self.tr("Auto Labeling"),
         )
+        precompute_embeddings = action(
+            self.tr("&Precompute Embeddings"),
+            self.precompute_embeddings,
+            None,
+            "brain",
+            self.tr(
+                "Encode all images in the background with the current"
+                " Segment Anything model"
+            ),
+        )
 
         # Label list context menu.
         label_menu = QtWidgets.QMenu()
@@ -788,6 +814,7 @@ class LabelingWidget(LabelDialog):
             on_shapes_present=(save_as, hide_all, show_all),
             group_selected_shapes=group_selected_shapes,
             ungroup_selected_shapes=ungroup_selected_shapes,
+            precompute_embeddings=precompute_embeddings,
         )
 
         self.canvas.vertex_selected.connect(
@@ -820,6 +847,7 @@ class LabelingWidget(LabelDialog):
                 close,
                 delete_file,
                 None,
+                precompute_embeddings,
             ),
         )
         utils.add_actions(
@@ -1423,19 +1451,14 @@ class LabelingWidget(LabelDialog):
         )
 
     def file_selection_changed(self):
-        items = self.file_list_widget.selectedItems()
-        if not items:
+        filename = self.file_list_widget.selected_file()
+        if not filename:
             return
-        item = items[0]
 
         if not self.may_continue():
             return
 
-        current_index = self.image_list.index(str(item.text()))
-        if current_index < len(self.image_list):
-            filename = self.image_list[current_index]
-            if filename:
-                self.load_file(filename)
+        self.load_file(filename)
 
     # React to canvas signals.
     def shape_selection_changed(self, selected_shapes):
@@ -1623,9 +1646,13 @@ class LabelingWidget(LabelDialog):
             flags[key] = flag
         try:
             image_path = osp.relpath(self.image_path, osp.dirname(filename))
-            image_data = (
-                self.image_data if self._config["store_data"] else None
-            )
+            image_data = None
+            if self._config["store_data"]:
+                if self.image_data is None:
+                    self.image_data = LabelFile.load_image_file(
+                        self.image_path
+                    )
+                image_data = self.image_data
             if osp.dirname(filename) and not osp.exists(osp.dirname(filename)):
                 os.makedirs(osp.dirname(filename))
             label_file.save(
@@ -1639,13 +1666,7 @@ class LabelingWidget(LabelDialog):
                 flags=flags,
             )
             self.label_file = label_file
-            items = self.file_list_widget.findItems(
-                self.image_path, Qt.MatchExactly
-            )
-            if len(items) > 0:
-                if len(items) != 1:
-                    raise RuntimeError("There are duplicate files.")
-                items[0].setCheckState(Qt.Checked)
+            self.file_list_widget.set_checked(self.filename, True)
             # disable allows next and previous image to proceed
             # self.filename = filename
             return True
@@ -1831,13 +1852,11 @@ class LabelingWidget(LabelDialog):
         save_config(self._config)
 
     def on_new_brightness_contrast(self, qimage):
-        self.canvas.load_pixmap(
-            QtGui.QPixmap.fromImage(qimage), clear_shapes=False
-        )
+        self.canvas.load_image(qimage, clear_shapes=False)
 
     def brightness_contrast(self, _):
         dialog = BrightnessContrastDialog(
-            utils.img_data_to_pil(self.image_data),
+            PIL.Image.fromarray(self.image.array),
             self.on_new_brightness_contrast,
             parent=self,
         )
@@ -1865,9 +1884,8 @@ class LabelingWidget(LabelDialog):
         filenames = []
         current_index = 0
         if filename is not None:
-            try:
-                current_index = self.image_list.index(filename)
-            except ValueError:
+            current_index = self.file_list_widget.row(filename)
+            if current_index < 0:
                 return []
             filenames.append(filename)
         for _ in range(num_files):
@@ -1897,13 +1915,9 @@ class LabelingWidget(LabelDialog):
         self.inform_next_files(filename)
 
         # Changing file_list_widget loads file
-        if filename in self.image_list and (
-            self.file_list_widget.currentRow()
-            != self.image_list.index(filename)
-        ):
-            self.file_list_widget.setCurrentRow(
-                self.image_list.index(filename)
-            )
+        row = self.file_list_widget.row(filename)
+        if row >= 0 and self.file_list_widget.currentRow() != row:
+            self.file_list_widget.setCurrentRow(row)
             self.file_list_widget.repaint()
             return False
 
@@ -1923,11 +1937,29 @@ class LabelingWidget(LabelDialog):
         self.status(
             str(self.tr("Loading %s...")) % osp.basename(str(filename))
         )
-        label_file = osp.splitext(filename)[0] + ".json"
-        if self.output_dir:
-            label_file_without_path = osp.basename(label_file)
-            label_file = osp.join(self.output_dir, label_file_without_path)
-        if QtCore.QFile.exists(label_file) and LabelFile.is_label_file(
+        label_file = self.get_image_label_file(filename)
+        prefetched = self.image_prefetcher.take(filename, label_file)
+        if prefetched is not None:
+            self.label_file = prefetched.label_file
+            image = prefetched.image
+            if self.label_file:
+                self.image_path = osp.join(
+                    osp.dirname(label_file),
+                    self.label_file.image_path,
+                )
+                if self.label_file.image_file is None:
+                    self.image_data = self.label_file.image_data
+                self.other_data = self.label_file.other_data
+                self.shape_text_edit.textChanged.disconnect()
+                self.shape_text_edit.setPlainText(
+                    self.other_data.get("image_text", "")
+                )
+                self.shape_text_edit.textChanged.connect(
+                    self.shape_text_changed
+                )
+            else:
+                self.image_path = filename
+        elif QtCore.QFile.exists(label_file) and LabelFile.is_label_file(
             label_file
         ):
             try:
@@ -1943,11 +1975,15 @@ class LabelingWidget(LabelDialog):
                 )
                 self.status(self.tr("Error reading %s") % label_file)
                 return False
-            self.image_data = self.label_file.image_data
             self.image_path = osp.join(
                 osp.dirname(label_file),
                 self.label_file.image_path,
             )
+            if self.label_file.image_file is None:
+                self.image_data = self.label_file.image_data
+                image = DecodedImage.from_data(self.image_data)
+            else:
+                image = DecodedImage.from_file(self.label_file.image_file)
             self.other_data = self.label_file.other_data
             self.shape_text_edit.textChanged.disconnect()
             self.shape_text_edit.setPlainText(
@@ -1955,13 +1991,12 @@ class LabelingWidget(LabelDialog):
             )
             self.shape_text_edit.textChanged.connect(self.shape_text_changed)
         else:
-            self.image_data = LabelFile.load_image_file(filename)
-            if self.image_data:
+            image = DecodedImage.from_file(filename)
+            if image is not None:
                 self.image_path = filename
             self.label_file = None
-        image = QtGui.QImage.fromData(self.image_data)
 
-        if image.isNull():
+        if image is None or image.isNull():
             formats = [
                 f"*.{fmt.data().decode()}"
                 for fmt in QtGui.QImageReader.supportedImageFormats()
@@ -1979,7 +2014,7 @@ class LabelingWidget(LabelDialog):
         self.filename = filename
         if self._config["keep_prev"]:
             prev_shapes = self.canvas.shapes
-        self.canvas.load_pixmap(QtGui.QPixmap.fromImage(image))
+        self.canvas.load_image(image)
         flags = {k: False for k in self._config["flags"] or []}
         if self.label_file:
             self.load_labels(self.label_file.shapes)
@@ -2006,11 +2041,6 @@ class LabelingWidget(LabelDialog):
                     orientation, self.scroll_values[orientation][self.filename]
                 )
         # set brightness contrast values
-        dialog = BrightnessContrastDialog(
-            utils.img_data_to_pil(self.image_data),
-            self.on_new_brightness_contrast,
-            parent=self,
-        )
         brightness, contrast = self.brightness_contrast_values.get(
             self.filename, (None, None)
         )
@@ -2022,20 +2052,70 @@ class LabelingWidget(LabelDialog):
             _, contrast = self.brightness_contrast_values.get(
                 self.recent_files[0], (None, None)
             )
-        if brightness is not None:
-            dialog.slider_brightness.setValue(brightness)
-        if contrast is not None:
-            dialog.slider_contrast.setValue(contrast)
         self.brightness_contrast_values[self.filename] = (brightness, contrast)
         if brightness is not None or contrast is not None:
+            dialog = BrightnessContrastDialog(
+                PIL.Image.fromarray(self.image.array),
+                self.on_new_brightness_contrast,
+                parent=self,
+            )
+            if brightness is not None:
+                dialog.slider_brightness.setValue(brightness)
+            if contrast is not None:
+                dialog.slider_contrast.setValue(contrast)
             dialog.on_new_value(None)
         self.paint_canvas()
         self.add_recent_file(self.filename)
         self.toggle_actions(True)
         self.canvas.setFocus()
         self.status(str(self.tr("Loaded %s")) % osp.basename(str(filename)))
+        self.prefetch_images(filename)
+        self.auto_run_on_open()
         return True
 
+    def auto_run_on_open(self):
+        """Run the auto labeling model on an image without labels,
+        if enabled in config
+        """
+        model_manager = self.auto_labeling_widget.model_manager
+        if (
+            not self._config["speculative_inference"]["auto_run_on_open"]
+            or self.label_file is not None
+            or not self.no_shape()
+            or self.auto_labeling_widget.isHidden()
+            or model_manager.loaded_model_config is None
+            or model_manager.is_marks_model_loaded()
+        ):
+            return
+        self.auto_labeling_widget.run_prediction()
+
+    def get_image_label_file(self, filename):
+        """Get path of the label file of an image"""
+        label_file = osp.splitext(filename)[0] + ".json"
+        if self.output_dir:
+            label_file_without_path = osp.basename(label_file)
+            label_file = osp.join(self.output_dir, label_file_without_path)
+        return label_file
+
+    def prefetch_images(self, filename):
+        """Load the images around the current image in the background,
+        so that switching to them is fast
+        """
+        num_files = self._config["image_prefetch"]["num_files"]
+        current_index = self.file_list_widget.row(filename)
+        if num_files <= 0 or current_index < 0:
+            return
+        files = []
+        for offset in range(1, num_files + 1):
+            # Next images first, as they are usually opened next
+            for index in (current_index + offset, current_index - offset):
+                if 0 <= index < len(self.image_list):
+                    image_file = self.image_list[index]
+                    files.append(
+                        (image_file, self.get_image_label_file(image_file))
+                    )
+        self.image_prefetcher.prefetch(files)
+
     # QT Overload
     def resizeEvent(self, _):
         if (
@@ -2089,6 +2169,9 @@ class LabelingWidget(LabelDialog):
         self.settings.setValue("window/position", self.pos())
         self.settings.setValue("window/state", self.parent.parent.saveState())
         self.settings.setValue("recent_files", self.recent_files)
+        if event.isAccepted():
+            self.image_prefetcher.shutdown()
+            self.stop_scan_image_folder()
         # ask the use for where to save the labels
         # self.settings.setValue('window/geometry', self.saveGeometry())
 
@@ -2134,7 +2217,7 @@ class LabelingWidget(LabelDialog):
         if self.filename is None:
             return
 
-        current_index = self.image_list.index(self.filename)
+        current_index = self.file_list_widget.row(self.filename)
         if current_index - 1 >= 0:
             filename = self.image_list[current_index - 1]
             if filename:
@@ -2161,7 +2244,7 @@ class LabelingWidget(LabelDialog):
         if self.filename is None:
             filename = self.image_list[0]
         else:
-            current_index = self.image_list.index(self.filename)
+            current_index = self.file_list_widget.row(self.filename)
             if current_index + 1 < len(self.image_list):
                 filename = self.image_list[current_index + 1]
             else:
@@ -2226,14 +2309,13 @@ class LabelingWidget(LabelDialog):
         self.statusBar().show()
 
         current_filename = self.filename
-        self.import_image_folder(self.last_open_dir, load=False)
-
-        if current_filename in self.image_list:
-            # retain currently selected file
-            self.file_list_widget.setCurrentRow(
-                self.image_list.index(current_filename)
-            )
-            self.file_list_widget.repaint()
+        if not self.may_continue() or not self.last_open_dir:
+            return
+        self.filename = None
+        self.file_list_widget.clear()
+        self.scan_image_folder(
+            self.last_open_dir, load=False, select_file=current_filename
+        )
 
     def save_file(self, _value=False):
         assert not self.image.isNull(), "cannot save empty image"
@@ -2323,8 +2405,7 @@ class LabelingWidget(LabelDialog):
             os.remove(label_file)
             logger.info("Label file is removed: %s", label_file)
 
-            item = self.file_list_widget.currentItem()
-            item.setCheckState(Qt.Unchecked)
+            self.file_list_widget.set_checked(self.filename, False)
 
             self.reset_state()
 
@@ -2446,11 +2527,8 @@ class LabelingWidget(LabelDialog):
 
     @property
     def image_list(self):
-        lst = []
-        for i in range(self.file_list_widget.count()):
-            item = self.file_list_widget.item(i)
-            lst.append(item.text())
-        return lst
+        """All files in the file list. The list must not be modified."""
+        return self.file_list_widget.files
 
     def import_dropped_image_files(self, image_files):
         extensions = [
@@ -2459,24 +2537,13 @@ class LabelingWidget(LabelDialog):
         ]
 
         self.filename = None
-        for file in image_files:
-            if file in self.image_list or not file.lower().endswith(
-                tuple(extensions)
-            ):
-                continue
-            label_file = osp.splitext(file)[0] + ".json"
-            if self.output_dir:
-                label_file_without_path = osp.basename(label_file)
-                label_file = osp.join(self.output_dir, label_file_without_path)
-            item = QtWidgets.QListWidgetItem(file)
-            item.setFlags(Qt.ItemIsEnabled | Qt.ItemIsSelectable)
-            if QtCore.QFile.exists(label_file) and LabelFile.is_label_file(
-                label_file
-            ):
-                item.setCheckState(Qt.Checked)
-            else:
-                item.setCheckState(Qt.Unchecked)
-            self.file_list_widget.addItem(item)
+        self.file_list_widget.add_files(
+            [
+                file
+                for file in image_files
+                if file.lower().endswith(tuple(extensions))
+            ]
+        )
 
         if len(self.image_list) > 1:
             self.actions.open_next_image.setEnabled(True)
@@ -2494,39 +2561,96 @@ class LabelingWidget(LabelDialog):
         self.last_open_dir = dirpath
         self.filename = None
         self.file_list_widget.clear()
-        for filename in self.scan_all_images(dirpath):
-            if pattern and pattern not in filename:
-                continue
-            label_file = osp.splitext(filename)[0] + ".json"
-            if self.output_dir:
-                label_file_without_path = osp.basename(label_file)
-                label_file = osp.join(self.output_dir, label_file_without_path)
-            item = QtWidgets.QListWidgetItem(filename)
-            item.setFlags(Qt.ItemIsEnabled | Qt.ItemIsSelectable)
-            if QtCore.QFile.exists(label_file) and LabelFile.is_label_file(
-                label_file
-            ):
-                item.setCheckState(Qt.Checked)
-            else:
-                item.setCheckState(Qt.Unchecked)
-            self.file_list_widget.addItem(item)
-        self.open_next_image(load=load)
+        self.scan_image_folder(dirpath, pattern=pattern, load=load)
 
-    def scan_all_images(self, folder_path):
-        extensions = [
+    def scan_image_folder(
+        self, dirpath, pattern=None, load=True, select_file=None
+    ):
+        """Scan a folder in a thread and add the images to the file list
+        as they are found. The first image is opened right away, and
+        select_file is selected once it is found.
+        """
+        self.stop_scan_image_folder()
+        scanner = FolderScanner(
+            dirpath, self.get_image_extensions(), cache=self.scan_cache
+        )
+        scanner.files_found.connect(
+            functools.partial(
+                self.on_images_found, scanner, pattern, load, select_file
+            )
+        )
+        scanner.scan_finished.connect(
+            functools.partial(self.on_image_scan_finished, scanner, pattern)
+        )
+        self.folder_scanner = scanner
+        self.folder_scan_thread = QtCore.QThread()
+        self.folder_scan_worker = GenericWorker(scanner.run)
+        self.folder_scan_worker.finished.connect(self.folder_scan_thread.quit)
+        self.folder_scan_worker.moveToThread(self.folder_scan_thread)
+        self.folder_scan_thread.started.connect(self.folder_scan_worker.run)
+        self.folder_scan_thread.start()
+
+    def stop_scan_image_folder(self):
+        """Stop scanning a folder"""
+        if self.folder_scanner is not None:
+            self.folder_scanner.stop()
+            self.folder_scanner = None
+        if self.folder_scan_thread is not None:
+            self.folder_scan_thread.quit()
+            self.folder_scan_thread.wait()
+            self.folder_scan_thread = None
+
+    def on_images_found(self, scanner, pattern, load, select_file, files):
+        if scanner is not self.folder_scanner:
+            return
+        if pattern:
+            files = [filename for filename in files if pattern in filename]
+        if not files:
+            return
+        self.file_list_widget.add_files(files)
+        if self.filename is None:
+            self.open_next_image(load=load)
+        if select_file in files:
+            # retain currently selected file
+            self.file_list_widget.setCurrentRow(
+                self.file_list_widget.row(select_file)
+            )
+            self.file_list_widget.repaint()
+
+    def on_image_scan_finished(self, scanner, pattern, files):
+        if scanner is not self.folder_scanner:
+            return
+        if pattern:
+            files = [filename for filename in files if pattern in filename]
+        # Images were added in scan order, show them sorted
+        self.file_list_widget.replace_files(files)
+
+    @staticmethod
+    def get_image_extensions():
+        return [
             f".{fmt.data().decode().lower()}"
             for fmt in QtGui.QImageReader.supportedImageFormats()
         ]
 
+    def scan_all_images(self, folder_path):
         images = []
-        for root, _, files in os.walk(folder_path):
-            for file in files:
-                if file.lower().endswith(tuple(extensions)):
-                    relative_path = osp.join(root, file)
-                    images.append(relative_path)
-        images = natsort.os_sorted(images)
+        scanner = FolderScanner(
+            folder_path, self.get_image_extensions(), cache=self.scan_cache
+        )
+        scanner.scan_finished.connect(images.extend)
+        scanner.run()
         return images
 
+    def precompute_embeddings(self):
+        """Precompute image embeddings of all images in the file list."""
+        if not self.image_list:
+            return
+        # Progress is reported in the auto labeling widget
+        self.auto_labeling_widget.show()
+        self.auto_labeling_widget.model_manager.precompute_embeddings(
+            self.image_list
+        )
+
     def toggle_auto_labeling_widget(self):
         """Toggle auto labeling widget visibility."""
         if self.auto_labeling_widget.isVisible():
@@ -5,9 +5,6 @@ from PyQt5 import QtCore, QtGui
 
 from . import utils
 
-# TODO(unknown):
-# - [opt] Store paths instead of creating new ones at each paint.
-
 
 DEFAULT_LINE_COLOR = QtGui.QColor(0, 255, 0, 128)  # bf hovering
 DEFAULT_FILL_COLOR = QtGui.QColor(100, 100, 100, 100)  # hovering
@@ -43,6 +40,12 @@ class Shape:
     point_size = 4
     scale = 1.5
 
+    # Size (relative to point_size) and type of the highlighted vertex
+    _highlight_settings = {
+        NEAR_VERTEX: (4, P_ROUND),
+        MOVE_VERTEX: (1.5, P_SQUARE),
+    }
+
     def __init__(
         self,
         label=None,
@@ -52,6 +55,10 @@ class Shape:
         flags=None,
         group_id=None,
     ):
+        # Incremented when the points change, to invalidate cached paths
+        self._points_version = 0
+        self._path = None
+        self._paint_paths = None
         self.label = label
         self.text = text
         self.group_id = group_id
@@ -64,10 +71,6 @@ class Shape:
 
         self._highlight_index = None
         self._highlight_mode = self.NEAR_VERTEX
-        self._highlight_settings = {
-            self.NEAR_VERTEX: (4, self.P_ROUND),
-            self.MOVE_VERTEX: (1.5, self.P_SQUARE),
-        }
 
         self._vertex_fill_color = None
 
@@ -101,6 +104,28 @@ class Shape:
         ]:
             raise ValueError(f"Unexpected shape_type: {value}")
         self._shape_type = value
+        self.points_changed()
+
+    @property
+    def points(self):
+        """Get the points of the shape"""
+        return self._points
+
+    @points.setter
+    def points(self, value):
+        """Set the points of the shape"""
+        self._points = value
+        self.points_changed()
+
+    @property
+    def points_version(self):
+        """Counter incremented each time the points change"""
+        return self._points_version
+
+    def points_changed(self):
+        """Invalidate the cached path. Must be called after changing
+        the points in place"""
+        self._points_version += 1
 
     def close(self):
         """Close the shape"""
@@ -112,6 +137,7 @@ class Shape:
             self.close()
         else:
             self.points.append(point)
+            self.points_changed()
 
     def can_add_point(self):
         """Check if shape supports more points"""
@@ -120,16 +146,19 @@ class Shape:
     def pop_point(self):
         """Remove and return the last point of the shape"""
         if self.points:
+            self.points_changed()
             return self.points.pop()
         return None
 
     def insert_point(self, i, point):
         """Insert a point to a specific index"""
         self.points.insert(i, point)
+        self.points_changed()
 
     def remove_point(self, i):
         """Remove point from a specific index"""
         self.points.pop(i)
+        self.points_changed()
 
     def is_closed(self):
         """Check if the shape is closed"""
@@ -156,48 +185,7 @@ class Shape:
             pen.setWidth(max(1, int(round(2.0 / self.scale))))
             painter.setPen(pen)
 
-            line_path = QtGui.QPainterPath()
-            vrtx_path = QtGui.QPainterPath()
-
-            if self.shape_type == "rectangle":
-                assert len(self.points) in [1, 2]
-                if len(self.points) == 2:
-                    rectangle = self.get_rect_from_line(*self.points)
-                    line_path.addRect(rectangle)
-                if self.selected:
-                    for i in range(len(self.points)):
-                        self.draw_vertex(vrtx_path, i)
-            elif self.shape_type == "circle":
-                assert len(self.points) in [1, 2]
-                if len(self.points) == 2:
-                    rectangle = self.get_circle_rect_from_line(self.points)
-                    line_path.addEllipse(rectangle)
-                if self.selected:
-                    for i in range(len(self.points)):
-                        self.draw_vertex(vrtx_path, i)
-            elif self.shape_type == "linestrip":
-                line_path.moveTo(self.points[0])
-                for i, p in enumerate(self.points):
-                    line_path.lineTo(p)
-                    if self.selected:
-                        self.draw_vertex(vrtx_path, i)
-            elif self.shape_type == "point":
-                assert len(self.points) == 1
-                self.draw_vertex(vrtx_path, 0)
-            else:
-                line_path.moveTo(self.points[0])
-                # Uncommenting the following line will draw 2 paths
-                # for the 1st vertex, and make it non-filled, which
-                # may be desirable.
-                self.draw_vertex(vrtx_path, 0)
-
-                for i, p in enumerate(self.points):
-                    line_path.lineTo(p)
-                    if self.selected:
-                        self.draw_vertex(vrtx_path, i)
-                if self.is_closed():
-                    line_path.lineTo(self.points[0])
-
+            line_path, vrtx_path = self.get_paint_paths()
             painter.drawPath(line_path)
             painter.drawPath(vrtx_path)
             if self._vertex_fill_color is not None:
@@ -210,6 +198,79 @@ class Shape:
                 )
                 painter.fillPath(line_path, color)
 
+    def get_paint_paths(self):
+        """Get the paths of the lines and vertices of the shape. The paths
+        are cached until the points or the drawing state change"""
+        key = (
+            self._points_version,
+            self._closed,
+            self.selected,
+            self._highlight_index,
+            self._highlight_mode,
+            self.scale,
+            self.point_size,
+            self.point_type,
+        )
+        if self._paint_paths is None or self._paint_paths[0] != key:
+            self._paint_paths = (key, *self._create_paint_paths())
+        return self._paint_paths[1:]
+
+    def _create_paint_paths(self):
+        line_path = QtGui.QPainterPath()
+        vrtx_path = QtGui.QPainterPath()
+
+        if self.shape_type == "rectangle":
+            assert len(self.points) in [1, 2]
+            if len(self.points) == 2:
+                rectangle = self.get_rect_from_line(*self.points)
+                line_path.addRect(rectangle)
+            if self.selected:
+                for i in range(len(self.points)):
+                    self.draw_vertex(vrtx_path, i)
+        elif self.shape_type == "circle":
+            assert len(self.points) in [1, 2]
+            if len(self.points) == 2:
+                rectangle = self.get_circle_rect_from_line(self.points)
+                line_path.addEllipse(rectangle)
+            if self.selected:
+                for i in range(len(self.points)):
+                    self.draw_vertex(vrtx_path, i)
+        elif self.shape_type == "linestrip":
+            line_path.moveTo(self.points[0])
+            for i, p in enumerate(self.points):
+                line_path.lineTo(p)
+                if self.selected:
+                    self.draw_vertex(vrtx_path, i)
+        elif self.shape_type == "point":
+            assert len(self.points) == 1
+            self.draw_vertex(vrtx_path, 0)
+        else:
+            line_path.moveTo(self.points[0])
+            # Uncommenting the following line will draw 2 paths
+            # for the 1st vertex, and make it non-filled, which
+            # may be desirable.
+            self.draw_vertex(vrtx_path, 0)
+
+            for i, p in enumerate(self.points):
+                line_path.lineTo(p)
+                if self.selected:
+                    self.draw_vertex(vrtx_path, i)
+            if self.is_closed():
+                line_path.lineTo(self.points[0])
+
+        return line_path, vrtx_path
+
+    @classmethod
+    def get_paint_margin(cls, scale):
+        """Distance (in widget pixels) from the bounding box of a shape
+        to the outside of its drawing at a scale: half of the largest
+        vertex plus the width of the pen"""
+        vertex_size = cls.point_size * max(
+            size for size, _ in cls._highlight_settings.values()
+        )
+        pen_width = max(1, int(round(2.0 / scale))) * scale
+        return vertex_size / 2 + pen_width
+
     def draw_vertex(self, path, i):
         """Draw a vertex"""
         d = self.point_size / self.scale
@@ -269,7 +330,13 @@ class Shape:
         return rectangle
 
     def make_path(self):
-        """Create a path from shape"""
+        """Create a path from shape. The path is cached until the points
+        change, and must not be modified"""
+        if self._path is None or self._path[0] != self._points_version:
+            self._path = (self._points_version, self._create_path())
+        return self._path[1]
+
+    def _create_path(self):
         if self.shape_type == "rectangle":
             path = QtGui.QPainterPath()
             if len(self.points) == 2:
@@ -297,6 +364,7 @@ class Shape:
     def move_vertex_by(self, i, offset):
         """Move a specific vertex by an offset"""
         self.points[i] = self.points[i] + offset
+        self.points_changed()
 
     def highlight_vertex(self, i, action):
         """Highlight a vertex appropriately based on the current action
@@ -317,6 +385,13 @@ class Shape:
         """Copy shape"""
         return copy.deepcopy(self)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Cached paths are not copied
+        state["_path"] = None
+        state["_paint_paths"] = None
+        return state
+
     def __len__(self):
         return len(self.points)
 
@@ -325,3 +400,4 @@ class Shape:
 
     def __setitem__(self, key, value):
         self.points[key] = value
+        self.points_changed()
@@ -0,0 +1,126 @@
+"""Spatial index of shapes, to hit-test shapes without testing them all."""
+
+import math
+
+
+class ShapeIndex:
+    """Uniform grid over the bounding boxes of shapes.
+
+    The index is synchronized with a list of shapes by sync(), which only
+    re-inserts the shapes whose points changed since they were indexed
+    (see Shape.points_version), so it stays up to date whatever code adds,
+    moves or deletes shapes. Shapes covering more than MAX_CELLS cells are
+    kept apart and always returned as candidates.
+    """
+
+    MAX_CELLS = 256
+
+    def __init__(self, cell_size=256):
+        self.cell_size = cell_size
+        self._cells = {}  # (cell x, cell y) -> set of shapes
+        self._large_shapes = set()
+        # shape -> [points version, bounding rect, cells, z-order]
+        self._entries = {}
+
+    def clear(self):
+        self._cells.clear()
+        self._large_shapes.clear()
+        self._entries.clear()
+
+    def get_cell_ranges(self, left, top, right, bottom):
+        size = self.cell_size
+        return (
+            range(math.floor(left / size), math.floor(right / size) + 1),
+            range(math.floor(top / size), math.floor(bottom / size) + 1),
+        )
+
+    def get_cells(self, left, top, right, bottom):
+        cells_x, cells_y = self.get_cell_ranges(left, top, right, bottom)
+        return [(x, y) for x in cells_x for y in cells_y]
+
+    def insert(self, shape, order):
+        rect = shape.bounding_rect()
+        cells = self.get_cells(
+            rect.left(), rect.top(), rect.right(), rect.bottom()
+        )
+        if len(cells) > self.MAX_CELLS:
+            cells = None
+            self._large_shapes.add(shape)
+        else:
+            for cell in cells:
+                self._cells.setdefault(cell, set()).add(shape)
+        self._entries[shape] = [shape.points_version, rect, cells, order]
+
+    def remove(self, shape):
+        entry = self._entries.pop(shape, None)
+        if entry is None:
+            return
+        if entry[2] is None:
+            self._large_shapes.discard(shape)
+            return
+        for cell in entry[2]:
+            shapes = self._cells[cell]
+            shapes.discard(shape)
+            if not shapes:
+                del self._cells[cell]
+
+    def sync(self, shapes):
+        """Update the index to the current shapes and their points"""
+        entries = self._entries
+        for order, shape in enumerate(shapes):
+            entry = entries.get(shape)
+            if entry is not None and entry[0] == shape.points_version:
+                entry[3] = order
+                continue
+            self.remove(shape)
+            if shape.points:
+                self.insert(shape, order)
+        if len(entries) != len(shapes):
+            current = set(shapes)
+            for shape in [s for s in entries if s not in current]:
+                self.remove(shape)
+
+    def query_rect(self, left, top, right, bottom):
+        """Shapes whose bounding box intersects a rectangle, from the
+        bottom one to the topmost (last drawn)"""
+        candidates = set(self._large_shapes)
+        cells_x, cells_y = self.get_cell_ranges(left, top, right, bottom)
+        if len(cells_x) * len(cells_y) > len(self._cells):
+            for cell_shapes in self._cells.values():
+                candidates.update(cell_shapes)
+        else:
+            for x in cells_x:
+                for y in cells_y:
+                    candidates.update(self._cells.get((x, y), ()))
+        shapes = []
+        for shape in candidates:
+            rect = self._entries[shape][1]
+            if (
+                rect.left() <= right
+                and rect.right() >= left
+                and rect.top() <= bottom
+                and rect.bottom() >= top
+            ):
+                shapes.append(shape)
+        shapes.sort(key=lambda shape: self._entries[shape][3])
+        return shapes
+
+    def query(self, point, margin=0.0):
+        """Shapes whose bounding box is within margin of a point, from
+        the topmost (last drawn) to the bottom one"""
+        x, y = point.x(), point.y()
+        candidates = set(self._large_shapes)
+        for cell in self.get_cells(
+            x - margin, y - margin, x + margin, y + margin
+        ):
+            candidates.update(self._cells.get(cell, ()))
+        shapes = []
+        for shape in candidates:
+            rect = self._entries[shape][1]
+            if (
+                rect.left() - margin <= x <= rect.right() + margin
+                and rect.top() - margin <= y <= rect.bottom() + margin
+            ):
+                shapes.append(shape)
+        shapes.sort(key=lambda shape: self._entries[shape][3], reverse=True)
+        return shapes
@@ -0,0 +1,150 @@
+"""Multi-resolution tile pyramid to draw very large images."""
+
+import math
+import threading
+from collections import OrderedDict
+
+from PyQt5 import QtCore, QtGui
+from PyQt5.QtCore import Qt
+
+
+class TilePyramid(QtCore.QObject):
+    """Pyramid of downsampled levels of an image, drawn by tiles.
+
+    Level 0 is the image itself, each next level halves the size of the
+    previous one until the image fits into one tile. The levels are built
+    in a background thread. Only the tiles of the visible area are
+    converted to pixmaps, from the level matching the zoom scale, and the
+    pixmaps are kept in an LRU cache limited to max_cache_mb.
+    """
+
+    level_ready = QtCore.pyqtSignal()
+
+    # Max number of tiles drawn from a finer level while the level
+    # matching the zoom scale is being built
+    MAX_FALLBACK_TILES = 64
+
+    def __init__(self, image, tile_size=512, max_cache_mb=256):
+        super().__init__()
+        self.tile_size = max(64, int(tile_size))
+        self.max_cache = max_cache_mb * 1024 * 1024
+        self.width, self.height = image.width(), image.height()
+        self.num_levels = 1 + max(
+            0,
+            math.ceil(
+                math.log2(max(self.width, self.height) / self.tile_size)
+            ),
+        )
+        self.lock = threading.Lock()
+        self.levels = [image] + [None] * (self.num_levels - 1)
+        self._tiles = OrderedDict()  # (level, x, y) -> QPixmap
+        self._cache_size = 0
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._build_levels, name="tile_pyramid", daemon=True
+        )
+        self._thread.start()
+
+    def _build_levels(self):
+        image = self.levels[0]
+        for level in range(1, self.num_levels):
+            if self._stopped.is_set():
+                return
+            image = image.scaled(
+                max(1, (image.width() + 1) // 2),
+                max(1, (image.height() + 1) // 2),
+                Qt.IgnoreAspectRatio,
+                Qt.SmoothTransformation,
+            )
+            with self.lock:
+                self.levels[level] = image
+            self.level_ready.emit()
+
+    def stop(self):
+        """Stop building the levels and release the cached tiles"""
+        self._stopped.set()
+        self._tiles.clear()
+        self._cache_size = 0
+
+    def get_level(self, scale):
+        """Coarsest level with at least the resolution of a zoom scale"""
+        if scale >= 1:
+            return 0
+        return min(self.num_levels - 1, int(math.log2(1 / scale)))
+
+    def get_tile(self, level, x, y):
+        """Pixmap of a tile of a level, from the cache if possible"""
+        key = (level, x, y)
+        pixmap = self._tiles.get(key)
+        if pixmap is not None:
+            self._tiles.move_to_end(key)
+            return pixmap
+
+        image = self.levels[level]
+        left, top = x * self.tile_size, y * self.tile_size
+        pixmap = QtGui.QPixmap.fromImage(
+            image.copy(
+                left,
+                top,
+                min(self.tile_size, image.width() - left),
+                min(self.tile_size, image.height() - top),
+            )
+        )
+        self._tiles[key] = pixmap
+        self._cache_size += self.get_pixmap_size(pixmap)
+        while self._cache_size > self.max_cache and len(self._tiles) > 1:
+            _, evicted = self._tiles.popitem(last=False)
+            self._cache_size -= self.get_pixmap_size(evicted)
+        return pixmap
+
+    @staticmethod
+    def get_pixmap_size(pixmap):
+        return pixmap.width() * pixmap.height() * max(1, pixmap.depth() // 8)
+
+    def paint(self, painter, rect, scale):
+        """Draw the tiles intersecting rect (in image coordinates) at
+        the resolution of the zoom scale. Returns False if nothing could
+        be drawn until the matching level is built."""
+        level = self.get_level(scale)
+        with self.lock:
+            while self.levels[level] is None:
+                level -= 1
+            image = self.levels[level]
+        factor_x = self.width / image.width()
+        factor_y = self.height / image.height()
+        step_x = self.tile_size * factor_x
+        step_y = self.tile_size * factor_y
+        tiles_x = range(
+            max(0, int(rect.left() / step_x)),
+            min(
+                math.ceil(image.width() / self.tile_size),
+                int(rect.right() / step_x) + 1,
+            ),
+        )
+        tiles_y = range(
+            max(0, int(rect.top() / step_y)),
+            min(
+                math.ceil(image.height() / self.tile_size),
+                int(rect.bottom() / step_y) + 1,
+            ),
+        )
+        if (
+            level < self.get_level(scale)
+            and len(tiles_x) * len(tiles_y) > self.MAX_FALLBACK_TILES
+        ):
+            return False
+
+        for y in tiles_y:
+            for x in tiles_x:
+                pixmap = self.get_tile(level, x, y)
+                painter.drawPixmap(
+                    QtCore.QRectF(
+                        x * step_x,
+                        y * step_y,
+                        pixmap.width() * factor_x,
+                        pixmap.height() * factor_y,
+                    ),
+                    pixmap,
+                    QtCore.QRectF(pixmap.rect()),
+                )
+        return True
@@ -3,12 +3,14 @@
 from ._io import lblsave
 from .image import (
     apply_exif_orientation,
+    get_exif_orientation,
     img_arr_to_b64,
     img_b64_to_arr,
     img_data_to_arr,
     img_data_to_pil,
     img_data_to_png_data,
     img_pil_to_data,
+    img_size,
 )
 from .qt import (
     Struct,
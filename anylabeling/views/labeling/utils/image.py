@@ -56,14 +56,14 @@ def img_data_to_png_data(img_data):
             return f.read()
 
 
-def apply_exif_orientation(image):
+def get_exif_orientation(image):
     try:
         exif = image._getexif()
     except AttributeError:
         exif = None
 
     if exif is None:
-        return image
+        return None
 
     exif = {
         PIL.ExifTags.TAGS[k]: v
@@ -71,7 +71,26 @@ def apply_exif_orientation(image):
         if k in PIL.ExifTags.TAGS
     }
 
-    orientation = exif.get("Orientation", None)
+    return exif.get("Orientation", None)
+
+
+def img_size(image, exif_orientation=True):
+    """Get (height, width) of an image file or image data.
+
+    Only the image header is read, pixel data is not decoded.
+    """
+    if isinstance(image, bytes):
+        image = io.BytesIO(image)
+    with PIL.Image.open(image) as img_pil:
+        width, height = img_pil.size
+        if exif_orientation and get_exif_orientation(img_pil) in (5, 6, 7, 8):
+            # rotated by 90 or 270 degrees
+            width, height = height, width
+    return height, width
+
+
+def apply_exif_orientation(image):
+    orientation = get_exif_orientation(image)
 
     if orientation == 1:
         # do nothing
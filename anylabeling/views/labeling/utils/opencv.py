@@ -2,28 +2,147 @@ import os.path
 
 import cv2
 import numpy as np
+import PIL.Image
 import qimage2ndarray
 from PyQt5 import QtGui
-from PyQt5.QtGui import QImage
+from PyQt5.QtGui import QImage, QImageReader
+
+from .image import get_exif_orientation
+
+
+class DecodedImage(QImage):
+    """
+    8bit RGB image decoded once and shared by the canvas and the models.
+    The QImage is a view over the pixels of the NumPy array `array`, which
+    is read-only so that writing to it raises instead of changing the
+    displayed image. Copy it before modifying it.
+    """
+
+    def __init__(self, array):
+        array = np.ascontiguousarray(array)
+        height, width = array.shape[:2]
+        super().__init__(
+            array.data, width, height, array.strides[0], QImage.Format_RGB888
+        )
+        array.flags.writeable = False
+        # Keep the buffer alive as long as the image
+        self.array = array
+
+    @classmethod
+    def from_file(cls, filename):
+        """
+        Decode an image file. Returns None if the file cannot be decoded.
+        """
+        try:
+            data = np.fromfile(filename, dtype=np.uint8)
+        except OSError:
+            return None
+        cv_image = decode_rgb_cv_img(data)
+        if cv_image is not None:
+            orientation = None
+            try:
+                with PIL.Image.open(filename) as image_pil:
+                    orientation = get_exif_orientation(image_pil)
+            except Exception:  # noqa
+                pass
+            return cls(apply_exif_orientation(cv_image, orientation))
+
+        # Formats not supported by OpenCV
+        reader = QImageReader(filename)
+        reader.setAutoTransform(True)
+        return cls.from_qt_img(reader.read())
+
+    @classmethod
+    def from_data(cls, data):
+        """
+        Decode image data. Returns None if the data cannot be decoded.
+        """
+        cv_image = decode_rgb_cv_img(np.frombuffer(data, dtype=np.uint8))
+        if cv_image is not None:
+            return cls(cv_image)
+        return cls.from_qt_img(QImage.fromData(data))
+
+    @classmethod
+    def from_qt_img(cls, qt_img):
+        """
+        Convert a QImage. Returns None for null images.
+        """
+        if qt_img.isNull():
+            return None
+        qt_img = qt_img.convertToFormat(QImage.Format_RGB32)
+        return cls(qimage2ndarray.rgb_view(qt_img).copy())
+
+
+def decode_rgb_cv_img(data):
+    """
+    Decode image data to 8bit RGB image, without applying EXIF orientation
+    """
+    cv_image = cv2.imdecode(data, cv2.IMREAD_UNCHANGED)
+    if cv_image is None:
+        return None
+    # To uint8
+    if cv_image.dtype != np.uint8:
+        cv2.normalize(cv_image, cv_image, 0, 255, cv2.NORM_MINMAX)
+        cv_image = np.array(cv_image, dtype=np.uint8)
+    # To RGB
+    if len(cv_image.shape) == 2 or cv_image.shape[2] == 1:
+        return cv2.cvtColor(cv_image, cv2.COLOR_GRAY2RGB)
+    if cv_image.shape[2] == 4:
+        return cv2.cvtColor(cv_image, cv2.COLOR_BGRA2RGB)
+    return cv2.cvtColor(cv_image, cv2.COLOR_BGR2RGB)
+
+
+def apply_exif_orientation(cv_image, orientation):
+    """
+    Apply EXIF orientation to an image array, same as
+    utils.apply_exif_orientation for PIL images
+    """
+    if orientation == 2:
+        # left-to-right mirror
+        return cv2.flip(cv_image, 1)
+    if orientation == 3:
+        # rotate 180
+        return cv2.rotate(cv_image, cv2.ROTATE_180)
+    if orientation == 4:
+        # top-to-bottom mirror
+        return cv2.flip(cv_image, 0)
+    if orientation == 5:
+        # top-to-left mirror
+        return cv2.flip(cv2.rotate(cv_image, cv2.ROTATE_90_CLOCKWISE), 1)
+    if orientation == 6:
+        # rotate 270
+        return cv2.rotate(cv_image, cv2.ROTATE_90_CLOCKWISE)
+    if orientation == 7:
+        # top-to-right mirror
+        return cv2.flip(
+            cv2.rotate(cv_image, cv2.ROTATE_90_COUNTERCLOCKWISE), 1
+        )
+    if orientation == 8:
+        # rotate 90
+        return cv2.rotate(cv_image, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return cv_image
 
 
 def qt_img_to_rgb_cv_img(qt_img, img_path=None):
     """
     Convert 8bit/16bit RGB image or 8bit/16bit Gray image to 8bit RGB image
     """
+    if isinstance(qt_img, DecodedImage):
+        # Already decoded, share the (read-only) pixels
+        return qt_img.array
     if img_path is not None and os.path.exists(img_path):
         # Load Image From Path Directly
-        cv_image = cv2.imdecode(np.fromfile(img_path, dtype=np.uint8), -1)
-        cv_image = cv2.cvtColor(cv_image, cv2.COLOR_BGR2RGB)
+        decoded_image = DecodedImage.from_file(img_path)
+        if decoded_image is not None:
+            return decoded_image.array
+    if (
+        qt_img.format() == QImage.Format_RGB32
+        or qt_img.format() == QImage.Format_ARGB32
+        or qt_img.format() == QImage.Format_ARGB32_Premultiplied
+    ):
+        cv_image = qimage2ndarray.rgb_view(qt_img)
     else:
-        if (
-            qt_img.format() == QImage.Format_RGB32
-            or qt_img.format() == QImage.Format_ARGB32
-            or qt_img.format() == QImage.Format_ARGB32_Premultiplied
-        ):
-            cv_image = qimage2ndarray.rgb_view(qt_img)
-        else:
-            cv_image = qimage2ndarray.raw_view(qt_img)
+        cv_image = qimage2ndarray.raw_view(qt_img)
     # To uint8
     if cv_image.dtype != np.uint8:
         cv2.normalize(cv_image, cv_image, 0, 255, cv2.NORM_MINMAX)
@@ -5,6 +5,7 @@ from .brightness_contrast_dialog import BrightnessContrastDialog
 from .canvas import Canvas
 from .color_dialog import ColorDialog
 from .file_dialog_preview import FileDialogPreview
+from .file_list_widget import FileListWidget
 from .label_dialog import LabelDialog, LabelQLineEdit
 from .label_list_widget import LabelListWidget, LabelListWidgetItem
 from .toolbar import ToolBar
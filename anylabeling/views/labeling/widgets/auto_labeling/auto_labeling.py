@@ -2,8 +2,9 @@ import os
 
 from PyQt5 import uic
 from PyQt5.QtCore import pyqtSignal, pyqtSlot
-from PyQt5.QtWidgets import QWidget, QFileDialog
+from PyQt5.QtWidgets import QWidget, QFileDialog, QMenu
 
+from anylabeling.config import get_config
 from anylabeling.services.auto_labeling.model_manager import ModelManager
 from anylabeling.services.auto_labeling.types import AutoLabelingMode
 
@@ -28,6 +29,12 @@ class AutoLabelingWidget(QWidget):
             lambda model_list: self.update_model_configs(model_list)
         )
         self.model_manager.new_model_status.connect(self.on_new_model_status)
+        self.model_manager.new_timing_breakdown.connect(
+            self.on_new_timing_breakdown
+        )
+        self.model_manager.new_embedding_cache_stats.connect(
+            self.on_new_embedding_cache_stats
+        )
         self.new_model_selected.connect(self.model_manager.load_model)
         self.new_custom_model_selected.connect(
             self.model_manager.load_custom_model
@@ -85,6 +92,17 @@ class AutoLabelingWidget(QWidget):
         # Hide labeling widgets by default
         self.hide_labeling_widgets()
 
+        # Timing of the last prediction
+        self.show_timing = (
+            get_config()
+            .get("auto_labeling_metrics", {})
+            .get("show_timing", False)
+        )
+        self.model_timing_label.setVisible(self.show_timing)
+        self.model_timing_label.customContextMenuRequested.connect(
+            self.show_timing_menu
+        )
+
         # Handle close button
         self.button_close.clicked.connect(self.unload_and_hide)
 
@@ -177,6 +195,63 @@ class AutoLabelingWidget(QWidget):
     def on_new_model_status(self, status):
         self.model_status_label.setText(status)
 
+    def on_new_timing_breakdown(self, breakdown):
+        """Show the time spent in each stage of the last prediction"""
+        if not self.show_timing:
+            return
+        stages = sorted(
+            breakdown["stages"].items(), key=lambda item: -item[1]
+        )
+        # Stages below 1 ms are not worth the space
+        stages = [
+            f"{name} {duration:.0f} ms"
+            for name, duration in stages
+            if duration >= 1 and name != "predict_shapes"
+        ]
+        text = self.tr("Total %.0f ms") % breakdown["total_ms"]
+        if not breakdown["stages"]:
+            text += self.tr(" (cached)")
+        elif stages:
+            text += ": " + ", ".join(stages)
+        self.model_timing_label.setText(text)
+
+    def on_new_embedding_cache_stats(self, stats):
+        """Show the usage of the embedding cache in the status bar"""
+        self.parent.status(
+            self.tr(
+                "Embedding cache: {items} images ({size:.0f} MB), "
+                "{hits} hits, {misses} misses, {evictions} evictions"
+            ).format(
+                items=stats["items"],
+                size=stats["nbytes"] / (1024 * 1024),
+                hits=stats["hits"],
+                misses=stats["misses"],
+                evictions=stats["evictions"],
+            )
+        )
+
+    def show_timing_menu(self, pos):
+        """Context menu of the timing label"""
+        menu = QMenu(self)
+        export_action = menu.addAction(self.tr("Export Chrome trace..."))
+        action = menu.exec_(self.model_timing_label.mapToGlobal(pos))
+        if action is not export_action:
+            return
+        filename, _ = QFileDialog.getSaveFileName(
+            self,
+            self.tr("Export Chrome trace"),
+            "anylabeling_trace.json",
+            self.tr("Chrome trace (*.json)"),
+        )
+        if not filename:
+            return
+        try:
+            self.model_manager.export_trace(filename)
+        except OSError as e:
+            self.model_status_label.setText(
+                self.tr("Could not export trace: %s") % e
+            )
+
     def on_new_model_loaded(self, model_config):
         """Enable model select combobox"""
         self.model_select_combobox.currentIndexChanged.disconnect()
@@ -8,6 +8,8 @@ from anylabeling.services.auto_labeling.types import AutoLabelingMode
 
 from .. import utils
 from ..shape import Shape
+from ..shape_index import ShapeIndex
+from ..tile_pyramid import TilePyramid
 
 CURSOR_DEFAULT = QtCore.Qt.ArrowCursor
 CURSOR_POINT = QtCore.Qt.PointingHandCursor
@@ -49,6 +51,7 @@ class Canvas(
                 f"Unexpected value for double_click event: {self.double_click}"
             )
         self.num_backups = kwargs.pop("num_backups", 10)
+        self.tiled_rendering = kwargs.pop("tiled_rendering", None) or {}
         self.parent = kwargs.pop("parent")
         super().__init__(*args, **kwargs)
         # Initialise local state.
@@ -56,6 +59,8 @@ class Canvas(
         self.is_auto_labeling = False
         self.auto_labeling_mode: AutoLabelingMode = None
         self.shapes = []
+        # Grid index of the shapes, for hit-testing
+        self.shape_index = ShapeIndex()
         self.shapes_backups = []
         self.current = None
         self.selected_shapes = []  # save the selected shapes here
@@ -70,7 +75,9 @@ class Canvas(
         self.prev_move_point = QtCore.QPoint()
         self.offsets = QtCore.QPointF(), QtCore.QPointF()
         self.scale = 1.0
+        # QPixmap of the image, or its QImage when drawn by tiles
         self.pixmap = QtGui.QPixmap()
+        self.tiles = None
         self.visible = {}
         self._hide_backround = False
         self.hide_backround = False
@@ -243,7 +250,7 @@ class Canvas(
         """Unhighlight shape/vertex/edge"""
         if self.h_hape:
             self.h_hape.highlight_clear()
-            self.update()
+            self.update_shapes(self.h_hape)
         self.prev_h_shape = self.h_hape
         self.prev_h_vertex = self.h_vertex
         self.prev_h_edge = self.h_edge
@@ -267,8 +274,9 @@ class Canvas(
         except AttributeError:
             return
 
+        self.update_cross_line(self.prev_move_point)
         self.prev_move_point = pos
-        self.repaint()
+        self.update_cross_line(pos)
         self.restore_cursor()
 
         # Polygon drawing.
@@ -279,6 +287,7 @@ class Canvas(
             if not self.current:
                 return
 
+            update_rect = self.get_shapes_rect([self.current, self.line])
             if self.out_off_pixmap(pos):
                 # Don't allow the user to draw outside the pixmap.
                 # Project the point to the pixmap's edges.
@@ -309,7 +318,11 @@ class Canvas(
             elif self.create_mode == "point":
                 self.line.points = [self.current[0]]
                 self.line.close()
-            self.repaint()
+            self.repaint(
+                update_rect.united(
+                    self.get_shapes_rect([self.current, self.line])
+                )
+            )
             self.current.highlight_clear()
             return
 
@@ -317,25 +330,28 @@ class Canvas(
         if QtCore.Qt.RightButton & ev.buttons():
             if self.selected_shapes_copy and self.prev_point:
                 self.override_cursor(CURSOR_MOVE)
+                self.update_shapes(*self.selected_shapes_copy)
                 self.bounded_move_shapes(self.selected_shapes_copy, pos)
-                self.repaint()
+                self.update_shapes(*self.selected_shapes_copy)
             elif self.selected_shapes:
                 self.selected_shapes_copy = [
                     s.copy() for s in self.selected_shapes
                 ]
-                self.repaint()
+                self.update_shapes(*self.selected_shapes_copy)
             return
 
         # Polygon/Vertex moving.
         if QtCore.Qt.LeftButton & ev.buttons():
             if self.selected_vertex():
+                self.update_shapes(self.h_hape)
                 self.bounded_move_vertex(pos)
-                self.repaint()
+                self.update_shapes(self.h_hape)
                 self.moving_shape = True
             elif self.selected_shapes and self.prev_point:
                 self.override_cursor(CURSOR_MOVE)
+                self.update_shapes(*self.selected_shapes)
                 self.bounded_move_shapes(self.selected_shapes, pos)
-                self.repaint()
+                self.update_shapes(*self.selected_shapes)
                 self.moving_shape = True
             return
 
@@ -344,7 +360,8 @@ class Canvas(
         # - Highlight vertex
         # Update shape/vertex fill and tooltip value accordingly.
         self.setToolTip(self.tr("Image"))
-        for shape in reversed([s for s in self.shapes if self.is_visible(s)]):
+        prev_h_shape = self.h_hape
+        for shape in self.shapes_at(pos, self.epsilon / self.scale):
             # Look for a nearby vertex to highlight. If that fails,
             # check if we happen to be inside a shape.
             index = shape.nearest_vertex(pos, self.epsilon / self.scale)
@@ -360,7 +377,6 @@ class Canvas(
                 self.override_cursor(CURSOR_POINT)
                 self.setToolTip(self.tr("Click & drag to move point"))
                 self.setStatusTip(self.toolTip())
-                self.update()
                 break
             if index_edge is not None and shape.can_add_point():
                 if self.selected_vertex():
@@ -372,7 +388,6 @@ class Canvas(
                 self.override_cursor(CURSOR_POINT)
                 self.setToolTip(self.tr("Click to create point"))
                 self.setStatusTip(self.toolTip())
-                self.update()
                 break
             if shape.contains_point(pos):
                 if self.selected_vertex():
@@ -387,10 +402,10 @@ class Canvas(
                 )
                 self.setStatusTip(self.toolTip())
                 self.override_cursor(CURSOR_GRAB)
-                self.update()
                 break
         else:  # Nothing found, clear highlights, reset state.
             self.un_highlight()
+        self.update_shapes(prev_h_shape, self.h_hape)
         self.vertex_selected.emit(self.h_vertex is not None)
 
     def add_point_to_edge(self):
@@ -570,6 +585,73 @@ class Canvas(
             self.current.pop_point()
             self.finalise()
 
+    def get_shapes_rect(self, shapes):
+        """Area of the widget where shapes are drawn. The whole widget
+        if the shapes have texts or groups drawn around them."""
+        left = top = float("inf")
+        right = bottom = float("-inf")
+        for shape in shapes:
+            if shape is None or not shape.points:
+                continue
+            if (self.show_texts and shape.text) or (
+                self.show_shape_groups and shape.group_id is not None
+            ):
+                return self.rect()
+            rect = shape.bounding_rect()
+            left = min(left, rect.left())
+            top = min(top, rect.top())
+            right = max(right, rect.right())
+            bottom = max(bottom, rect.bottom())
+        if left > right:
+            return QtCore.QRect()
+        offset = self.offset_to_center()
+        margin = self.get_paint_margin()
+        return QtCore.QRectF(
+            QtCore.QPointF(
+                (left + offset.x()) * self.scale - margin,
+                (top + offset.y()) * self.scale - margin,
+            ),
+            QtCore.QPointF(
+                (right + offset.x()) * self.scale + margin,
+                (bottom + offset.y()) * self.scale + margin,
+            ),
+        ).toAlignedRect()
+
+    def get_paint_margin(self):
+        """Margin (in widget pixels) around the bounding box of shapes
+        repainted with them, for vertices and lines drawn outside of it,
+        plus one pixel for antialiasing"""
+        return Shape.get_paint_margin(self.scale) + 1
+
+    def update_shapes(self, *shapes):
+        """Schedule a repaint of the area of shapes only. Must be called
+        before and after changing the shapes."""
+        rect = self.get_shapes_rect(shapes)
+        if not rect.isEmpty():
+            self.update(rect)
+
+    def update_cross_line(self, point):
+        """Schedule a repaint of the cross line at a point"""
+        if not self.show_cross_line or self.pixmap is None:
+            return
+        offset = self.offset_to_center()
+        x = int((point.x() + offset.x()) * self.scale)
+        y = int((point.y() + offset.y()) * self.scale)
+        # Pen width of the cross line, in pixels
+        margin = int(max(1, round(2.0 / self.scale)) * self.scale) + 2
+        self.update(x - margin, 0, 2 * margin, self.height())
+        self.update(0, y - margin, self.width(), 2 * margin)
+
+    def shapes_at(self, point, margin=0.0):
+        """Visible shapes whose bounding box is within margin of a point,
+        from the topmost one"""
+        self.shape_index.sync(self.shapes)
+        return [
+            shape
+            for shape in self.shape_index.query(point, margin)
+            if self.is_visible(shape)
+        ]
+
     def select_shapes(self, shapes):
         """Select some shapes"""
         self.set_hiding()
@@ -582,8 +664,8 @@ class Canvas(
             index, shape = self.h_vertex, self.h_hape
             shape.highlight_vertex(index, shape.MOVE_VERTEX)
         else:
-            for shape in reversed(self.shapes):
-                if self.is_visible(shape) and shape.contains_point(point):
+            for shape in self.shapes_at(point):
+                if shape.contains_point(point):
                     self.set_hiding()
                     if shape not in self.selected_shapes:
                         if multiple_selection_mode:
@@ -728,7 +810,14 @@ class Canvas(
         p.scale(self.scale, self.scale)
         p.translate(self.offset_to_center())
 
-        p.drawPixmap(0, 0, self.pixmap)
+        # Area to repaint in image coordinates
+        paint_rect = p.transform().inverted()[0].mapRect(
+            QtCore.QRectF(event.rect())
+        )
+        if self.tiles is not None:
+            self.tiles.paint(p, paint_rect, self.scale)
+        else:
+            p.drawPixmap(0, 0, self.pixmap)
         Shape.scale = self.scale
 
         # Draw loading/waiting screen
@@ -814,7 +903,14 @@ class Canvas(
                 )
                 p.drawRect(wrap_rect)
 
-        for shape in self.shapes:
+        margin = self.get_paint_margin() / self.scale
+        self.shape_index.sync(self.shapes)
+        for shape in self.shape_index.query_rect(
+            paint_rect.left() - margin,
+            paint_rect.top() - margin,
+            paint_rect.right() + margin,
+            paint_rect.bottom() + margin,
+        ):
             if (
                 shape.selected or not self._hide_backround
             ) and self.is_visible(shape):
@@ -1189,13 +1285,39 @@ class Canvas(
             self.drawing_polygon.emit(False)
         self.update()
 
+    def load_image(self, image, clear_shapes=True):
+        """Load a QImage. Images larger than the min_image_size of tiled
+        rendering are drawn from a tile pyramid instead of a full
+        resolution pixmap"""
+        min_image_size = self.tiled_rendering.get("min_image_size", 8192)
+        if not min_image_size or (
+            max(image.width(), image.height()) <= min_image_size
+        ):
+            self.load_pixmap(QtGui.QPixmap.fromImage(image), clear_shapes)
+            return
+        self.load_pixmap(image, clear_shapes)
+        self.tiles = TilePyramid(
+            image,
+            tile_size=self.tiled_rendering.get("tile_size", 512),
+            max_cache_mb=self.tiled_rendering.get("max_cache_mb", 256),
+        )
+        self.tiles.level_ready.connect(self.update)
+
     def load_pixmap(self, pixmap, clear_shapes=True):
         """Load pixmap"""
+        self.stop_tiles()
         self.pixmap = pixmap
         if clear_shapes:
             self.shapes = []
         self.update()
 
+    def stop_tiles(self):
+        """Stop drawing the image by tiles"""
+        if self.tiles is not None:
+            self.tiles.level_ready.disconnect(self.update)
+            self.tiles.stop()
+            self.tiles = None
+
     def load_shapes(self, shapes, replace=True):
         """Load shapes"""
         if replace:
@@ -1227,6 +1349,7 @@ class Canvas(
     def reset_state(self):
         """Clear shapes and pixmap"""
         self.restore_cursor()
+        self.stop_tiles()
         self.pixmap = None
         self.shapes_backups = []
         self.update()
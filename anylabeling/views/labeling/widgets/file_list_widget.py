@@ -0,0 +1,168 @@
+"""This module defines the file list widget for large image folders"""
+
+import os.path as osp
+
+from PyQt5 import QtCore, QtWidgets
+from PyQt5.QtCore import Qt
+
+
+class FileListModel(QtCore.QAbstractListModel):
+    """List model of image files.
+
+    Files are kept in a list with a file -> row dict for fast lookups.
+    The labeled state of a file is only checked when it is displayed.
+    """
+
+    def __init__(self, get_label_file=None, parent=None):
+        super().__init__(parent)
+        self.get_label_file = get_label_file
+        self._files = []
+        self._rows = {}
+        self._checked = {}
+
+    # QT Overload
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._files)
+
+    # QT Overload
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self._files):
+            return None
+        filename = self._files[index.row()]
+        if role == Qt.DisplayRole:
+            return filename
+        if role == Qt.CheckStateRole:
+            return Qt.Checked if self.is_checked(filename) else Qt.Unchecked
+        return None
+
+    # QT Overload
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    @property
+    def files(self):
+        """All files. The list must not be modified."""
+        return self._files
+
+    def file(self, row):
+        return self._files[row]
+
+    def row(self, filename):
+        """Row of a file, -1 if the file is not in the list"""
+        return self._rows.get(filename, -1)
+
+    def set_files(self, files):
+        self.beginResetModel()
+        self._files = []
+        self._rows = {}
+        self._checked = {}
+        self._append(files)
+        self.endResetModel()
+
+    def add_files(self, files):
+        files = [f for f in dict.fromkeys(files) if f not in self._rows]
+        if not files:
+            return
+        start = len(self._files)
+        self.beginInsertRows(
+            QtCore.QModelIndex(), start, start + len(files) - 1
+        )
+        self._append(files)
+        self.endInsertRows()
+
+    def _append(self, files):
+        for filename in files:
+            if filename not in self._rows:
+                self._rows[filename] = len(self._files)
+                self._files.append(filename)
+
+    def is_checked(self, filename):
+        """Whether the file has a label file"""
+        checked = self._checked.get(filename)
+        if checked is None:
+            checked = self.get_label_file is not None and osp.exists(
+                self.get_label_file(filename)
+            )
+            self._checked[filename] = checked
+        return checked
+
+    def set_checked(self, filename, checked):
+        row = self.row(filename)
+        if row < 0:
+            return
+        self._checked[filename] = checked
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.CheckStateRole])
+
+
+class FileListWidget(QtWidgets.QListView):
+    """View of a FileListModel with a QListWidget-like interface"""
+
+    itemSelectionChanged = QtCore.pyqtSignal()
+
+    def __init__(self, get_label_file=None, parent=None):
+        super().__init__(parent)
+        self.file_model = FileListModel(get_label_file, self)
+        self.setModel(self.file_model)
+        self.setSelectionMode(QtWidgets.QAbstractItemView.SingleSelection)
+        # Only lay out the visible items
+        self.setUniformItemSizes(True)
+        self.setLayoutMode(QtWidgets.QListView.Batched)
+        self.selectionModel().selectionChanged.connect(
+            lambda *_: self.itemSelectionChanged.emit()
+        )
+
+    def __contains__(self, filename):
+        return self.file_model.row(filename) >= 0
+
+    @property
+    def files(self):
+        return self.file_model.files
+
+    def count(self):
+        return self.file_model.rowCount()
+
+    def currentRow(self):
+        index = self.currentIndex()
+        return index.row() if index.isValid() else -1
+
+    def setCurrentRow(self, row):
+        self.setCurrentIndex(self.file_model.index(row))
+
+    def clear(self):
+        self.file_model.set_files([])
+
+    def row(self, filename):
+        return self.file_model.row(filename)
+
+    def selected_file(self):
+        """Selected file, None if no file is selected"""
+        indexes = self.selectionModel().selectedIndexes()
+        if not indexes:
+            return None
+        return self.file_model.file(indexes[0].row())
+
+    def set_files(self, files):
+        self.file_model.set_files(files)
+
+    def replace_files(self, files):
+        """Replace the files, keeping the current file selected"""
+        if files == self.files:
+            return
+        current_file = self.selected_file()
+        # Reselecting the current file must not load it again
+        self.blockSignals(True)
+        self.file_model.set_files(files)
+        if current_file in self:
+            self.setCurrentRow(self.row(current_file))
+        self.blockSignals(False)
+
+    def add_files(self, files):
+        self.file_model.add_files(files)
+
+    def set_checked(self, filename, checked):
+        self.file_model.set_checked(filename, checked)
@@ -0,0 +1,80 @@
+"""Compare two benchmark results of run_benchmarks.py.
+
+Usage:
+
+    python benchmarks/compare.py before.json after.json
+"""
+
+import argparse
+import json
+
+
+def load_results(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def format_change(before, after):
+    if not before:
+        return "n/a"
+    return f"{(after - before) / before * 100:+.1f}%"
+
+
+def compare(before, after, metric="p50_ms", threshold=0.0):
+    """Yield table rows (model, stage, before, after, change)"""
+    for name, after_result in after["models"].items():
+        before_result = before["models"].get(name)
+        if before_result is None or "error" in before_result:
+            continue
+        if "error" in after_result:
+            yield name, "error", "", "", after_result["error"]
+            continue
+        for stage, after_stats in after_result["stages"].items():
+            before_stats = before_result["stages"].get(stage)
+            if not before_stats or not after_stats:
+                continue
+            b, a = before_stats[metric], after_stats[metric]
+            if b and abs(a - b) / b < threshold:
+                continue
+            yield name, stage, f"{b:.2f}", f"{a:.2f}", format_change(b, a)
+        for key in ("throughput_images_per_s", "peak_rss_mb"):
+            b, a = before_result[key], after_result[key]
+            yield name, key, f"{b:.1f}", f"{a:.1f}", format_change(b, a)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare two results of run_benchmarks.py"
+    )
+    parser.add_argument("before", help="results of the baseline")
+    parser.add_argument("after", help="results to compare")
+    parser.add_argument(
+        "--metric",
+        default="p50_ms",
+        choices=["p50_ms", "p95_ms", "mean_ms"],
+        help="stage timing to compare (default: p50_ms)",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.0,
+        help="only show stages which changed by more than this ratio",
+    )
+    args = parser.parse_args()
+
+    before = load_results(args.before)
+    after = load_results(args.after)
+    print(f"before: {before.get('git_commit')} ({before.get('created')})")
+    print(f"after:  {after.get('git_commit')} ({after.get('created')})")
+    header = ("model", "stage", "before", "after", "change")
+    rows = list(compare(before, after, args.metric, args.threshold))
+    widths = [
+        max(len(str(row[i])) for row in [header] + rows)
+        for i in range(len(header))
+    ]
+    for row in [header] + rows:
+        print("  ".join(str(v).ljust(w) for v, w in zip(row, widths)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Per-stage timing of the auto labeling models.
+
+The stages of a prediction are measured by wrapping the functions and
+methods of a model instance. Stages may be nested (e.g. ``pre_process``
+runs the network in some models), so each stage only gets the time spent
+in itself, not in the nested stages.
+"""
+
+import functools
+import sys
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+
+STAGES = (
+    "decode",
+    "pre_process",
+    "inference",
+    "post_process",
+    "nms",
+    "shapes",
+    "other",
+    "total",
+)
+
+# Method names of the model classes, by stage
+PRE_PROCESS_METHODS = (
+    "pre_process",
+    "prepare_input",
+    "preprocess",
+    "det_pre_process",
+    "cls_pre_process",
+    "yolo_pre_process",
+    "get_infer_results",
+)
+POST_PROCESS_METHODS = (
+    "post_process",
+    "postprocess",
+    "det_post_process",
+    "cls_post_process",
+    "yolo_post_process",
+    "rescale",
+)
+SHAPES_METHODS = ("build_shapes",)
+NMS_FUNCTIONS = ("non_max_suppression", "batched_nms", "numpy_nms")
+
+
+class StageTimer:
+    """Accumulate the exclusive time spent in wrapped functions by stage.
+
+    Only calls from the thread which created the timer are measured, so
+    background threads of the models do not skew the results.
+    """
+
+    def __init__(self):
+        self.thread_id = threading.get_ident()
+        self.times = defaultdict(float)
+        self._stack = []
+        self._patches = []
+
+    def wrap(self, func, stage):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if threading.get_ident() != self.thread_id:
+                return func(*args, **kwargs)
+            frame = [0.0]  # time spent in nested stages
+            self._stack.append(frame)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                self._stack.pop()
+                self.times[stage] += elapsed - frame[0]
+                if self._stack:
+                    self._stack[-1][0] += elapsed
+
+        return wrapper
+
+    def patch(self, owner, name, stage):
+        """Replace owner.name with a timed version"""
+        func = getattr(owner, name, None)
+        if not callable(func):
+            return
+        self._patches.append((owner, name, owner.__dict__.get(name)))
+        setattr(owner, name, self.wrap(func, stage))
+
+    def reset(self):
+        self.times = defaultdict(float)
+
+    def restore(self):
+        """Remove all patches"""
+        for owner, name, value in reversed(self._patches):
+            if value is None:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, value)
+        self._patches = []
+
+
+def instrument_model(model, timer):
+    """Wrap the stages of a model instance and the shared functions"""
+    import onnxruntime as ort
+
+    from anylabeling.services.auto_labeling import model as model_module
+    from anylabeling.services.auto_labeling import ops
+    from anylabeling.views.labeling.shape import Shape
+
+    for name in PRE_PROCESS_METHODS:
+        timer.patch(model, name, "pre_process")
+    for name in POST_PROCESS_METHODS:
+        timer.patch(model, name, "post_process")
+    for name in SHAPES_METHODS:
+        timer.patch(model, name, "shapes")
+    for name in NMS_FUNCTIONS:
+        timer.patch(ops, name, "nms")
+    for module in (sys.modules[type(model).__module__], model_module):
+        timer.patch(module, "qt_img_to_rgb_cv_img", "decode")
+    timer.patch(ort.InferenceSession, "run", "inference")
+    timer.patch(Shape, "__init__", "shapes")
+    timer.patch(Shape, "add_point", "shapes")
+
+
+def summarize(samples):
+    """p50, p95 and mean in milliseconds of a list of durations in seconds"""
+    values = np.asarray(samples, dtype=np.float64) * 1000
+    if not len(values):
+        return None
+    return {
+        "p50_ms": round(float(np.percentile(values, 50)), 3),
+        "p95_ms": round(float(np.percentile(values, 95)), 3),
+        "mean_ms": round(float(values.mean()), 3),
+    }
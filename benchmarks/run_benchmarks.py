@@ -0,0 +1,347 @@
+"""Benchmark the inference of the auto labeling models.
+
+Every model runs in its own process, on a fixed set of images, and the
+time of each stage of a prediction is reported as JSON, so that the
+results of two commits can be compared with compare.py.
+
+Usage (from the repository root):
+
+    python benchmarks/run_benchmarks.py -o results.json
+    python benchmarks/run_benchmarks.py --models yolov5 yolov8
+    python benchmarks/run_benchmarks.py --config path/to/model.yaml \\
+        --images path/to/images
+
+Without --config, tiny synthetic ONNX models are generated for the
+model types in synthetic_models.py, so no network access is needed.
+"""
+
+import os
+import sys
+
+# Make anylabeling and the benchmark modules importable, also in the
+# spawned worker processes
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+import argparse
+import datetime
+import json
+import logging
+import multiprocessing
+import os.path as osp
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+
+# Synthetic images: (name, width, height)
+IMAGE_SIZES = (
+    ("vga", 640, 480),
+    ("hd", 1280, 720),
+    ("full_hd", 1920, 1080),
+    ("12mp", 4000, 3000),
+)
+
+# Model types which need marks (prompts) from the user
+MARKS_MODEL_TYPES = ("segment_anything", "sam_med2d")
+
+
+def create_images(output_dir, seed=0):
+    """Write the fixed set of synthetic images, returns their paths"""
+    import cv2
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    image_files = []
+    for name, width, height in IMAGE_SIZES:
+        # Smooth background with noise and a few filled shapes, so that
+        # images compress and decode like photos rather than pure noise
+        xs = np.linspace(0, 255, width, dtype=np.float32)
+        ys = np.linspace(0, 255, height, dtype=np.float32)
+        image = np.stack(
+            [
+                np.add.outer(ys, xs) / 2,
+                np.add.outer(ys, xs[::-1]) / 2,
+                np.tile(xs, (height, 1)),
+            ],
+            axis=2,
+        )
+        image += rng.normal(0, 8, image.shape)
+        image = np.clip(image, 0, 255).astype(np.uint8)
+        for _ in range(20):
+            x1, x2 = sorted(rng.integers(0, width, 2))
+            y1, y2 = sorted(rng.integers(0, height, 2))
+            color = [int(c) for c in rng.integers(0, 256, 3)]
+            cv2.rectangle(image, (x1, y1), (x2, y2), color, -1)
+        image_file = osp.join(output_dir, f"{name}_{width}x{height}.jpg")
+        cv2.imwrite(image_file, image)
+        image_files.append(image_file)
+    return image_files
+
+
+def get_peak_rss_mb():
+    """Peak resident set size of the current process"""
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes on Linux
+    if sys.platform == "darwin":
+        return peak_rss / 1024 / 1024
+    return peak_rss / 1024
+
+
+def get_git_commit():
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"],
+                cwd=BENCHMARKS_DIR,
+                stderr=subprocess.DEVNULL,
+            )
+            .decode()
+            .strip()
+        )
+    except Exception:  # noqa
+        return None
+
+
+def get_environment():
+    import cv2
+    import numpy as np
+    import onnxruntime as ort
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "onnxruntime": ort.__version__,
+    }
+
+
+def run_model(model_config, image_files, repeat, warmup):
+    """Benchmark one model in the current process"""
+    from anylabeling.batch import create_model
+    from anylabeling.services.auto_labeling.model import Model
+    from profiler import STAGES, StageTimer, instrument_model, summarize
+
+    # Do not read or fill the on-disk embedding cache of SAM-like models
+    model_config = dict(model_config, embedding_cache_size=0)
+    start = time.perf_counter()
+    model = create_model(model_config, on_message=logging.debug)
+    load_time = time.perf_counter() - start
+
+    if model_config["type"] in MARKS_MODEL_TYPES:
+        image = Model.load_image_from_filename(image_files[0])
+        model.set_auto_labeling_marks(
+            [
+                {
+                    "type": "point",
+                    "data": [image.width() // 2, image.height() // 2],
+                    "label": 1,
+                }
+            ]
+        )
+
+    timer = StageTimer()
+    instrument_model(model, timer)
+    load_image = timer.wrap(Model.load_image_from_filename, "decode")
+    predict_shapes = timer.wrap(model.predict_shapes, "other")
+
+    samples = {stage: [] for stage in STAGES}
+    samples_by_image = {osp.basename(f): [] for f in image_files}
+    num_shapes = {}
+    for run in range(warmup + repeat):
+        for image_file in image_files:
+            timer.reset()
+            start = time.perf_counter()
+            image = load_image(image_file)
+            # A different file name for each run, so that models with an
+            # embedding cache encode the image every time
+            result = predict_shapes(image, f"{image_file}#{run}")
+            total = time.perf_counter() - start
+            if run < warmup:
+                continue
+            for stage in STAGES[:-1]:
+                samples[stage].append(timer.times.get(stage, 0.0))
+            samples["total"].append(total)
+            samples_by_image[osp.basename(image_file)].append(total)
+            shapes = getattr(result, "shapes", result) or []
+            num_shapes[osp.basename(image_file)] = len(shapes)
+    timer.restore()
+    model.unload()
+
+    num_runs = len(samples["total"])
+    return {
+        "type": model_config["type"],
+        "name": model_config.get("name"),
+        "load_time_ms": round(load_time * 1000, 3),
+        "num_runs": num_runs,
+        "throughput_images_per_s": round(
+            num_runs / max(sum(samples["total"]), 1e-9), 3
+        ),
+        "peak_rss_mb": round(get_peak_rss_mb(), 1),
+        "stages": {stage: summarize(samples[stage]) for stage in STAGES},
+        "images": {
+            name: {"total": summarize(values), "num_shapes": num_shapes[name]}
+            for name, values in samples_by_image.items()
+        },
+    }
+
+
+def _run_model_worker(model_config, image_files, repeat, warmup, threads):
+    """Entry point of the worker process of a model"""
+    if threads:
+        os.environ["OMP_NUM_THREADS"] = str(threads)
+    logging.basicConfig(level=logging.WARNING)
+    try:
+        return run_model(model_config, image_files, repeat, warmup)
+    except Exception as e:  # noqa
+        logging.exception("Benchmark of %s failed", model_config.get("name"))
+        return {
+            "type": model_config.get("type"),
+            "name": model_config.get("name"),
+            "error": str(e),
+        }
+
+
+def run_benchmarks(model_configs, image_files, repeat, warmup, threads):
+    """Benchmark each model in a new process, so that they do not share
+    memory, threads or caches"""
+    results = {}
+    # Spawn instead of fork: ONNXRuntime and Qt are not fork-safe
+    context = multiprocessing.get_context("spawn")
+    for key, model_config in model_configs:
+        logging.info("Benchmarking %s", key)
+        with context.Pool(1) as pool:
+            results[key] = pool.apply(
+                _run_model_worker,
+                (model_config, image_files, repeat, warmup, threads),
+            )
+        if "error" in results[key]:
+            logging.error("%s: %s", key, results[key]["error"])
+            continue
+        stages = results[key]["stages"]
+        logging.info(
+            "%s: %.1f images/s, total p50 %.1f ms, p95 %.1f ms",
+            key,
+            results[key]["throughput_images_per_s"],
+            stages["total"]["p50_ms"],
+            stages["total"]["p95_ms"],
+        )
+    return results
+
+
+def main():
+    from synthetic_models import (
+        SYNTHETIC_MODEL_CONFIGS,
+        create_synthetic_model_config,
+    )
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark the inference of auto labeling models"
+    )
+    parser.add_argument(
+        "--models",
+        nargs="+",
+        choices=sorted(SYNTHETIC_MODEL_CONFIGS),
+        help="synthetic models to benchmark (default: all)",
+    )
+    parser.add_argument(
+        "--config",
+        "-c",
+        action="append",
+        default=[],
+        help=(
+            "model config to benchmark instead of the synthetic models: "
+            "path to a yaml file or a built-in config, can be repeated"
+        ),
+    )
+    parser.add_argument(
+        "--images",
+        "-i",
+        default=None,
+        help="image directory (default: a fixed set of synthetic images)",
+    )
+    parser.add_argument(
+        "--repeat",
+        "-n",
+        type=int,
+        default=10,
+        help="number of timed runs over the images (default: 10)",
+    )
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        default=1,
+        help="number of untimed runs over the images (default: 1)",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=0,
+        help="number of ONNXRuntime threads (default: ONNXRuntime default)",
+    )
+    parser.add_argument(
+        "--output", "-o", default=None, help="output JSON file"
+    )
+    args = parser.parse_args()
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+    )
+
+    from anylabeling.batch import load_model_config, scan_all_images
+
+    with tempfile.TemporaryDirectory(prefix="anylabeling_bench_") as tmp_dir:
+        if args.images:
+            image_files = scan_all_images(args.images)
+            if not image_files:
+                logging.error("No images found in %s", args.images)
+                sys.exit(1)
+        else:
+            image_files = create_images(tmp_dir)
+
+        model_configs = []
+        for config in args.config:
+            model_config = load_model_config(config)
+            model_configs.append((model_config["name"], model_config))
+        if not args.config:
+            for model_type in args.models or sorted(SYNTHETIC_MODEL_CONFIGS):
+                model_config = create_synthetic_model_config(
+                    model_type, tmp_dir
+                )
+                model_configs.append((model_config["name"], model_config))
+
+        results = run_benchmarks(
+            model_configs, image_files, args.repeat, args.warmup, args.threads
+        )
+
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "git_commit": get_git_commit(),
+        "environment": get_environment(),
+        "settings": {
+            "repeat": args.repeat,
+            "warmup": args.warmup,
+            "threads": args.threads,
+            "images": [osp.basename(f) for f in image_files],
+        },
+        "models": results,
+    }
+    report = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(report + "\n")
+        logging.info("Results saved to %s", args.output)
+    else:
+        print(report)
+    sys.exit(1 if any("error" in r for r in results.values()) else 0)
+
+
+if __name__ == "__main__":
+    main()
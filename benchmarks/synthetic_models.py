@@ -0,0 +1,239 @@
+"""Tiny ONNX models with the inputs and outputs of the supported detectors.
+
+The models are a few strided convolutions with random weights, so their
+outputs have the right shapes and plausible value ranges, and exercise
+the pre-processing, post-processing and NMS of the real model classes
+without downloading any weights.
+"""
+
+import os.path as osp
+
+import numpy as np
+import onnx
+from onnx import TensorProto, helper, numpy_helper
+
+from anylabeling.batch import load_model_config
+
+OPSET_VERSION = 13
+# IR version of onnx 1.13, the newest one supported by onnxruntime 1.14
+IR_VERSION = 8
+
+# Model type -> built-in config used as template for the synthetic model
+SYNTHETIC_MODEL_CONFIGS = {
+    "yolov5": "yolov5s.yaml",
+    "yolov6": "yolov6s.yaml",
+    "yolov7": "yolov7.yaml",
+    "yolov8": "yolov8s.yaml",
+    "yolov8_seg": "yolov8s_seg.yaml",
+    "yolox": "yolox_s.yaml",
+    "yolo_nas": "yolo_nas_s.yaml",
+    "rtdetr": "rtdetr_r50.yaml",
+}
+
+
+class GraphBuilder:
+    """Minimal helper to build an ONNX graph node by node"""
+
+    def __init__(self, seed=0):
+        self.rng = np.random.default_rng(seed)
+        self.nodes = []
+        self.initializers = []
+        self._count = 0
+
+    def name(self, prefix):
+        self._count += 1
+        return f"{prefix}_{self._count}"
+
+    def constant(self, array, dtype=np.float32):
+        name = self.name("const")
+        self.initializers.append(
+            numpy_helper.from_array(np.asarray(array, dtype=dtype), name)
+        )
+        return name
+
+    def node(self, op_type, inputs, output=None, **attrs):
+        output = output or self.name(op_type.lower())
+        self.nodes.append(helper.make_node(op_type, inputs, [output], **attrs))
+        return output
+
+    def conv(self, x, in_channels, out_channels, stride, bias=None):
+        """Convolution with a stride x stride kernel and random weights"""
+        if bias is None:
+            bias = np.zeros(out_channels)
+        weight = self.rng.normal(
+            0.0, 1.5 / stride, (out_channels, in_channels, stride, stride)
+        )
+        return self.node(
+            "Conv",
+            [x, self.constant(weight), self.constant(bias)],
+            kernel_shape=[stride, stride],
+            strides=[stride, stride],
+        )
+
+    def head(self, x, channels, strides, bias, scale, offset, output=None):
+        """Multi-scale head, output shape [1, channels, num_anchors]"""
+        outputs = []
+        for stride in strides:
+            y = self.conv(x, 3, channels, stride, bias)
+            outputs.append(
+                self.node(
+                    "Reshape", [y, self.constant([1, channels, -1], np.int64)]
+                )
+            )
+        y = self.node("Concat", outputs, axis=2)
+        y = self.node("Sigmoid", [y])
+        y = self.node("Mul", [y, self.constant(np.reshape(scale, (-1, 1)))])
+        offset = self.constant(np.reshape(offset, (-1, 1)))
+        return self.node("Add", [y, offset], output)
+
+    def make_model(self, inputs, outputs):
+        """Inputs and outputs are lists of (name, shape)"""
+        graph = helper.make_graph(
+            self.nodes,
+            "synthetic",
+            [
+                helper.make_tensor_value_info(name, TensorProto.FLOAT, shape)
+                for name, shape in inputs
+            ],
+            [
+                helper.make_tensor_value_info(name, TensorProto.FLOAT, shape)
+                for name, shape in outputs
+            ],
+            initializer=self.initializers,
+        )
+        model = helper.make_model(
+            graph,
+            opset_imports=[helper.make_opsetid("", OPSET_VERSION)],
+            ir_version=IR_VERSION,
+        )
+        onnx.checker.check_model(model, full_check=True)
+        return model
+
+
+def build_model(model_type, model_config, seed=0):
+    """Build the synthetic ONNX model of a model type"""
+    height = model_config["input_height"]
+    width = model_config["input_width"]
+    num_classes = len(model_config["classes"])
+    input_name = "image" if model_type == "rtdetr" else "images"
+    b = GraphBuilder(seed)
+    x = input_name
+    strides = (8, 16, 32)
+    # Boxes are (cx, cy, w, h) in input pixels unless noted otherwise
+    box_scale = [width, height, width / 4, height / 4]
+    # Keep class scores low, so that only a part of the anchors are
+    # candidates as with a real model
+    class_bias = [-3.0] * num_classes
+
+    def num_anchors(strides):
+        return sum((height // s) * (width // s) for s in strides)
+
+    if model_type in ("yolov5", "yolov6", "yolov7", "yolox"):
+        if model_type == "yolox":
+            # Offsets in grid cells and log sizes in strides
+            box_scale = [1, 1, 3, 3]
+            if model_config.get("p6"):
+                strides = (8, 16, 32, 64)
+        channels = 5 + num_classes
+        y = b.head(
+            x,
+            channels,
+            strides,
+            bias=[0.0] * 5 + class_bias,
+            scale=box_scale + [1] * (1 + num_classes),
+            offset=[0] * channels,
+        )
+        b.node("Transpose", [y], "output", perm=[0, 2, 1])
+        outputs = [("output", [1, num_anchors(strides), channels])]
+    elif model_type == "yolov8":
+        channels = 4 + num_classes
+        b.head(
+            x,
+            channels,
+            strides,
+            bias=[0.0] * 4 + class_bias,
+            scale=box_scale + [1] * num_classes,
+            offset=[0] * channels,
+            output="output0",
+        )
+        outputs = [("output0", [1, channels, num_anchors(strides)])]
+    elif model_type == "yolov8_seg":
+        num_masks = model_config["num_masks"]
+        channels = 4 + num_classes + num_masks
+        # Positive mask coefficients and prototypes, so that the mask of
+        # a detection covers its box and a polygon is always found
+        b.head(
+            x,
+            channels,
+            strides,
+            bias=[0.0] * 4 + class_bias + [0.0] * num_masks,
+            scale=box_scale + [1] * num_classes + [2] * num_masks,
+            offset=[0] * channels,
+            output="output0",
+        )
+        b.node("Sigmoid", [b.conv(x, 3, num_masks, 4)], "output1")
+        outputs = [
+            ("output0", [1, channels, num_anchors(strides)]),
+            ("output1", [1, num_masks, height // 4, width // 4]),
+        ]
+    elif model_type == "yolo_nas":
+        # Boxes are (x1, y1, x2, y2) in input pixels
+        channels = 4 + num_classes
+        y = b.head(
+            x,
+            channels,
+            strides,
+            bias=[0.0] * 4 + class_bias,
+            scale=[width * 3 / 4, height * 3 / 4]
+            + box_scale[2:]
+            + [1] * num_classes,
+            offset=[0] * channels,
+        )
+        y = b.node("Transpose", [y], perm=[0, 2, 1])
+        xywh = b.name("xywh")
+        b.nodes.append(
+            helper.make_node(
+                "Split",
+                [y, b.constant([4, num_classes], np.int64)],
+                [xywh, "scores"],
+                axis=2,
+            )
+        )
+        to_xyxy = [[1, 0, 1, 0], [0, 1, 0, 1], [0, 0, 1, 0], [0, 0, 0, 1]]
+        b.node("MatMul", [xywh, b.constant(to_xyxy)], "boxes")
+        outputs = [
+            ("boxes", [1, num_anchors(strides), 4]),
+            ("scores", [1, num_anchors(strides), num_classes]),
+        ]
+    elif model_type == "rtdetr":
+        # One box per query, normalized (cx, cy, w, h)
+        channels = 4 + num_classes
+        y = b.head(
+            x,
+            channels,
+            (32,),
+            bias=[0.0] * 4 + class_bias,
+            scale=[1, 1, 0.25, 0.25] + [1] * num_classes,
+            offset=[0] * channels,
+        )
+        b.node("Transpose", [y], "output", perm=[0, 2, 1])
+        outputs = [("output", [1, num_anchors((32,)), channels])]
+    else:
+        raise ValueError(f"No synthetic model for model type: {model_type}")
+
+    return b.make_model([(input_name, [1, 3, height, width])], outputs)
+
+
+def create_synthetic_model_config(model_type, output_dir, seed=0):
+    """Save the synthetic model of a model type and return its config"""
+    if model_type not in SYNTHETIC_MODEL_CONFIGS:
+        raise ValueError(f"No synthetic model for model type: {model_type}")
+    model_config = load_model_config(SYNTHETIC_MODEL_CONFIGS[model_type])
+    model_path = osp.join(output_dir, f"synthetic_{model_type}.onnx")
+    onnx.save(build_model(model_type, model_config, seed), model_path)
+    model_config["name"] = f"synthetic_{model_type}"
+    model_config["model_path"] = model_path
+    model_config["config_file"] = osp.join(
+        output_dir, f"synthetic_{model_type}.yaml"
+    )
+    return model_config
@@ -108,6 +108,7 @@ setup(
     entry_points={
         "console_scripts": [
             "anylabeling=anylabeling.app:main",
+            "anylabeling-batch=anylabeling.batch:main",
         ],
     },
 )
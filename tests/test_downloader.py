@@ -0,0 +1,180 @@
+import hashlib
+import os
+import random
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from anylabeling.services.auto_labeling import downloader
+from anylabeling.services.auto_labeling.downloader import (
+    DownloadCancelled,
+    DownloadError,
+    Downloader,
+)
+
+DATA = random.Random(0).randbytes(4500)
+SHA256 = hashlib.sha256(DATA).hexdigest()
+# Range of the request getting the size of the file
+PROBE_RANGE = "bytes=0-0"
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    """Serve DATA, with or without range requests"""
+
+    def do_GET(self):
+        server = self.server
+        range_header = self.headers.get("Range")
+        match = re.fullmatch(r"bytes=(\d+)-(\d+)", range_header or "")
+        with server.lock:
+            server.ranges.append(range_header)
+            # Close the connection in the middle of the body
+            truncate = server.truncate > 0 and range_header != PROBE_RANGE
+            if truncate:
+                server.truncate -= 1
+        if server.accept_ranges and match:
+            start, end = int(match[1]), int(match[2])
+            body = DATA[start : end + 1]
+            self.send_response(206)
+            self.send_header(
+                "Content-Range", f"bytes {start}-{end}/{len(DATA)}"
+            )
+        else:
+            body = DATA
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", '"v1"')
+        self.end_headers()
+        if truncate:
+            body = body[: len(body) // 2]
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FileHandler)
+    server.lock = threading.Lock()
+    server.ranges = []
+    server.accept_ranges = True
+    server.truncate = 0
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/model.onnx"
+    thread = threading.Thread(
+        target=server.serve_forever, args=(0.01,), daemon=True
+    )
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(Downloader, "CHUNK_SIZE", 1000)
+    monkeypatch.setattr(Downloader, "BLOCK_SIZE", 256)
+    # No waiting between retries
+    monkeypatch.setattr(downloader.time, "sleep", lambda seconds: None)
+
+
+def get_starts(ranges):
+    """Start offsets of the range requests, without the probe"""
+    return sorted(
+        int(re.match(r"bytes=(\d+)-", r)[1])
+        for r in ranges
+        if r and r != PROBE_RANGE
+    )
+
+
+def assert_downloaded(output_path):
+    with open(output_path, "rb") as f:
+        assert f.read() == DATA
+    assert not os.path.exists(output_path + ".part")
+    assert not os.path.exists(output_path + ".part.json")
+
+
+def test_download_chunks(server, tmp_path):
+    output_path = str(tmp_path / "model.onnx")
+    progress = []
+    Downloader(
+        num_connections=3, on_progress=lambda *args: progress.append(args)
+    ).download(server.url, output_path, sha256=SHA256)
+    assert_downloaded(output_path)
+    assert get_starts(server.ranges) == [0, 1000, 2000, 3000, 4000]
+    assert progress[-1] == (len(DATA), len(DATA))
+
+
+def test_download_without_ranges(server, tmp_path):
+    server.accept_ranges = False
+    output_path = str(tmp_path / "model.onnx")
+    progress = []
+    Downloader(on_progress=lambda *args: progress.append(args)).download(
+        server.url, output_path, sha256=SHA256
+    )
+    assert_downloaded(output_path)
+    assert server.ranges == [PROBE_RANGE, None]
+    assert progress[-1] == (len(DATA), len(DATA))
+
+
+def test_truncated_chunk_is_retried(server, tmp_path):
+    server.truncate = 1
+    output_path = str(tmp_path / "model.onnx")
+    Downloader(num_connections=1).download(
+        server.url, output_path, sha256=SHA256
+    )
+    assert_downloaded(output_path)
+    # The first chunk is resumed after the received half
+    assert get_starts(server.ranges) == [0, 500, 1000, 2000, 3000, 4000]
+
+
+def test_truncated_stream_is_retried(server, tmp_path):
+    server.accept_ranges = False
+    server.truncate = 1
+    output_path = str(tmp_path / "model.onnx")
+    Downloader().download(server.url, output_path, sha256=SHA256)
+    assert_downloaded(output_path)
+    assert server.ranges == [PROBE_RANGE, None, None]
+
+
+def test_too_many_retries(server, tmp_path):
+    server.truncate = 10
+    output_path = str(tmp_path / "model.onnx")
+    with pytest.raises(DownloadError):
+        Downloader(num_connections=1, max_retries=2).download(
+            server.url, output_path
+        )
+    assert not os.path.exists(output_path)
+
+
+def test_resume(server, tmp_path):
+    output_path = str(tmp_path / "model.onnx")
+    progress = []
+    with pytest.raises(DownloadCancelled):
+        Downloader(
+            num_connections=1,
+            on_progress=lambda *args: progress.append(args),
+            is_stopped=lambda: progress[-1][0] >= 2000,
+        ).download(server.url, output_path, sha256=SHA256)
+    assert os.path.isfile(output_path + ".part")
+    assert os.path.isfile(output_path + ".part.json")
+    assert not os.path.exists(output_path)
+
+    server.ranges.clear()
+    Downloader(num_connections=1).download(
+        server.url, output_path, sha256=SHA256
+    )
+    assert_downloaded(output_path)
+    # The first two chunks are not downloaded again
+    assert get_starts(server.ranges) == [2000, 3000, 4000]
+
+
+def test_checksum_mismatch(server, tmp_path):
+    output_path = str(tmp_path / "model.onnx")
+    with pytest.raises(DownloadError, match="Checksum mismatch"):
+        Downloader().download(server.url, output_path, sha256="0" * 64)
+    assert not os.path.exists(output_path)
+    assert not os.path.exists(output_path + ".part")
+    assert not os.path.exists(output_path + ".part.json")
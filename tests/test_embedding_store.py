@@ -0,0 +1,80 @@
+import os
+import time
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("onnxruntime")
+
+from anylabeling.services.auto_labeling.embedding_store import (  # noqa: E402
+    EmbeddingStore,
+)
+
+
+def create_store(tmp_path, max_size_mb=1):
+    return EmbeddingStore(
+        "sam", "encoder.onnx", max_size_mb, root=str(tmp_path / "store")
+    )
+
+
+@pytest.fixture
+def image_file(tmp_path):
+    image_file = tmp_path / "image.jpg"
+    image_file.write_bytes(b"image data")
+    return str(image_file)
+
+
+def get_embedding():
+    return {
+        "features": np.arange(16, dtype=np.float32).reshape(4, 4),
+        "original_size": (480, 640),
+    }
+
+
+def test_put_get(tmp_path, image_file):
+    store = create_store(tmp_path)
+    assert store.get(image_file) is None
+    store.put(image_file, get_embedding())
+    embedding = store.get(image_file)
+    np.testing.assert_array_equal(
+        embedding["features"], get_embedding()["features"]
+    )
+    assert embedding["original_size"] == (480, 640)
+    # Found by another store on the same folder
+    assert create_store(tmp_path).find(image_file)
+
+
+def test_put_written_by_another_process(tmp_path, image_file):
+    store = create_store(tmp_path)
+    other_store = create_store(tmp_path)
+    other_store.put(image_file, get_embedding())
+    assert not store.find(image_file)
+    store.put(image_file, get_embedding())
+    assert store.find(image_file)
+    assert store._total_size == other_store._total_size > 0
+
+
+def test_temporary_folders(tmp_path, image_file):
+    store = create_store(tmp_path)
+    new_tmp = os.path.join(store.root, ".new.tmp")
+    old_tmp = os.path.join(store.root, ".old.tmp")
+    os.makedirs(new_tmp)
+    os.makedirs(old_tmp)
+    old_time = time.time() - 2 * EmbeddingStore.TMP_MAX_AGE
+    os.utime(old_tmp, (old_time, old_time))
+    create_store(tmp_path)
+    # Only folders of interrupted writes are removed
+    assert os.path.isdir(new_tmp)
+    assert not os.path.exists(old_tmp)
+
+
+def test_max_size(tmp_path):
+    store = create_store(tmp_path, max_size_mb=0.0001)
+    image_files = []
+    for i in range(3):
+        image_file = tmp_path / f"image_{i}.jpg"
+        image_file.write_bytes(f"image {i}".encode())
+        image_files.append(str(image_file))
+        store.put(str(image_file), get_embedding())
+    # The most recent entry is always kept
+    assert [store.find(f) for f in image_files] == [False, False, True]
@@ -0,0 +1,71 @@
+from anylabeling.services.auto_labeling.lru_cache import LRUCache, get_nbytes
+
+
+class Array:
+    """Stand-in for an array with a size in bytes"""
+
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+
+
+def test_get_nbytes():
+    embedding = {"features": Array(100), "sizes": (Array(10), Array(5))}
+    assert get_nbytes(embedding) == 115
+    assert get_nbytes([embedding, Array(1)]) == 116
+    assert get_nbytes("not an array") == 0
+
+
+def test_max_items():
+    cache = LRUCache(maxsize=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    # "b" is the least recently used
+    assert not cache.find("b")
+    assert cache.find("a") and cache.find("c")
+    assert cache.stats()["evictions"] == 1
+
+
+def test_max_bytes():
+    cache = LRUCache(maxsize=None, max_bytes=250)
+    cache.put("a", Array(100))
+    cache.put("b", Array(100))
+    cache.put("c", Array(100))
+    assert not cache.find("a")
+    assert cache.nbytes == 200
+    # Replacing a value updates the size of the cache
+    cache.put("b", Array(50))
+    assert cache.nbytes == 150
+    assert cache.pop("c").nbytes == 100
+    assert cache.nbytes == 50
+
+
+def test_most_recent_item_is_kept():
+    cache = LRUCache(maxsize=None, max_bytes=10)
+    cache.put("a", Array(100))
+    assert cache.find("a")
+    cache.put("b", Array(100))
+    assert not cache.find("a") and cache.find("b")
+
+
+def test_resize():
+    cache = LRUCache(maxsize=None, max_bytes=None)
+    for key in "abcd":
+        cache.put(key, Array(100))
+    cache.resize(maxsize=None, max_bytes=200)
+    assert [k for k in "abcd" if cache.find(k)] == ["c", "d"]
+
+
+def test_stats():
+    cache = LRUCache(maxsize=1)
+    cache.put("a", Array(8))
+    cache.get("a")
+    cache.get("b")
+    assert cache.stats() == {
+        "items": 1,
+        "nbytes": 8,
+        "hits": 1,
+        "misses": 1,
+        "evictions": 0,
+    }
@@ -0,0 +1,69 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+
+from anylabeling.services.auto_labeling import ops  # noqa: E402
+
+BOXES = np.array(
+    [
+        [10, 10, 110, 110],
+        [12, 12, 112, 112],  # overlaps the first box
+        [200, 200, 300, 300],
+        [205, 195, 305, 295],  # overlaps the third box
+    ],
+    dtype=np.float32,
+)
+SCORES = np.array([0.9, 0.8, 0.7, 0.95], dtype=np.float32)
+CLASS_IDS = np.array([0, 1, 0, 0])
+
+
+@pytest.fixture(params=["cv2", "numpy"])
+def nms_backend(request, monkeypatch):
+    if request.param == "numpy":
+        monkeypatch.delattr(ops.cv2, "dnn")
+    return request.param
+
+
+def test_numpy_nms(nms_backend):
+    keep = ops.numpy_nms(BOXES, SCORES, 0.5)
+    assert keep.tolist() == [3, 0]
+
+
+def test_numpy_nms_empty(nms_backend):
+    keep = ops.numpy_nms(np.zeros((0, 4)), np.zeros((0,)), 0.5)
+    assert keep.shape == (0,)
+
+
+def test_numpy_nms_zero_scores(nms_backend):
+    # cv2.dnn drops boxes with a score of 0, they must be kept
+    keep = ops.numpy_nms(BOXES, np.array([0.0, 0.6, 0.5, 0.0]), 0.5)
+    assert keep.tolist() == [1, 2]
+
+
+def test_batched_nms_agnostic(nms_backend):
+    keep = ops.batched_nms(BOXES, SCORES, CLASS_IDS, 0.5, agnostic=True)
+    assert keep.tolist() == [3, 0]
+
+
+def test_batched_nms_by_class(nms_backend):
+    keep = ops.batched_nms(BOXES, SCORES, CLASS_IDS, 0.5)
+    # The second box is of another class than the first one
+    assert keep.tolist() == [3, 0, 1]
+
+
+def test_non_max_suppression():
+    # [x, y, w, h, objectness, class scores...]
+    prediction = np.array(
+        [
+            [
+                [60, 60, 100, 100, 0.9, 0.9, 0.1],
+                [62, 62, 100, 100, 0.8, 0.9, 0.1],
+                [250, 250, 100, 100, 0.85, 0.1, 0.9],
+            ]
+        ],
+        dtype=np.float32,
+    )
+    (output,) = ops.non_max_suppression(prediction, 0.25, 0.45)
+    assert output.shape == (2, 6)
+    assert output[:, 5].tolist() == [0, 1]